@@ -8,23 +8,75 @@
 ###  Non-standard packages needed: numpy                                                                             ###
 ###                                                                                                                  ###
 ###  Content:                                                                                                        ###
-###   The function in this module calculates the indices of the array boundaries depending on a domain and margin    ###
+###   The functions in this module calculate the indices of the array boundaries depending on a domain and margin    ###
+###    and the lat/lon box of a domain                                                                               ###
+###   The indices only depend on the lat/lon grid, so they are memoized per domain, margin and grid key and stored   ###
+###    in data/crop_indices.sqlite, a grid is only reduced once row block by row block without masked arrays         ###
 ###                                                                                                                  ###
 ###  Usage:                                                                                                          ###
 ###   This module here containes functions that have to be imported by another function or script                    ###
 ###                                                                                                                  ###
 ########################################################################################################################
 
+import os
+import json
+import sqlite3
+
 import numpy as np
 
 
+# crop indices of this process by memo key #
+
+crop_indices = dict()
+
+
 def crop_data(image_data, lats, lons, domain, margin_deg, verbose):
 
     if verbose:
         print('image_data:', image_data.shape)
         print('lats:', lats.shape)
         print('lons:', lons.shape)
-        print('----- mask out-of-domain pixels... -----')
+        print('----- find in-domain pixels... -----')
+
+    num_values_before = image_data.shape[0] * image_data.shape[1]
+
+
+    # reduce arrays to smallest possible, None is returned if no pixel is inside the domain #
+
+    crop_indices = calc_crop_indices(lats, lons, domain, margin_deg)
+    if crop_indices is None:
+        if verbose:
+            print('----- no pixel inside the domain -----')
+        return None
+
+    index_x_first, index_x_last, index_y_first, index_y_last = crop_indices
+
+    if verbose:
+        print('x subset:', index_x_first, index_x_last)
+        print('y subset:', index_y_first, index_y_last)
+
+        image_data = image_data[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
+        lats = lats[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
+        lons = lons[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
+
+        num_values_after = image_data.shape[0] * image_data.shape[1]
+
+        print('----- reduced arrays to {:.2f}%... -----'.format(\
+                100. * num_values_after / num_values_before))
+
+        print('image_data:', image_data.shape)
+        print('lats:', lats.shape)
+        print('lons:', lons.shape)
+
+    return index_x_first, index_x_last, index_y_first, index_y_last
+
+########################################################################################################################
+########################################################################################################################
+########################################################################################################################
+
+def get_domain_cutout(domain, margin_deg):
+
+    # returns the lat/lon box around a domain extended by margin_deg #
 
     cutout = dict()
     if domain['limits_type'] == 'radius':
@@ -38,53 +90,89 @@ def crop_data(image_data, lats, lons, domain, margin_deg, verbose):
         cutout['lon_max'] = float(np.where(cutout['lat_min'] <= -90 or cutout['lat_max'] >= 90, 180,
                                   domain['centerlon'] + domain['radius'] \
                                   / (111.2 * np.cos(domain['centerlat']*np.pi/180)) + margin_deg))
+    elif domain['limits_type'] == 'latlon':
+        cutout['lat_min'] = max(domain['lat_min'] - margin_deg, -90)
+        cutout['lat_max'] = min(domain['lat_max'] + margin_deg, 90)
+        cutout['lon_min'] = domain['lon_min'] - margin_deg
+        cutout['lon_max'] = domain['lon_max'] + margin_deg
     else:
         print('domain limits_type {} not supported yet!'.format(domain['limits_type']))
         exit()
 
-    lats = np.ma.masked_outside(lats, cutout['lat_min'], cutout['lat_max'])
-    lons = np.ma.masked_outside(lons, cutout['lon_min'], cutout['lon_max'])
-
-
-    # combine all three masks #
-
-    image_data = np.ma.masked_where(lats.mask==True, image_data)
-    image_data = np.ma.masked_where(lons.mask==True, image_data)
-    lats = np.ma.masked_where(image_data.mask==True, lats)
-    lons = np.ma.masked_where(image_data.mask==True, lons)
+    return cutout
 
-    #print_masked_array_stats(image_data, 'image_data')
-
-    num_values_before = image_data.shape[0] * image_data.shape[1]
-
-
-    # reduce arrays to smallest possible #
-
-    x_mask = np.ma.all(image_data.mask,0)
-    y_mask = np.ma.all(image_data.mask,1)
+########################################################################################################################
+#  Crop index service                                                                                                  #
+########################################################################################################################
 
-    index_x_first = np.where(x_mask==False)[0][0]
-    index_x_last = np.where(x_mask==False)[0][-1]
-    index_y_first = np.where(y_mask==False)[0][0]
-    index_y_last = np.where(y_mask==False)[0][-1]
+def calc_crop_indices(lats, lons, domain, margin_deg, grid_key = None, base_path = None, num_block_rows = 256):
+
+    # returns index_x_first, index_x_last, index_y_first, index_y_last (inclusive) of the smallest box containing #
+    #  all pixels inside the domain cutout or None if no pixel is inside, masked or nan pixels are outside #
+    #  grid_key has to identify the lat/lon grid (e.g. its file grid and slice), with a grid_key the indices are #
+    #  memoized in this process and, if also base_path is given, stored in data/crop_indices.sqlite for later runs #
+
+    if grid_key is not None:
+        memo_key = '{}|{}|{:.6f}'.format(grid_key, json.dumps(domain, sort_keys = True), margin_deg)
+        if memo_key in crop_indices:
+            return crop_indices[memo_key]
+        if base_path is not None:
+            connection = open_crop_indices(base_path)
+            row = connection.execute('SELECT x_first, x_last, y_first, y_last FROM crop_indices WHERE key = ?',
+                                     (memo_key,)).fetchone()
+            connection.close()
+            if row is not None:
+                crop_indices[memo_key] = None if row[0] is None else tuple(row)
+                return crop_indices[memo_key]
+
+    cutout = get_domain_cutout(domain, margin_deg)
+
+
+    # any() over the rows and columns of one block at a time, only boolean vectors of the grid size are kept #
+
+    rows_inside = np.zeros(np.shape(lats)[0], dtype = bool)
+    columns_inside = np.zeros(np.shape(lats)[1], dtype = bool)
+
+    with np.errstate(invalid = 'ignore'):
+        for row_first in range(0, np.shape(lats)[0], num_block_rows):
+            lats_block = np.ma.filled(lats[row_first:row_first+num_block_rows], np.nan)
+            lons_block = np.ma.filled(lons[row_first:row_first+num_block_rows], np.nan)
+            inside = (lats_block >= cutout['lat_min']) & (lats_block <= cutout['lat_max']) \
+                     & (lons_block >= cutout['lon_min']) & (lons_block <= cutout['lon_max'])
+            rows_inside[row_first:row_first+num_block_rows] = np.any(inside, 1)
+            columns_inside |= np.any(inside, 0)
+
+    if np.any(rows_inside):
+        indices = (int(np.flatnonzero(columns_inside)[0]), int(np.flatnonzero(columns_inside)[-1]),
+                   int(np.flatnonzero(rows_inside)[0]), int(np.flatnonzero(rows_inside)[-1]))
+    else:
+        indices = None
 
-    if verbose:
-        print('x subset:', index_x_first, index_x_last)
-        print('y subset:', index_y_first, index_y_last)
+    if grid_key is not None:
+        crop_indices[memo_key] = indices
+        if base_path is not None:
+            connection = open_crop_indices(base_path)
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO crop_indices VALUES (?, ?, ?, ?, ?)',
+                                   (memo_key, *(indices or (None, None, None, None))))
+            connection.close()
 
-        image_data = image_data[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
-        lats = lats[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
-        lons = lons[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
+    return indices
 
-        num_values_after = image_data.shape[0] * image_data.shape[1]
+########################################################################################################################
 
-        print('----- reduced arrays to {:.2f}%... -----'.format(\
-                100. * num_values_after / num_values_before))
+def open_crop_indices(base_path):
 
-        #print_masked_array_stats(image_data, 'image_data')
+    # every caller opens its own connection, sqlite connections can not be shared between threads #
 
-        print('image_data:', image_data.shape)
-        print('lats:', lats.shape)
-        print('lons:', lons.shape)
+    os.makedirs(base_path + 'data', exist_ok = True)
+    connection = sqlite3.connect(base_path + 'data/crop_indices.sqlite', timeout = 60)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('''CREATE TABLE IF NOT EXISTS crop_indices (
+                              key TEXT PRIMARY KEY,
+                              x_first INTEGER,
+                              x_last INTEGER,
+                              y_first INTEGER,
+                              y_last INTEGER)''')
 
-    return index_x_first, index_x_last, index_y_first, index_y_last
+    return connection
@@ -5,18 +5,21 @@
 ###                                                                                                                  ###
 ###  Author: Marco Wurth, July 2021                                                                                  ###
 ###  Tested with Python 3.9 and Fedora Linux                                                                         ###
-###  Non-standard packages needed: None                                                                              ###
+###  Non-standard packages needed: numpy                                                                             ###
 ###                                                                                                                  ###
 ###  Content:                                                                                                        ###
 ###   The function in this module serves as a library for different domains that I used defined by a center          ###
-###   coordinate and a radius in km around it                                                                        ###
+###   coordinate and a radius in km around it or by a lat/lon box                                                    ###
 ###   Feel free to modify or add more domains!                                                                       ###
+###   The second function defines the crop regions of the downloaded files that are made up of domains               ###
 ###                                                                                                                  ###
 ###  Usage:                                                                                                          ###
 ###   This module here containes functions that have to be imported by another function or script                    ###
 ###                                                                                                                  ###
 ########################################################################################################################
 
+import numpy as np
+
 
 def get_image_domain(domain_name):
 
@@ -56,8 +59,47 @@ def get_image_domain(domain_name):
         domain =   dict(name = domain_name, limits_type = 'radius',
                         centerlat = -36.0, centerlon = -66.0, radius = 500)
 
+    #elif domain_name == 'Atacama_Chile_Coast_box':
+    #    domain =   dict(name = domain_name, limits_type = 'latlon',
+    #                    lat_min = -26.0, lat_max = -18.0, lon_min = -72.0, lon_max = -69.0)
+
     else:
         print('domain unknown:', domain_name)
         exit()
 
+
+    # lat/lon box domains also get the center and the radius of the box, the plot settings depend on them #
+
+    if domain['limits_type'] == 'latlon':
+        domain['centerlat'] = (domain['lat_min'] + domain['lat_max']) / 2
+        domain['centerlon'] = (domain['lon_min'] + domain['lon_max']) / 2
+        domain['radius'] = max(domain['lat_max'] - domain['lat_min'],
+                               (domain['lon_max'] - domain['lon_min']) * np.cos(domain['centerlat']*np.pi/180)) \
+                           * 111.2 / 2
+
     return domain
+
+########################################################################################################################
+########################################################################################################################
+########################################################################################################################
+
+def get_region_domain_names(region):
+
+    # returns the domains a domain-based crop region of the downloaded files has to contain #
+    #  the crop box of such a region is the union of the fixed grid boxes of these domains #
+
+    if region == 'atacama_domains':
+        domain_names = ['Atacama_Peru_West', 'Atacama_Peru_East', 'Atacama_Chile_North',
+                        'Atacama_Chile_Central', 'Atacama_Chile_South']
+
+    elif region == 'atacama_squared_domain':
+        domain_names = ['Atacama_Squared']
+
+    elif region == 'argentina_domains':
+        domain_names = ['Argentina_Central', 'Argentina_Central_cerca']
+
+    else:
+        print('region unknown:', region)
+        exit()
+
+    return domain_names
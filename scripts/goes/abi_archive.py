@@ -0,0 +1,362 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This module uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: None                                                                              ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   This module keeps a SQLite manifest of the local ABI archive in data/ABI/GOES-16/<product>/archive.sqlite      ###
+###   Every completed download is recorded with product, band, scan time, region, size and sha256 checksum, so       ###
+###    reruns can skip finished files and only missing or corrupt files are downloaded again                         ###
+###   The manifest is also the index of the archive: files from before the manifest are added by a one-time scan of  ###
+###    their band folder and the load functions look up files and time ranges with indexed queries                   ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   This module here containes functions that have to be imported by another function or script                    ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import os
+import re
+import time
+import datetime
+import hashlib
+import sqlite3
+
+
+# pattern of the regional and mesoscale file names in the band folders, full-disk files end with _region-<region> #
+
+filename_pattern = re.compile(r'ABI-(L2-CMIP[FM]\d?)-M\dC(\d{2})_G16_s(\d{11})\d{3}_e\d{14}_c\d{14}'
+                              r'(?:_region-(.+))?\.nc$')
+
+# files in temp and .part files are only orphans of interrupted runs if they were not written to for this long #
+
+orphan_min_age = datetime.timedelta(hours = 1)
+
+########################################################################################################################
+#  Database handling                                                                                                   #
+########################################################################################################################
+
+def get_archive_path(base_path, product_fullname):
+
+    # cut the mesoscale sector number, both sectors share one folder #
+
+    return dict(base = base_path,
+                data = 'data/ABI/GOES-16/{}/'.format(product_fullname[:8]))
+
+########################################################################################################################
+
+def open_archive(base_path, product_fullname):
+
+    # every caller opens its own connection, sqlite connections can not be shared between threads #
+
+    path = get_archive_path(base_path, product_fullname)
+
+    connection = sqlite3.connect(path['base'] + path['data'] + 'archive.sqlite', timeout = 60)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('''CREATE TABLE IF NOT EXISTS files (
+                              product TEXT NOT NULL,
+                              band INTEGER NOT NULL,
+                              scan_start TEXT NOT NULL,
+                              region TEXT NOT NULL,
+                              filename TEXT NOT NULL,
+                              size INTEGER NOT NULL,
+                              sha256 TEXT NOT NULL,
+                              completed TEXT NOT NULL,
+                              PRIMARY KEY (product, band, scan_start, region))''')
+    connection.execute('''CREATE TABLE IF NOT EXISTS indexed_folders (
+                              band INTEGER PRIMARY KEY,
+                              folder_mtime REAL NOT NULL)''')
+
+    return connection
+
+########################################################################################################################
+
+def get_archive_key(product_fullname, band, date, region):
+
+    # scan times are stored with minute precision like the dates used for downloading and plotting #
+    #  mesoscale sector files are not cut, so their region is always 'sector' #
+
+    if product_fullname != 'L2-CMIPF':
+        region = 'sector'
+
+    return product_fullname, band, date.strftime('%Y-%m-%dT%H:%M'), region
+
+########################################################################################################################
+
+def calc_file_checksum(filepath):
+
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1024**2), b''):
+            sha256.update(block)
+
+    return sha256.hexdigest()
+
+########################################################################################################################
+
+def update_folder_mtime(connection, folder, band):
+
+    # store the new mtime of an already indexed band folder after the archive functions changed it themselves, so #
+    #  update_archive_index only scans the folder again for files added or removed from outside #
+
+    connection.execute('UPDATE indexed_folders SET folder_mtime = ? WHERE band = ?', (os.stat(folder).st_mtime, band))
+
+    return
+
+########################################################################################################################
+#  Manifest                                                                                                            #
+########################################################################################################################
+
+def record_archive_file(base_path, product_fullname, band, date, region, filename):
+
+    # record a completed file of the band folder with its size and checksum #
+
+    path = get_archive_path(base_path, product_fullname)
+    folder = path['base'] + path['data'] + 'b{:02d}/'.format(band)
+
+    connection = open_archive(base_path, product_fullname)
+    with connection:
+        connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (*get_archive_key(product_fullname, band, date, region), filename,
+                            os.path.getsize(folder + filename), calc_file_checksum(folder + filename),
+                            datetime.datetime.utcnow().isoformat()))
+        update_folder_mtime(connection, folder, band)
+    connection.close()
+
+    return
+
+########################################################################################################################
+
+def find_completed_file(base_path, product_fullname, band, date, region, verify):
+
+    # returns the filename of a completed file or None if it has to be downloaded (again) #
+    #  verify = 'size' compares the file size, verify = 'checksum' also the sha256 checksum #
+    #  files not in the manifest are looked up once more after the band folder was indexed #
+    #  missing or corrupt files are removed from the manifest and the band folder #
+
+    connection = open_archive(base_path, product_fullname)
+    query = 'SELECT filename, size, sha256 FROM files WHERE product = ? AND band = ? AND scan_start = ? AND region = ?'
+    query_args = get_archive_key(product_fullname, band, date, region)
+
+    row = connection.execute(query, query_args).fetchone()
+    if row is None:
+        update_archive_index(base_path, product_fullname, band)
+        row = connection.execute(query, query_args).fetchone()
+    if row is None:
+        connection.close()
+        return None
+
+    filename, size, sha256 = row
+    path = get_archive_path(base_path, product_fullname)
+    filepath = path['base'] + path['data'] + 'b{:02d}/'.format(band) + filename
+
+    file_is_complete = os.path.isfile(filepath) and os.path.getsize(filepath) == size
+    if file_is_complete and verify == 'checksum':
+
+        # files added by the folder scan have no checksum yet, it is calculated and stored on their first check #
+        #  no matter if the folder was indexed above or by a load function before #
+
+        if sha256 == '':
+            with connection:
+                connection.execute('UPDATE files SET sha256 = ? '
+                                   'WHERE product = ? AND band = ? AND scan_start = ? AND region = ?',
+                                   (calc_file_checksum(filepath), *query_args))
+        else:
+            file_is_complete = calc_file_checksum(filepath) == sha256
+
+    if not file_is_complete:
+        print('corrupt or missing archive file, will be downloaded again:', filename)
+        if os.path.isfile(filepath):
+            os.remove(filepath)
+        with connection:
+            connection.execute('DELETE FROM files WHERE product = ? AND band = ? AND scan_start = ? AND region = ?',
+                               query_args)
+            update_folder_mtime(connection, os.path.dirname(filepath), band)
+        filename = None
+
+    connection.close()
+
+    return filename
+
+########################################################################################################################
+
+def remove_archive_file(base_path, filepath):
+
+    # remove a deleted file data/ABI/GOES-16/<product>/bXX/<filename> from the manifest of its product #
+
+    product_folder, band_folder, filename = filepath.split('/')[-3:]
+
+    connection = open_archive(base_path, product_folder)
+    with connection:
+        connection.execute('DELETE FROM files WHERE band = ? AND filename = ?', (int(band_folder[1:]), filename))
+        if os.path.isdir(base_path + os.path.dirname(filepath)):
+            update_folder_mtime(connection, base_path + os.path.dirname(filepath), int(band_folder[1:]))
+    connection.close()
+
+    return
+
+########################################################################################################################
+
+def find_completed_scans(base_path, product_fullname, region, date_first, date_last):
+
+    # returns the set of (band, scan start) keys of all files in the manifest between date_first and date_last #
+    #  one query for the planning of long jobs, the files themselves are not verified here #
+
+    region = get_archive_key(product_fullname, 1, date_first, region)[3]
+
+    connection = open_archive(base_path, product_fullname)
+    rows = connection.execute('SELECT band, scan_start FROM files '
+                              'WHERE product = ? AND region = ? AND scan_start >= ? AND scan_start <= ?',
+                              (product_fullname, region, date_first.strftime('%Y-%m-%dT%H:%M'),
+                               date_last.strftime('%Y-%m-%dT%H:%M'))).fetchall()
+    connection.close()
+
+    return set(rows)
+
+########################################################################################################################
+
+def cleanup_archive_orphans(base_path, product_fullname):
+
+    # remove full-disk and regional files left in temp by interrupted runs and partially written .part files #
+    #  only files older than orphan_min_age are removed, so downloads of other runs of this product are kept #
+
+    path = get_archive_path(base_path, product_fullname)
+
+    candidate_filepaths = []
+    if os.path.isdir(path['base'] + path['data'] + 'temp'):
+        for filename in os.listdir(path['base'] + path['data'] + 'temp'):
+            if filename.startswith('ABI-'):
+                candidate_filepaths.append(path['base'] + path['data'] + 'temp/' + filename)
+    for band in range(1, 16+1):
+        band_folder = path['base'] + path['data'] + 'b{:02d}'.format(band)
+        if os.path.isdir(band_folder):
+            for filename in os.listdir(band_folder):
+                if filename.endswith('.part'):
+                    candidate_filepaths.append(band_folder + '/' + filename)
+
+    # files can be renamed or removed by another run in the meantime #
+
+    mtime_max = time.time() - orphan_min_age.total_seconds()
+    orphan_filepaths = []
+    for filepath in candidate_filepaths:
+        try:
+            if os.stat(filepath).st_mtime < mtime_max:
+                os.remove(filepath)
+                orphan_filepaths.append(filepath)
+        except FileNotFoundError:
+            pass
+    if len(orphan_filepaths) > 0:
+        print('removed {:d} orphaned files of interrupted downloads'.format(len(orphan_filepaths)))
+
+    return len(orphan_filepaths)
+
+########################################################################################################################
+#  Index                                                                                                               #
+########################################################################################################################
+
+def index_archive_folder(base_path, product_fullname, band):
+
+    # add all files of a band folder that are not in the manifest yet, e.g. files downloaded before the manifest #
+    #  existed or copied from another archive, their checksum is left empty, returns the number of added files #
+
+    path = get_archive_path(base_path, product_fullname)
+    folder = path['base'] + path['data'] + 'b{:02d}/'.format(band)
+    if not os.path.isdir(folder):
+        return 0
+    folder_mtime = os.stat(folder).st_mtime
+
+    connection = open_archive(base_path, product_fullname)
+    known_filenames = set([row[0] for row in connection.execute('SELECT filename FROM files WHERE band = ?', (band,))])
+
+    new_files = []
+    for filename in os.listdir(folder):
+        match = filename_pattern.match(filename)
+        if filename in known_filenames or match is None or int(match.group(2)) != band:
+            continue
+        file_product, file_band, scan_start, region = match.groups()
+        if file_product == 'L2-CMIPF' and region is None:
+            continue
+        stat = os.stat(folder + filename)
+        new_files.append((*get_archive_key(file_product, band, datetime.datetime.strptime(scan_start, '%Y%j%H%M'),
+                                           region), filename, stat.st_size, '',
+                          datetime.datetime.utcfromtimestamp(stat.st_mtime).isoformat()))
+
+    with connection:
+        connection.executemany('INSERT OR IGNORE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)', new_files)
+        connection.execute('INSERT OR REPLACE INTO indexed_folders VALUES (?, ?)', (band, folder_mtime))
+    connection.close()
+
+    return len(new_files)
+
+########################################################################################################################
+
+def update_archive_index(base_path, product_fullname, band):
+
+    # scan the band folder only if it was never scanned or files were added or removed since the last scan #
+
+    path = get_archive_path(base_path, product_fullname)
+    folder = path['base'] + path['data'] + 'b{:02d}/'.format(band)
+    if not os.path.isdir(folder):
+        return
+
+    connection = open_archive(base_path, product_fullname)
+    row = connection.execute('SELECT folder_mtime FROM indexed_folders WHERE band = ?', (band,)).fetchone()
+    connection.close()
+
+    if row is None or row[0] != os.stat(folder).st_mtime:
+        index_archive_folder(base_path, product_fullname, band)
+
+    return
+
+########################################################################################################################
+
+def find_archive_file(base_path, product_fullname, band, date, region):
+
+    # returns the filename of the file with the scan start (cut to minutes) of date or None if there is none #
+    #  files deleted outside of the archive functions are removed from the index #
+    #  the band folder is only scanned on a miss if it changed from outside, the archive functions keep the stored #
+    #  folder mtime current, so lookups while downloads are running stay index lookups #
+
+    connection = open_archive(base_path, product_fullname)
+    query = 'SELECT filename FROM files WHERE product = ? AND band = ? AND scan_start = ? AND region = ?'
+    query_args = get_archive_key(product_fullname, band, date, region)
+
+    row = connection.execute(query, query_args).fetchone()
+    if row is None:
+        update_archive_index(base_path, product_fullname, band)
+        row = connection.execute(query, query_args).fetchone()
+
+    path = get_archive_path(base_path, product_fullname)
+    if row is not None and not os.path.isfile(path['base'] + path['data'] + 'b{:02d}/'.format(band) + row[0]):
+        with connection:
+            connection.execute('DELETE FROM files WHERE product = ? AND band = ? AND scan_start = ? AND region = ?',
+                               query_args)
+        row = None
+    connection.close()
+
+    if row is None:
+        return None
+
+    return row[0]
+
+########################################################################################################################
+
+def find_archive_files(base_path, product_fullname, band, region, date_first, date_last):
+
+    # returns scan start and filename of all files between date_first and date_last (inclusive) sorted by time #
+
+    update_archive_index(base_path, product_fullname, band)
+
+    product_fullname, band, scan_first, region = get_archive_key(product_fullname, band, date_first, region)
+    scan_last = date_last.strftime('%Y-%m-%dT%H:%M')
+
+    connection = open_archive(base_path, product_fullname)
+    rows = connection.execute('SELECT scan_start, filename FROM files WHERE product = ? AND band = ? '
+                              'AND scan_start >= ? AND scan_start <= ? AND region = ? ORDER BY scan_start',
+                              (product_fullname, band, scan_first, scan_last, region)).fetchall()
+    connection.close()
+
+    return [(datetime.datetime.fromisoformat(scan_start), filename) for scan_start, filename in rows]
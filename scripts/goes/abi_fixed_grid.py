@@ -0,0 +1,312 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This module uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: numpy                                                                             ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   This module contains the geometry of the ABI fixed grid: the scan angle grids of the 0.5km, 1km and 2km        ###
+###    bands and the projection of geographical coordinates into scan angles and back (GOES-R PUG Vol. 3, 4.2.8)     ###
+###   The grids of the 0.5km, 1km and 2km bands are integer subdivisions of each other, so bands are resampled in    ###
+###    index space by block replication and block mean/min/max without any geolocation                               ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   This module here containes functions that have to be imported by another function or script                    ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import warnings
+
+import numpy as np
+
+
+# projection attributes of GOES-16 as given in the goes_imager_projection variable of the ABI files #
+
+goes16_projection = dict(perspective_point_height = 35786023.0,
+                         semi_major_axis = 6378137.0,
+                         semi_minor_axis = 6356752.31414,
+                         longitude_of_projection_origin = -75.0)
+
+########################################################################################################################
+#  Fixed grid definition                                                                                               #
+########################################################################################################################
+
+def get_fixed_grid_info(resolution_nadir):
+
+    # returns scan angle of the first pixel center, scan angle increment and number of pixels of the full disk grid #
+    #  x increases from west to east, y decreases from north to south #
+
+    if resolution_nadir == 2.0:
+        grid = dict(x_first = -0.151844, y_first = 0.151844, step = 56e-6, num_pixels = 5424)
+    elif resolution_nadir == 1.0:
+        grid = dict(x_first = -0.151858, y_first = 0.151858, step = 28e-6, num_pixels = 10848)
+    elif resolution_nadir == 0.5:
+        grid = dict(x_first = -0.151865, y_first = 0.151865, step = 14e-6, num_pixels = 21696)
+
+    return grid
+
+########################################################################################################################
+#  Forward projection                                                                                                  #
+########################################################################################################################
+
+def calc_scan_angles_from_latlon(lats, lons, projection = goes16_projection):
+
+    # returns the scan angles x, y in radians of geodetic coordinates in degrees and a mask of the points visible #
+    #  from the satellite, invisible points get nan #
+
+    r_eq = projection['semi_major_axis']
+    r_pol = projection['semi_minor_axis']
+    H = projection['perspective_point_height'] + r_eq
+    e2 = 1 - r_pol**2 / r_eq**2
+
+    lats = np.radians(np.asarray(lats, dtype = np.float64))
+    lons = np.radians(np.asarray(lons, dtype = np.float64))
+    lon_0 = np.radians(projection['longitude_of_projection_origin'])
+
+    lats_c = np.arctan(r_pol**2 / r_eq**2 * np.tan(lats))
+    r_c = r_pol / np.sqrt(1 - e2 * np.cos(lats_c)**2)
+    s_x = H - r_c * np.cos(lats_c) * np.cos(lons - lon_0)
+    s_y = -r_c * np.cos(lats_c) * np.sin(lons - lon_0)
+    s_z = r_c * np.sin(lats_c)
+
+    visible = H * (H - s_x) >= s_y**2 + r_eq**2 / r_pol**2 * s_z**2
+
+    x = np.where(visible, np.arcsin(-s_y / np.sqrt(s_x**2 + s_y**2 + s_z**2)), np.nan)
+    y = np.where(visible, np.arctan(s_z / s_x), np.nan)
+
+    return x, y, visible
+
+########################################################################################################################
+
+def calc_latlon_box_scan_angle_bounds(lat_min, lat_max, lon_min, lon_max, num_samples = 200,
+                                      projection = goes16_projection):
+
+    # returns the scan angle bounds x_min, x_max, y_min, y_max of a lat/lon box or None if any part of the box is #
+    #  not visible from the satellite, the scan angles have no extrema inside the box so its edges are sampled only #
+
+    edge_lats = np.linspace(lat_min, lat_max, num_samples)
+    edge_lons = np.linspace(lon_min, lon_max, num_samples)
+    lats = np.concatenate([edge_lats, edge_lats, np.full(num_samples, lat_min), np.full(num_samples, lat_max)])
+    lons = np.concatenate([np.full(num_samples, lon_min), np.full(num_samples, lon_max), edge_lons, edge_lons])
+
+    x, y, visible = calc_scan_angles_from_latlon(lats, lons, projection)
+    if not np.all(visible):
+        return None
+
+    return np.min(x), np.max(x), np.min(y), np.max(y)
+
+########################################################################################################################
+
+def calc_latlon_box_index_bounds(lat_min, lat_max, lon_min, lon_max, resolution_nadir, num_samples = 200,
+                                 projection = goes16_projection):
+
+    # returns the full disk index bounds y_min, y_max, x_min, x_max (exclusive) of the smallest fixed grid box #
+    #  containing a lat/lon box, if any part of the box is not visible from the satellite the full disk is returned #
+
+    grid = get_fixed_grid_info(resolution_nadir)
+
+    bounds = calc_latlon_box_scan_angle_bounds(lat_min, lat_max, lon_min, lon_max, num_samples, projection)
+    if bounds is None:
+        return 0, grid['num_pixels'], 0, grid['num_pixels']
+    x_bound_min, x_bound_max, y_bound_min, y_bound_max = bounds
+
+    x_min = int(np.floor((x_bound_min - grid['x_first']) / grid['step']))
+    x_max = int(np.ceil((x_bound_max - grid['x_first']) / grid['step'])) + 1
+    y_min = int(np.floor((grid['y_first'] - y_bound_max) / grid['step']))
+    y_max = int(np.ceil((grid['y_first'] - y_bound_min) / grid['step'])) + 1
+
+    return max(y_min, 0), min(y_max, grid['num_pixels']), max(x_min, 0), min(x_max, grid['num_pixels'])
+
+########################################################################################################################
+
+def calc_latlon_box_vector_index_bounds(x, y, lat_min, lat_max, lon_min, lon_max, num_samples = 200,
+                                        projection = goes16_projection):
+
+    # returns the index bounds y_first, y_last, x_first, x_last (inclusive) of the scan angle vectors x (west to #
+    #  east) and y (north to south) of a file containing a lat/lon box, padded by one pixel on every side #
+    #  returns None if any part of the box is not visible or the box doesn't overlap the file #
+
+    bounds = calc_latlon_box_scan_angle_bounds(lat_min, lat_max, lon_min, lon_max, num_samples, projection)
+    if bounds is None:
+        return None
+    x_bound_min, x_bound_max, y_bound_min, y_bound_max = bounds
+
+    x_first = max(int(np.searchsorted(x, x_bound_min)) - 2, 0)
+    x_last = min(int(np.searchsorted(x, x_bound_max)) + 1, len(x) - 1)
+    y_first = max(int(np.searchsorted(-np.asarray(y), -y_bound_max)) - 2, 0)
+    y_last = min(int(np.searchsorted(-np.asarray(y), -y_bound_min)) + 1, len(y) - 1)
+
+    if x_first > x_last or y_first > y_last:
+        return None
+
+    return y_first, y_last, x_first, x_last
+
+########################################################################################################################
+
+def calc_pixel_size(lat, lon, resolution_nadir, projection = goes16_projection):
+
+    # returns the size in km of a fixed grid pixel at a geographical location, the larger of its north-south and #
+    #  east-west extent, or resolution_nadir if the location is not visible from the satellite #
+
+    grid = get_fixed_grid_info(resolution_nadir)
+
+    x, y, visible = calc_scan_angles_from_latlon([lat, lat + 1 / 111.2, lat],
+                                                 [lon, lon, lon + 1 / (111.2 * np.cos(np.radians(lat)))], projection)
+    if not np.all(visible):
+        return resolution_nadir
+
+    km_per_step_north = grid['step'] / np.hypot(x[1] - x[0], y[1] - y[0])
+    km_per_step_east = grid['step'] / np.hypot(x[2] - x[0], y[2] - y[0])
+
+    return float(max(km_per_step_north, km_per_step_east, resolution_nadir))
+
+########################################################################################################################
+#  Inverse projection                                                                                                  #
+########################################################################################################################
+
+def calc_latlon_from_scan_angles(x, y, projection = goes16_projection, dtype = np.float32, num_block_rows = 256,
+                                 valid_only = True, lats = None, lons = None):
+
+    # returns the lat/lon grids (y, x) in degrees of the scan angle vectors x, y in radians, off-disk pixels are nan #
+    #  all lengths are normalized by the distance H of the satellite from the earth center, the discriminant of the #
+    #  PUG equations is expanded so that no terms of order H**2 cancel and the distance r_s is calculated with the #
+    #  cancellation-free form of the smaller quadratic root c / (-b/2 + sqrt(discriminant)), so float32 is enough #
+    #  the grids are calculated in blocks of num_block_rows rows from the 1d sin/cos vectors without meshgrids, #
+    #  with valid_only only the columns of every block that contain earth pixels are calculated #
+    #  lats and lons can be given as output arrays (e.g. memory-mapped files) to write the grids into #
+
+    if projection.get('sweep_angle_axis', 'x') != 'x':
+        print('sweep angle axis {} not supported yet!'.format(projection['sweep_angle_axis']))
+        exit()
+
+    r_eq = projection['semi_major_axis']
+    r_pol = projection['semi_minor_axis']
+    H = projection['perspective_point_height'] + r_eq
+    r_eq_norm2 = (r_eq / H)**2
+    axes_ratio2 = r_eq**2 / r_pol**2
+    lon_0 = projection['longitude_of_projection_origin']
+
+    x = np.asarray(x, dtype = np.float64)
+    y = np.asarray(y, dtype = np.float64)
+    sin_x, cos_x = np.sin(x).astype(dtype), np.cos(x).astype(dtype)
+    sin_y, cos_y = np.sin(y).astype(dtype), np.cos(y).astype(dtype)
+
+    if lats is None:
+        lats = np.empty((y.size, x.size), dtype = dtype)
+    if lons is None:
+        lons = np.empty((y.size, x.size), dtype = dtype)
+
+    cos_x2 = cos_x * cos_x
+
+    for row_first in range(0, y.size, num_block_rows):
+        rows = slice(row_first, min(row_first + num_block_rows, y.size))
+        lats[rows] = np.nan
+        lons[rows] = np.nan
+
+        discriminant = dtype(r_eq_norm2) * cos_x2 * (cos_y[rows, None] * cos_y[rows, None]) \
+                       - dtype(1 - r_eq_norm2) * (sin_x * sin_x + dtype(axes_ratio2) * cos_x2
+                                                  * (sin_y[rows, None] * sin_y[rows, None]))
+        columns = slice(None)
+        if valid_only:
+            valid_columns = np.nonzero(np.any(discriminant >= 0, axis = 0))[0]
+            if valid_columns.size == 0:
+                continue
+            columns = slice(valid_columns[0], valid_columns[-1] + 1)
+            discriminant = discriminant[:, columns]
+
+        with np.errstate(invalid = 'ignore'):
+            cos_x_cos_y = cos_x[None, columns] * cos_y[rows, None]
+            r_s = dtype(1 - r_eq_norm2) / (cos_x_cos_y + np.sqrt(discriminant))
+            s_x = r_s * cos_x_cos_y
+            s_y = -r_s * sin_x[None, columns]
+            s_z = r_s * cos_x[None, columns] * sin_y[rows, None]
+
+            lats[rows, columns] = np.degrees(np.arctan(dtype(axes_ratio2) * s_z / np.hypot(1 - s_x, s_y)))
+            lons[rows, columns] = lon_0 - np.degrees(np.arctan(s_y / (1 - s_x)))
+
+    return lats, lons
+
+########################################################################################################################
+#  Resampling in index space                                                                                           #
+########################################################################################################################
+
+def calc_block_indices(coord_fine, coord_coarse):
+
+    # returns the integer factor between two scan angle vectors and for every coarse pixel the indices of its factor #
+    #  fine pixels as array (coarse pixels, factor), -1 where a fine pixel is not in coord_fine #
+    #  returns None, None if the pixels are no integer subdivisions or the blocks are not aligned #
+
+    if len(coord_fine) < 2 or len(coord_coarse) < 2:
+        return None, None
+
+    step_fine = (coord_fine[-1] - coord_fine[0]) / (len(coord_fine) - 1)
+    step_coarse = (coord_coarse[-1] - coord_coarse[0]) / (len(coord_coarse) - 1)
+    factor = int(round(step_coarse / step_fine))
+    if factor < 1 or abs(step_coarse / step_fine - factor) > 1e-3:
+        return None, None
+
+    # position of the first fine pixel in the first coarse pixel within coord_fine #
+
+    position = (coord_coarse[0] - coord_fine[0]) / step_fine - (factor - 1) / 2
+    index_first = int(round(position))
+    if abs(position - index_first) > 0.01:
+        return None, None
+
+    indices = index_first + factor * np.arange(len(coord_coarse))[:, None] + np.arange(factor)[None, :]
+    indices[(indices < 0) | (indices >= len(coord_fine))] = -1
+
+    return factor, indices
+
+########################################################################################################################
+
+def upsample_blocks(array, x, y, x_fine, y_fine):
+
+    # returns the array on the grid of the finer scan angle vectors x_fine, y_fine by block replication, #
+    #  fine pixels outside the array are nan, returns None if the grids are not aligned #
+
+    factor_x, indices_x = calc_block_indices(x_fine, x)
+    factor_y, indices_y = calc_block_indices(y_fine, y)
+    if indices_x is None or indices_y is None:
+        return None
+
+    # coarse index of every fine pixel, -1 picks the nan row and column appended to the array #
+
+    coarse_x = np.full(len(x_fine), -1)
+    coarse_y = np.full(len(y_fine), -1)
+    coarse_x[indices_x[indices_x >= 0]] = np.nonzero(indices_x >= 0)[0]
+    coarse_y[indices_y[indices_y >= 0]] = np.nonzero(indices_y >= 0)[0]
+
+    array_padded = np.pad(np.asarray(array, dtype = np.float32), ((0, 1), (0, 1)), constant_values = np.nan)
+
+    return array_padded[coarse_y][:, coarse_x]
+
+########################################################################################################################
+
+def downsample_blocks(array, x, y, x_coarse, y_coarse, method = 'mean'):
+
+    # returns the array on the grid of the coarser scan angle vectors x_coarse, y_coarse by block 'mean', 'min' or #
+    #  'max', nan pixels are ignored and coarse pixels without any valid fine pixel are nan #
+    #  returns None if the grids are not aligned #
+
+    factor_x, indices_x = calc_block_indices(x, x_coarse)
+    factor_y, indices_y = calc_block_indices(y, y_coarse)
+    if indices_x is None or indices_y is None:
+        return None
+
+    array_padded = np.pad(np.asarray(array, dtype = np.float32), ((0, 1), (0, 1)), constant_values = np.nan)
+    blocks = array_padded[indices_y.ravel()][:, indices_x.ravel()].reshape(
+              len(y_coarse), factor_y, len(x_coarse), factor_x)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if method == 'mean':
+            return np.nanmean(blocks, axis = (1, 3))
+        elif method == 'min':
+            return np.nanmin(blocks, axis = (1, 3))
+        elif method == 'max':
+            return np.nanmax(blocks, axis = (1, 3))
+        else:
+            print('block resampling method {} not supported yet!'.format(method))
+            exit()
@@ -0,0 +1,95 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This module uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: numpy                                                                             ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   This module caches the lat/lon grids of the ABI fixed grid: they only depend on the x/y scan angle vectors     ###
+###    and the goes_imager_projection attributes of a file, so they are calculated once, stored as float32 .npy      ###
+###    files in data/ABI/GOES-16/geolocation and memory-mapped read-only by all later loads                          ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   This module here containes functions that have to be imported by another function or script                    ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import os
+import hashlib
+import threading
+
+import numpy as np
+
+from goes.abi_fixed_grid import calc_latlon_from_scan_angles
+
+
+# memory-mapped grids of this process by cache key #
+
+latlon_grids = dict()
+
+projection_attribute_names = ['perspective_point_height', 'semi_major_axis', 'semi_minor_axis',
+                              'longitude_of_projection_origin', 'sweep_angle_axis']
+
+########################################################################################################################
+
+def get_geolocation_key(x, y, imager_projection):
+
+    # sha256 of the x/y vectors and the projection attributes, any change of the grid gives a new key #
+
+    sha256 = hashlib.sha256()
+    sha256.update(np.ascontiguousarray(x, dtype = np.float64).tobytes())
+    sha256.update(np.ascontiguousarray(y, dtype = np.float64).tobytes())
+    for attribute_name in projection_attribute_names:
+        sha256.update('{}={};'.format(attribute_name, getattr(imager_projection, attribute_name, None)).encode())
+
+    return sha256.hexdigest()[:32]
+
+########################################################################################################################
+
+def get_latlon_grids(base_path, x, y, imager_projection):
+
+    # returns read-only memory-mapped float32 lat/lon grids (y, x) of the scan angle vectors x, y in radians #
+    #  imager_projection is the goes_imager_projection variable (or any object with its attributes), #
+    #  pixels off the earth disk are nan, grids not yet in the cache are calculated and stored first #
+
+    key = get_geolocation_key(x, y, imager_projection)
+    if key in latlon_grids:
+        return latlon_grids[key]
+
+    path = dict(base = base_path,
+                data = 'data/ABI/GOES-16/geolocation/')
+    filepath_lats = path['base'] + path['data'] + key + '_lats.npy'
+    filepath_lons = path['base'] + path['data'] + key + '_lons.npy'
+
+    # the grids are calculated block by block directly into the memory-mapped .npy files #
+    #  every writer has its own temporary files, so processes and threads that find the same grid missing at the #
+    #  same time never write into each other's files and only complete grids are renamed into the cache #
+
+    if not (os.path.isfile(filepath_lats) and os.path.isfile(filepath_lons)):
+        os.makedirs(path['base'] + path['data'], exist_ok = True)
+        part_suffix = '.{:d}-{:d}.part'.format(os.getpid(), threading.get_ident())
+        lats = np.lib.format.open_memmap(filepath_lats + part_suffix, mode = 'w+', dtype = np.float32,
+                                         shape = (np.size(y), np.size(x)))
+        lons = np.lib.format.open_memmap(filepath_lons + part_suffix, mode = 'w+', dtype = np.float32,
+                                         shape = (np.size(y), np.size(x)))
+        calc_latlon_from_scan_angles(x, y, get_projection(imager_projection), lats = lats, lons = lons)
+        lats.flush()
+        lons.flush()
+        del lats, lons
+        os.replace(filepath_lats + part_suffix, filepath_lats)
+        os.replace(filepath_lons + part_suffix, filepath_lons)
+
+    latlon_grids[key] = np.load(filepath_lats, mmap_mode = 'r'), np.load(filepath_lons, mmap_mode = 'r')
+
+    return latlon_grids[key]
+
+########################################################################################################################
+
+def get_projection(imager_projection):
+
+    # returns the projection attributes of a goes_imager_projection variable as dict for abi_fixed_grid #
+
+    return dict([(attribute_name, getattr(imager_projection, attribute_name))
+                 for attribute_name in projection_attribute_names])
@@ -8,13 +8,17 @@
 ###  Non-standard packages needed: None                                                                              ###
 ###                                                                                                                  ###
 ###  Content:                                                                                                        ###
-###   The function in this module returns an information string depending on type and band number                    ###
+###   The functions in this module return an information string depending on type and band number and the scan       ###
+###    mode of ABI depending on the date                                                                             ###
 ###                                                                                                                  ###
 ###  Usage:                                                                                                          ###
 ###   This module here containes functions that have to be imported by another function or script                    ###
 ###                                                                                                                  ###
 ########################################################################################################################
 
+import datetime
+
+
 def get_band_info(band_num, info_type):
 
     if info_type == 'resolution_nadir':
@@ -121,3 +125,19 @@ def get_band_info(band_num, info_type):
             info = 'LWIR'
 
     return info
+
+########################################################################################################################
+########################################################################################################################
+########################################################################################################################
+
+def get_scan_mode(date):
+
+    # returns the ABI scan mode, GOES-16 switched from mode 3 to mode 6 on 2 April 2019 #
+    #  mode 3: full disk every 15min, mode 6: full disk every 10min, mesoscale sectors every minute in both modes #
+
+    if date >= datetime.datetime(2019, 4, 2, 16):
+        scan_mode = 6
+    else:
+        scan_mode = 3
+
+    return scan_mode
@@ -0,0 +1,145 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This module uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: numpy, xarray                                                                     ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   This module adds overview levels to the regional files: CMI averaged over blocks of 2x2, 4x4 and 8x8 pixels    ###
+###    and the DQF flags of the pixel nearest to the block center, each level with the scan angles of its block      ###
+###    centers, so downsampled loads read 1/4, 1/16 or 1/64 of the data instead of striding the full resolution      ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   This module here containes functions that have to be imported by another function or script                    ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import numpy as np
+import xarray as xr
+
+
+# block sizes of the overview levels written into the regional files if write_overviews is set in download_abi #
+
+overview_factors = [2, 4, 8]
+
+########################################################################################################################
+
+def get_overview_names(overview_factor):
+
+    # returns the names of CMI, DQF, x and y of an overview level, level 1 is the full resolution #
+
+    if overview_factor == 1:
+        return dict(CMI = 'CMI', DQF = 'DQF', x = 'x', y = 'y')
+
+    return dict([(name, '{}_overview_{:d}'.format(name, overview_factor)) for name in ['CMI', 'DQF', 'x', 'y']])
+
+########################################################################################################################
+
+def add_overview_levels(dataset_region):
+
+    # returns the regional dataset with all overview levels added, blocks at the south and east edge that are not #
+    #  complete are left out, nan pixels are ignored in the block mean #
+    #  every level is summed up from the sums and valid pixel counts of the level before, so only arrays of a #
+    #  quarter of the full size are allocated, the dataset passed in is not changed #
+
+    dataset_region = dataset_region.copy(deep = False)
+    x = dataset_region['x'].values
+    y = dataset_region['y'].values
+    block_sums = dataset_region['CMI'].values
+    block_counts = None
+    block_factor = 1
+
+    for overview_factor in overview_factors:
+        num_x = x.size // overview_factor
+        num_y = y.size // overview_factor
+        if num_x < 2 or num_y < 2:
+            continue
+
+        names = get_overview_names(overview_factor)
+
+        x_overview = x[:num_x*overview_factor].reshape(num_x, overview_factor).mean(axis = 1)
+        y_overview = y[:num_y*overview_factor].reshape(num_y, overview_factor).mean(axis = 1)
+
+        block_sums, block_counts = sum_blocks(block_sums, block_counts, overview_factor // block_factor,
+                                              num_y, num_x)
+        block_factor = overview_factor
+
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            image_overview = np.where(block_counts > 0, block_sums / block_counts, np.nan).astype(np.float32)
+
+        dataset_region[names['CMI']] = xr.DataArray(image_overview, dims = (names['y'], names['x']),
+                                                    attrs = dataset_region['CMI'].attrs)
+
+        # flags are categorical and can not be averaged #
+
+        if 'DQF' in dataset_region:
+            index_center = (overview_factor - 1) // 2
+            dataset_region[names['DQF']] = xr.DataArray(
+                dataset_region['DQF'].values[index_center:num_y*overview_factor:overview_factor,
+                                             index_center:num_x*overview_factor:overview_factor],
+                dims = (names['y'], names['x']), attrs = dataset_region['DQF'].attrs)
+
+        dataset_region = dataset_region.assign_coords({names['x']: (names['x'], x_overview),
+                                                       names['y']: (names['y'], y_overview)})
+
+    return dataset_region
+
+########################################################################################################################
+
+def sum_blocks(sums, counts, factor, num_y, num_x):
+
+    # returns the sums and valid pixel counts of the factor x factor blocks of a level, counts None means that the #
+    #  level is the full resolution image with nan pixels, the blocks are added up from strided views #
+
+    block_sums = np.zeros((num_y, num_x), dtype = np.float32)
+    block_counts = np.zeros((num_y, num_x), dtype = np.int32)
+
+    for offset_y in range(factor):
+        for offset_x in range(factor):
+            sums_offset = sums[offset_y:num_y*factor:factor, offset_x:num_x*factor:factor]
+            if counts is None:
+                valid = np.isfinite(sums_offset)
+                block_sums += np.where(valid, sums_offset, 0)
+                block_counts += valid
+            else:
+                block_sums += sums_offset
+                block_counts += counts[offset_y:num_y*factor:factor, offset_x:num_x*factor:factor]
+
+    return block_sums, block_counts
+
+########################################################################################################################
+
+def get_overview_encoding(dataset_region, complevel = 4):
+
+    # returns the netcdf encoding of the overview levels, CMI and DQF are packed like their full resolution #
+    #  variables, so the flags are stored as bytes again and not as the decoded float32 #
+
+    encoding = dict()
+    for overview_factor in overview_factors:
+        names = get_overview_names(overview_factor)
+
+        for variable_name in ['CMI', 'DQF']:
+            if names[variable_name] not in dataset_region:
+                continue
+
+            encoding[names[variable_name]] = dict(zlib = True, complevel = complevel, shuffle = True)
+            for packing_key in ['dtype', 'scale_factor', 'add_offset', '_FillValue', '_Unsigned']:
+                if packing_key in dataset_region[variable_name].encoding:
+                    encoding[names[variable_name]][packing_key] = dataset_region[variable_name].encoding[packing_key]
+
+    return encoding
+
+########################################################################################################################
+
+def select_overview_level(goes_dataset, downsampling_factor):
+
+    # returns the largest overview factor in the file that divides the downsampling factor and the remaining stride #
+
+    for overview_factor in sorted(overview_factors, reverse = True):
+        if downsampling_factor % overview_factor == 0 \
+          and get_overview_names(overview_factor)['CMI'] in goes_dataset:
+            return overview_factor, downsampling_factor // overview_factor
+
+    return 1, downsampling_factor
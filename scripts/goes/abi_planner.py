@@ -0,0 +1,158 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This module uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: None                                                                              ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   This module expands date ranges into the scan times of a product: full disk every 15min in scan mode 3 and     ###
+###    every 10min in scan mode 6, mesoscale sectors every minute, across month and year boundaries                  ###
+###   Backfill jobs keep their settings and the progress of every file in a checkpoint file                          ###
+###    data/ABI/GOES-16/<product>/jobs/<job_name>.json, so a job of several months can be stopped and resumed        ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   This module here containes functions that have to be imported by another function or script                    ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import os
+import datetime
+import calendar
+import json
+
+from goes.abi_information import get_scan_mode
+
+
+########################################################################################################################
+#  Scan times                                                                                                          #
+########################################################################################################################
+
+def get_scan_interval(product_fullname, date):
+
+    # returns the time between two scans of the product in minutes #
+
+    if product_fullname == 'L2-CMIPF':
+        if get_scan_mode(date) == 6:
+            scan_interval = 10
+        else:
+            scan_interval = 15
+    else:
+        scan_interval = 1
+
+    return scan_interval
+
+########################################################################################################################
+
+def get_next_scan_time(product_fullname, date):
+
+    # returns the first scan start time (cut to minutes) at or after date, scans start at multiples of the scan #
+    #  interval after the full hour #
+
+    date = datetime.datetime(date.year, date.month, date.day, date.hour, date.minute) \
+           + datetime.timedelta(minutes = int(date.second > 0 or date.microsecond > 0))
+    scan_interval = get_scan_interval(product_fullname, date)
+
+    return date + datetime.timedelta(minutes = -date.minute % scan_interval)
+
+########################################################################################################################
+
+def plan_scan_times(product_fullname, datetime_start, datetime_end, step = None, cron = None):
+
+    # returns all scan times between datetime_start and datetime_end (inclusive) #
+    #  step (timedelta): only the first scan at or after every multiple of step since 00UTC is taken, #
+    #   e.g. step = datetime.timedelta(minutes = 30) takes the scans at hh:00 and hh:30 #
+    #  cron (dict): only scan times matching all given lists are taken, possible keys are #
+    #   'months', 'days', 'weekdays' (0 = monday), 'hours' and 'minutes', e.g. cron = dict(hours = list(range(6, 12))) #
+
+    scan_times = []
+
+    if step is None:
+        date = get_next_scan_time(product_fullname, datetime_start)
+        while date <= datetime_end:
+            scan_times.append(date)
+            date = get_next_scan_time(product_fullname, date + datetime.timedelta(minutes = 1))
+    else:
+        date_step = datetime.datetime(datetime_start.year, datetime_start.month, datetime_start.day)
+        while date_step <= datetime_end:
+            date = get_next_scan_time(product_fullname, max(date_step, datetime_start))
+            if date < date_step + step and date <= datetime_end \
+              and (len(scan_times) == 0 or date > scan_times[-1]):
+                scan_times.append(date)
+            date_step += step
+
+    if cron is not None:
+        scan_times = [date for date in scan_times
+                      if date.month in cron.get('months', [date.month])
+                      and date.day in cron.get('days', [date.day])
+                      and date.weekday() in cron.get('weekdays', [date.weekday()])
+                      and date.hour in cron.get('hours', [date.hour])
+                      and date.minute in cron.get('minutes', [date.minute])]
+
+    return scan_times
+
+########################################################################################################################
+
+def expand_date_lists(year, month, days, hours, minutes):
+
+    # returns the dates of all combinations of the date lists used in the scripts, invalid dates like the #
+    #  31st of April are skipped instead of crashing the whole run #
+
+    dates = []
+    for day in days:
+        if not 1 <= day <= calendar.monthrange(year, month)[1]:
+            print('skipped invalid date {:4d}-{:02d}-{:02d}'.format(year, month, day))
+            continue
+        for hour in hours:
+            for minute in minutes:
+                dates.append(datetime.datetime(year, month, day, hour, minute))
+
+    return dates
+
+########################################################################################################################
+#  Job checkpoints                                                                                                     #
+########################################################################################################################
+
+def get_job_task_key(date, band):
+    return '{}_b{:02d}'.format(date.strftime('%Y-%m-%dT%H:%M'), band)
+
+########################################################################################################################
+
+def load_job_checkpoint(base_path, product_fullname, job_name, job_spec):
+
+    # returns the checkpoint of a job with the files finished and failed so far #
+    #  a job whose settings have changed since its checkpoint was written starts from scratch #
+
+    filepath = base_path + 'data/ABI/GOES-16/{}/jobs/{}.json'.format(product_fullname[:8], job_name)
+
+    checkpoint = None
+    if os.path.isfile(filepath):
+        with open(filepath, 'r') as file:
+            checkpoint = json.load(file)
+        if checkpoint['spec'] != job_spec:
+            print('settings of job {} have changed, the job starts from scratch'.format(job_name))
+            checkpoint = None
+        else:
+            print('resume job {}: {:d} files finished, {:d} failed before'.format(
+                   job_name, len(checkpoint['finished']), len(checkpoint['failed'])))
+
+    if checkpoint is None:
+        checkpoint = dict(spec = job_spec, finished = [], failed = dict())
+
+    return checkpoint
+
+########################################################################################################################
+
+def save_job_checkpoint(base_path, product_fullname, job_name, checkpoint):
+
+    # the checkpoint is written to a .part file first and then renamed, so an interrupted write never corrupts it #
+
+    filepath = base_path + 'data/ABI/GOES-16/{}/jobs/{}.json'.format(product_fullname[:8], job_name)
+    os.makedirs(os.path.dirname(filepath), exist_ok = True)
+
+    with open(filepath + '.part', 'w') as file:
+        json.dump(checkpoint, file, indent = 1)
+    os.replace(filepath + '.part', filepath)
+
+    return
@@ -0,0 +1,252 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This script uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: None                                                                              ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   This module keeps the ABI files in data/ABI/GOES-16/<product>/bXX and the images in images/GOES-16 below a     ###
+###    disk quota: size, scan time and last access of every file are tracked in data/ABI/GOES-16/quota.sqlite and    ###
+###    the least recently used (or oldest scan) files are deleted when the quota is exceeded                         ###
+###   Files with a scan time inside a pinned date range are never deleted                                            ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   1) Execute in terminal folder>python abi_quota.py to pin date ranges and enforce the quota                     ###
+###   2) Via import of the functions from another script, load and plot functions record their file accesses         ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import sys
+import os
+import re
+import datetime
+import sqlite3
+
+base_path = ''
+sys.path.append(base_path + 'scripts')
+
+from goes.abi_archive import remove_archive_file
+
+
+# folders under quota and the patterns of the scan times in ABI file and image names #
+
+quota_folders = ['data/ABI/GOES-16/L2-CMIPF/', 'data/ABI/GOES-16/L2-CMIPM/', 'images/GOES-16/']
+
+data_filename_pattern = re.compile(r'_s(\d{11})\d{3}_')
+image_filename_pattern = re.compile(r'_(\d{8}_\d{2}:\d{2})UTC_')
+
+
+def main():
+
+    # specify quota and eviction policy #
+    #  'lru': delete the least recently used files first, 'oldest_scan': delete the files of the oldest scans first #
+
+    quota_gb = 50
+    policy = 'lru'
+    #policy = 'oldest_scan'
+
+    dry_run = True
+    #dry_run = False
+
+
+    # pin date ranges under analysis, pins are kept until they are removed with unpin_date_range #
+
+    #pin_date_range(base_path, 'atacama_fog_winter_2020',
+    #               datetime.datetime(2020, 6, 1, 0, 0), datetime.datetime(2020, 9, 30, 23, 59))
+    #unpin_date_range(base_path, 'atacama_fog_winter_2020')
+
+
+    scan_quota_folders(base_path)
+    enforce_archive_quota(base_path, quota_gb * 1024**3, policy, dry_run)
+
+    return
+
+########################################################################################################################
+#  Database handling                                                                                                   #
+########################################################################################################################
+
+def open_quota(base_path):
+
+    # every caller opens its own connection, sqlite connections can not be shared between threads #
+
+    os.makedirs(base_path + 'data/ABI/GOES-16', exist_ok = True)
+    connection = sqlite3.connect(base_path + 'data/ABI/GOES-16/quota.sqlite', timeout = 60)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('''CREATE TABLE IF NOT EXISTS files (
+                              filepath TEXT PRIMARY KEY,
+                              size INTEGER NOT NULL,
+                              scan_start TEXT,
+                              accessed TEXT NOT NULL)''')
+    connection.execute('CREATE INDEX IF NOT EXISTS files_accessed ON files (accessed)')
+    connection.execute('''CREATE TABLE IF NOT EXISTS pins (
+                              name TEXT PRIMARY KEY,
+                              scan_first TEXT NOT NULL,
+                              scan_last TEXT NOT NULL)''')
+
+    return connection
+
+########################################################################################################################
+
+def get_file_scan_start(filename):
+
+    # returns the scan start (cut to minutes) of an ABI file or image name as iso string or None if it has none #
+
+    match = data_filename_pattern.search(filename)
+    if match is not None:
+        return datetime.datetime.strptime(match.group(1), '%Y%j%H%M').isoformat()
+
+    match = image_filename_pattern.search(filename)
+    if match is not None:
+        return datetime.datetime.strptime(match.group(1), '%Y%m%d_%H:%M').isoformat()
+
+    return None
+
+########################################################################################################################
+#  Access tracking                                                                                                     #
+########################################################################################################################
+
+def record_file_access(base_path, filepath):
+
+    # record a new or used file with the current time as last access, filepath is relative to base_path #
+
+    connection = open_quota(base_path)
+    with connection:
+        connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                           (filepath, os.path.getsize(base_path + filepath),
+                            get_file_scan_start(os.path.basename(filepath)), datetime.datetime.utcnow().isoformat()))
+    connection.close()
+
+    return
+
+########################################################################################################################
+
+def scan_quota_folders(base_path):
+
+    # add files not yet tracked with their modification time as last access and remove vanished files #
+
+    filepaths = dict()
+    for folder in quota_folders:
+        for dirpath, dirnames, filenames in os.walk(base_path + folder):
+            if os.path.basename(dirpath) in ['temp', 'jobs']:
+                continue
+            for filename in filenames:
+                if filename.endswith('.nc') or filename.endswith('.png'):
+                    filepaths[os.path.relpath(os.path.join(dirpath, filename), base_path or '.')] = \
+                        os.stat(os.path.join(dirpath, filename))
+
+    connection = open_quota(base_path)
+    known_filepaths = set([row[0] for row in connection.execute('SELECT filepath FROM files')])
+    with connection:
+        connection.executemany('INSERT INTO files VALUES (?, ?, ?, ?)',
+                               [(filepath, stat.st_size, get_file_scan_start(os.path.basename(filepath)),
+                                 datetime.datetime.utcfromtimestamp(stat.st_mtime).isoformat())
+                                for filepath, stat in filepaths.items() if filepath not in known_filepaths])
+        connection.executemany('DELETE FROM files WHERE filepath = ?',
+                               [(filepath,) for filepath in known_filepaths if filepath not in filepaths])
+    connection.close()
+
+    return
+
+########################################################################################################################
+#  Pins                                                                                                                #
+########################################################################################################################
+
+def pin_date_range(base_path, pin_name, date_first, date_last):
+
+    connection = open_quota(base_path)
+    with connection:
+        connection.execute('INSERT OR REPLACE INTO pins VALUES (?, ?, ?)',
+                           (pin_name, date_first.isoformat(), date_last.isoformat()))
+    connection.close()
+
+    return
+
+########################################################################################################################
+
+def unpin_date_range(base_path, pin_name):
+
+    connection = open_quota(base_path)
+    with connection:
+        connection.execute('DELETE FROM pins WHERE name = ?', (pin_name,))
+    connection.close()
+
+    return
+
+########################################################################################################################
+#  Eviction                                                                                                            #
+########################################################################################################################
+
+def enforce_archive_quota(base_path, quota_bytes, policy = 'lru', dry_run = False):
+
+    # delete unpinned files in the order of the policy until the tracked files fit into quota_bytes #
+    #  deleted ABI files are also removed from the archive manifest, so they are downloaded again when needed #
+    #  returns the number of deleted files and bytes, with dry_run the files are only listed #
+
+    if policy == 'lru':
+        order = 'accessed'
+    elif policy == 'oldest_scan':
+        order = 'scan_start IS NULL, scan_start, accessed'
+    else:
+        print('eviction policy not supported yet!')
+        exit()
+
+    connection = open_quota(base_path)
+    total_bytes = connection.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+    if total_bytes <= quota_bytes:
+        connection.close()
+        return 0, 0
+
+    rows = connection.execute('SELECT filepath, size FROM files WHERE NOT EXISTS ('
+                              'SELECT 1 FROM pins WHERE files.scan_start BETWEEN pins.scan_first AND pins.scan_last) '
+                              'ORDER BY ' + order)
+
+    evicted_filepaths = []
+    evicted_bytes = 0
+    for filepath, size in rows:
+        if total_bytes - evicted_bytes <= quota_bytes:
+            break
+        evicted_filepaths.append(filepath)
+        evicted_bytes += size
+    rows.close()
+
+    print('archive uses {:.2f} of {:.2f} GB, {} {:d} files with {:.2f} GB'.format(
+           total_bytes / 1024**3, quota_bytes / 1024**3, 'would delete' if dry_run else 'delete',
+           len(evicted_filepaths), evicted_bytes / 1024**3))
+    if total_bytes - evicted_bytes > quota_bytes:
+        print('quota can not be met, the remaining files are pinned')
+
+    if dry_run:
+        for filepath in evicted_filepaths:
+            print('  ' + filepath)
+        connection.close()
+        return len(evicted_filepaths), evicted_bytes
+
+    for filepath in evicted_filepaths:
+        if os.path.isfile(base_path + filepath):
+            os.remove(base_path + filepath)
+        if filepath.startswith('data/'):
+            remove_archive_file(base_path, filepath)
+    with connection:
+        connection.executemany('DELETE FROM files WHERE filepath = ?', [(filepath,) for filepath in evicted_filepaths])
+    connection.close()
+
+    return len(evicted_filepaths), evicted_bytes
+
+############################################################################
+############################################################################
+############################################################################
+
+if __name__ == '__main__':
+    import time
+    t1 = time.time()
+    main()
+    t2 = time.time()
+    delta_t = t2-t1
+    if delta_t < 60:
+        print('total script time:  {:.1f}s'.format(delta_t))
+    elif 60 <= delta_t <= 3600:
+        print('total script time:  {:.0f}min{:.0f}s'.format(delta_t//60, delta_t-delta_t//60*60))
+    else:
+        print('total script time:  {:.0f}h{:.0f}min'.format(delta_t//3600, (delta_t-delta_t//3600*3600)/60))
@@ -0,0 +1,59 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This module uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: numpy, xesmf                                                                      ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   This module keeps the xesmf regridders between the grids of two bands: the weights only depend on the source   ###
+###    and target grid, so they are calculated once, stored in data/ABI/GOES-16/regridding_weights and read again    ###
+###    for every later timestep and run with the same domain                                                         ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   This module here containes functions that have to be imported by another function or script                    ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import os
+import hashlib
+
+import numpy as np
+import xesmf
+
+
+# regridders of this process by weights key #
+
+regridders = dict()
+
+########################################################################################################################
+
+def get_regridder(base_path, lats_in, lons_in, grid_key_in, lats_out, lons_out, grid_key_out,
+                  method = 'nearest_s2d'):
+
+    # returns an xesmf regridder from the lat/lon grid in to the lat/lon grid out #
+    #  grid_key_in and grid_key_out have to identify the grids (e.g. file grid, hyperslab and crop indices), #
+    #  regridders not yet in the weights folder are calculated and their weights are stored first #
+
+    key = hashlib.sha256('{}|{}|{}'.format(grid_key_in, grid_key_out, method).encode()).hexdigest()[:32]
+    if key in regridders:
+        return regridders[key]
+
+    path = dict(base = base_path,
+                weights = 'data/ABI/GOES-16/regridding_weights/')
+    filepath = path['base'] + path['weights'] + key + '.nc'
+
+    grid_in = dict(lat = np.ascontiguousarray(lats_in), lon = np.ascontiguousarray(lons_in))
+    grid_out = dict(lat = np.ascontiguousarray(lats_out), lon = np.ascontiguousarray(lons_out))
+
+    if os.path.isfile(filepath):
+        regridders[key] = xesmf.Regridder(grid_in, grid_out, method, weights = filepath)
+    else:
+        print('calculate regridding weights...')
+        os.makedirs(path['base'] + path['weights'], exist_ok = True)
+        regridders[key] = xesmf.Regridder(grid_in, grid_out, method)
+        regridders[key].to_netcdf(filepath + '.part')
+        os.replace(filepath + '.part', filepath)
+
+    return regridders[key]
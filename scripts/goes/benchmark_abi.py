@@ -0,0 +1,161 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This script uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: numpy, xarray, netcdf4, pyproj                                                    ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   This script benchmarks parts of the download and loading chain with local files                                ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   1) Execute in terminal folder>python benchmark_abi.py                                                          ###
+###   2) Via import of the benchmark functions from another script                                                   ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import sys
+import os
+import time
+
+import numpy as np
+import xarray as xr
+import pyproj
+
+base_path = ''
+sys.path.append(base_path + 'scripts')
+
+from goes.download_abi import crop_dataset_to_region, get_region_file_encoding
+from goes.abi_fixed_grid import get_fixed_grid_info, calc_latlon_from_scan_angles, goes16_projection
+
+
+def main():
+
+    # specify the path of a full-disk L2-CMIPF file #
+
+    filepath_full = ''
+    band = 13
+    region = 'atacama'
+
+
+    # specify benchmarks #
+
+    output_profiles = ['default', 'compressed', 'compressed_fast']
+    num_repeats = 5
+
+    # the pyproj reference of the inverse projection needs about 1GB of memory for the 2km full disk #
+
+    resolution_nadir = 2.0
+    #resolution_nadir = 1.0
+
+
+    benchmark_output_profiles(base_path, filepath_full, band, region, output_profiles, num_repeats)
+    benchmark_inverse_projection(resolution_nadir, num_repeats)
+
+    return
+
+########################################################################################################################
+########################################################################################################################
+########################################################################################################################
+
+def benchmark_output_profiles(base_path, filepath_full, band, region, output_profiles, num_repeats):
+
+    # write the regional file of a full-disk file with every output profile and time write and read of CMI #
+
+    path = dict(base = base_path,
+                data = 'data/ABI/GOES-16/L2-CMIPF/temp/')
+
+    print('output profile'.ljust(18), 'write [s]'.rjust(10), 'read [s]'.rjust(10), 'size [MB]'.rjust(10))
+
+    for output_profile in output_profiles:
+        filename_benchmark = path['base'] + path['data'] + 'benchmark_{}.nc'.format(output_profile)
+
+        write_times = []
+        for i in range(num_repeats):
+            dataset_full = xr.open_dataset(filepath_full)
+            dataset_region = crop_dataset_to_region(dataset_full, band, region).load()
+            dataset_full.close()
+
+            t1 = time.perf_counter()
+            dataset_region.to_netcdf(filename_benchmark, format = 'NETCDF4',
+                                     encoding = get_region_file_encoding(dataset_region, band, output_profile))
+            write_times.append(time.perf_counter() - t1)
+
+        read_times = []
+        for i in range(num_repeats):
+            t1 = time.perf_counter()
+            goes_dataset = xr.open_dataset(filename_benchmark)
+            image_array = goes_dataset['CMI'].values
+            goes_dataset.close()
+            read_times.append(time.perf_counter() - t1)
+
+        print(output_profile.ljust(18),
+              '{:.3f}'.format(min(write_times)).rjust(10),
+              '{:.3f}'.format(min(read_times)).rjust(10),
+              '{:.2f}'.format(os.path.getsize(filename_benchmark) / 1024**2).rjust(10))
+
+        os.remove(filename_benchmark)
+
+    return
+
+########################################################################################################################
+
+def benchmark_inverse_projection(resolution_nadir, num_repeats):
+
+    # time the lat/lon calculation of the full disk fixed grid with pyproj (float64 meshgrids) and with the #
+    #  closed-form inverse projection in float32 and float64, the errors are the maxima over all earth pixels #
+
+    grid = get_fixed_grid_info(resolution_nadir)
+    x = grid['x_first'] + grid['step'] * np.arange(grid['num_pixels'])
+    y = grid['y_first'] - grid['step'] * np.arange(grid['num_pixels'])
+    h = goes16_projection['perspective_point_height']
+
+    times = []
+    for i in range(num_repeats):
+        t1 = time.perf_counter()
+        p = pyproj.Proj(proj = 'geos', h = h, lon_0 = goes16_projection['longitude_of_projection_origin'],
+                        sweep = 'x', ellps = 'GRS80')
+        xx, yy = np.meshgrid(x * h, y * h)
+        lons_pyproj, lats_pyproj = p(xx, yy, inverse = True)
+        del xx, yy
+        times.append(time.perf_counter() - t1)
+    earth = np.abs(lats_pyproj) <= 90.0
+
+    print('inverse projection'.ljust(18), 'time [s]'.rjust(10), 'lat err [deg]'.rjust(14),
+          'lon err [deg]'.rjust(14), 'mask diff'.rjust(10))
+    print('pyproj'.ljust(18), '{:.3f}'.format(min(times)).rjust(10))
+
+    for dtype in [np.float32, np.float64]:
+        times = []
+        for i in range(num_repeats):
+            t1 = time.perf_counter()
+            lats, lons = calc_latlon_from_scan_angles(x, y, dtype = dtype)
+            times.append(time.perf_counter() - t1)
+
+        valid = earth & np.isfinite(lats)
+        print('closed form {}'.format(np.dtype(dtype).name).ljust(18),
+              '{:.3f}'.format(min(times)).rjust(10),
+              '{:.2e}'.format(np.max(np.abs(lats[valid] - lats_pyproj[valid]))).rjust(14),
+              '{:.2e}'.format(np.max(np.abs(lons[valid] - lons_pyproj[valid]))).rjust(14),
+              '{:d}'.format(int(np.sum(earth != np.isfinite(lats)))).rjust(10))
+        del lats, lons
+
+    return
+
+############################################################################
+############################################################################
+############################################################################
+
+if __name__ == '__main__':
+    import time
+    t1 = time.time()
+    main()
+    t2 = time.time()
+    delta_t = t2-t1
+    if delta_t < 60:
+        print('total script time:  {:.1f}s'.format(delta_t))
+    elif 60 <= delta_t <= 3600:
+        print('total script time:  {:.0f}min{:.0f}s'.format(delta_t//60, delta_t-delta_t//60*60))
+    else:
+        print('total script time:  {:.0f}h{:.0f}min'.format(delta_t//3600, (delta_t-delta_t//3600*3600)/60))
@@ -5,33 +5,70 @@
 ###                                                                                                                  ###
 ###  Author: Marco Wurth, July 2021                                                                                  ###
 ###  Tested with Python 3.9 and Fedora Linux                                                                         ###
-###  Non-standard packages needed: distributed, boto3, xarray, netcdf4                                               ###
+###  Non-standard packages needed: distributed, boto3, xarray, netcdf4, h5netcdf                                     ###
 ###                                                                                                                  ###
 ###  Usage:                                                                                                          ###
 ###   1) Execute in terminal folder>python download_abi.py                                                           ###
 ###   2) Via import of download_abi_files or download_single_abi_file from another script                            ###
+###   3) Realtime: set follow_exec = True, new files are downloaded within seconds until the script is stopped       ###
+###   4) Backfill: set backfill_exec = True to download a date range as one resumable job with a process pool        ###
 ###                                                                                                                  ###
-###  Known bugs: There is an issue with boto3 and parallelization that sometimes leads                               ###
-###   to KeyError('endpoint_resolver') or KeyError('credential_provider') but if download_retries_per_file > 1       ###
-###   it will most probably work on the next retry of the thread and download all files successfully in the end      ###
+###  S3 access: All downloads use one anonymous (unsigned) S3 client per worker process which is shared by all its   ###
+###   threads, so no AWS credentials are needed anymore, also not for the parallelized downloading                   ###
 ###                                                                                                                  ###
 ########################################################################################################################
 
 import sys
 import os
+import io
 import time
 import datetime
-import fnmatch
+import threading
+import collections
+import queue
+import concurrent.futures
+import functools
 
 import distributed                      # provides parallelization features, see distributed.dask.org/en/latest
-from boto3 import resource              # provides access to the Amazon Simple Storage Service (Amazon S3)
-from botocore import UNSIGNED
-from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError, ClientError
 import xarray as xr                     # provides interface for reading, manipulation and writing of netcdf files
 
 base_path = ''
 sys.path.append(base_path + 'scripts')
 
+from goes.s3_inventory import get_s3_client, s3_bucket_name, find_s3_object, get_latest_scan, update_inventory_hour, \
+                             find_new_objects
+from goes.s3_byte_range import S3RangeFile, prefetch_chunks
+from goes.s3_concurrency import ConcurrencyController, call_with_backoff
+from goes.abi_information import get_band_info
+from goes.abi_fixed_grid import calc_latlon_box_index_bounds
+from general.domain_definitions import get_image_domain, get_region_domain_names
+from general.crop_data import get_domain_cutout
+from goes.abi_archive import record_archive_file, find_completed_file, cleanup_archive_orphans, find_completed_scans
+from goes.abi_quota import record_file_access, scan_quota_folders, enforce_archive_quota
+from goes.abi_overviews import add_overview_levels, get_overview_encoding
+from goes.abi_planner import expand_date_lists, plan_scan_times, get_job_task_key, load_job_checkpoint, \
+                             save_job_checkpoint
+
+
+# transfer settings of the shared anonymous s3 client, the client itself is created in s3_inventory #
+#  max_pool_connections there has to be at least the number of threads per worker times the max_concurrency here #
+
+s3_transfer_config = TransferConfig(multipart_threshold = 16 * 1024**2,
+                                    multipart_chunksize = 8 * 1024**2,
+                                    max_concurrency = 4,
+                                    use_threads = True)
+
+
+# in-flight memory budget of the memory fetch mode, shared by all download threads of a worker process #
+#  process pools split it between their worker processes, see set_memory_budget #
+
+memory_budget_bytes = 4 * 1024**3
+
+memory_in_flight = dict(bytes = 0)
+memory_budget_condition = threading.Condition()
+
 
 def main():
 
@@ -45,6 +82,100 @@ def main():
     download_retries_per_file = 3
 
 
+    # adapt the number of parallel downloads (up to num_max_parallel_tasks) to the observed throughput and errors, #
+    #  failed downloads are retried after a jittered exponential backoff, see s3_concurrency #
+
+    adaptive_concurrency = True
+    #adaptive_concurrency = False
+
+
+    # pipelined execution settings, overrides distributed_exec and fetch_mode if set on #
+    #  fetch threads download into memory, crop processes cut the files and write threads store the regional files #
+    #  the stages are connected by queues of queue_size files that block full stages (backpressure) #
+
+    pipeline_exec = False
+    #pipeline_exec = True
+
+    pipeline_settings = dict(num_fetch_threads = 8,
+                             num_crop_processes = 4,
+                             num_write_threads = 2,
+                             queue_size = 8)
+
+
+    # specify download order, see order_download_tasks for all options #
+
+    task_priority = 'chronological'
+    #task_priority = 'newest_first'
+    #task_priority = 'band_order'
+
+
+    # specify how files are fetched, the memory and byte_range modes need h5netcdf #
+    #  byte_range is only used for full-disk files, mesoscale sector files are then fetched as in full_file mode #
+    #  'full_file':  download the whole file to temp and cut it to the region afterwards #
+    #  'memory':     download the whole file into memory, crop it there and write only the regional file #
+    #  'byte_range': read only the netcdf chunks inside the region with ranged GET requests #
+
+    fetch_mode = 'full_file'
+    #fetch_mode = 'memory'
+    #fetch_mode = 'byte_range'
+
+
+    # specify the netcdf encoding of the regional files, see get_region_file_encoding for all options #
+    #  compressed files are several times smaller and faster to load, mesoscale sector files are kept as they are #
+
+    output_profile = 'default'
+    #output_profile = 'compressed'
+    #output_profile = 'compressed_fast'
+
+
+    # specify if overview levels (2x2, 4x4 and 8x8 block means, see abi_overviews) are added to the regional files #
+    #  they make downsampled plots of large regions faster to load, but the files larger and the cropping slower #
+
+    write_overviews = False
+    #write_overviews = True
+
+
+    # specify if files already completed in the archive manifest are skipped and how they are verified #
+    #  'size': compare file size, 'checksum': also compare the sha256 checksum, 'none': download everything again #
+
+    skip_existing = 'size'
+    #skip_existing = 'checksum'
+    #skip_existing = 'none'
+
+
+    # realtime follow mode, overrides all time settings below and runs until stopped with ctrl+c #
+    #  the inventory of the current hourly folders is polled every follow_poll_seconds and new files of all #
+    #  follow_products are downloaded right away, the latency from scan end to the local file is printed per file #
+
+    follow_exec = False
+    #follow_exec = True
+
+    follow_products = ['L2-CMIPF']
+    #follow_products = ['L2-CMIPF', 'L2-CMIPM1', 'L2-CMIPM2']
+    follow_poll_seconds = 5
+
+
+    # backfill job over a date range, overrides all time settings below, see plan_scan_times for step and cron #
+    #  progress is checkpointed, a stopped job is resumed by running it again with the same job_name and settings #
+
+    backfill_exec = False
+    #backfill_exec = True
+
+    backfill_settings = dict(job_name = 'atacama_fog_winter_2020',
+                             datetime_start = datetime.datetime(2020, 6, 1, 0, 0),
+                             datetime_end = datetime.datetime(2020, 9, 30, 23, 59),
+                             step = datetime.timedelta(minutes = 30),
+                             cron = dict(hours = list(range(6, 16))),
+                             num_processes = 8)
+
+
+    # disk quota of the ABI files and images, the least recently used files are deleted after the downloads #
+    #  files of pinned date ranges are kept, see abi_quota #
+
+    archive_quota_gb = None
+    #archive_quota_gb = 50
+
+
     # specify product #
 
     product = 'L2-CMIPF'       # Full-disk
@@ -59,54 +190,72 @@ def main():
     #region = 'ssa'
     region = 'atacama'
     #region = 'atacama_squared'  # this extends the rectangular atacama region to the west and east
+    #region = 'atacama_domains'  # smallest region containing all five 300km atacama domains, see domain_definitions
 
 
-    # get latest available image time #
+    # specify bands (possible 1-16) to download #
 
-    if product == 'L2-CMIPF':
-        timediff_minutes = 20   # if not enough raise to 30min
-        datetime_now = datetime.datetime.utcnow()
-        datetime_latest = datetime_now - datetime.timedelta(
-                            seconds = (datetime_now.minute % 10 + timediff_minutes) * 60 + datetime_now.second)
-    elif product == 'L2-CMIPM1' or product == 'L2-CMIPM2':
-        timediff_minutes = 2
-        datetime_now = datetime.datetime.utcnow()
-        datetime_latest = datetime_now - datetime.timedelta(seconds = timediff_minutes * 60 + datetime_now.second)
+    #bands = [2,5,6,7,8,10,13]
+    #bands = [5,6,7,8,10]
+    bands = [7, 13]
+    #bands = [11, 15]
+    #bands = list(range(1, 16+1))
 
-    print('now:'.ljust(8), datetime_now)
-    print('latest:'.ljust(8), datetime_latest)
 
-    year = datetime_latest.year
-    month = datetime_latest.month
-    days = [datetime_latest.day]
-    hours = [datetime_latest.hour]
-    minutes = [datetime_latest.minute]
+    if follow_exec:
+        follow_abi_files(base_path, follow_products, region, bands, num_max_parallel_tasks, download_retries_per_file,
+                         follow_poll_seconds, fetch_mode, output_profile, write_overviews, skip_existing,
+                         adaptive_concurrency = adaptive_concurrency, archive_quota_gb = archive_quota_gb)
+        return
 
+    if backfill_exec:
+        run_backfill_job(base_path, product, region, bands, backfill_settings, download_retries_per_file,
+                         fetch_mode, output_profile, write_overviews, skip_existing, adaptive_concurrency)
+        if archive_quota_gb is not None:
+            scan_quota_folders(base_path)
+            enforce_archive_quota(base_path, archive_quota_gb * 1024**3)
+        return
 
-    # override latest time with specified time #
 
-    #year = 2021
-    #month = 4
-    days = [25]
-    #days = list(range(1, 31))
-    #hours = list(range(0, 6))
-    #hours = list(range(12, 17))
-    #minutes = list(range(0, 60, 10))
-    hours = [17]
-    minutes = [0]
+    # download the latest available scan or a specified time #
+    #  the s3 inventory is only listed for the latest scan, it is estimated from the current time if s3 is offline #
 
+    #latest_exec = True
+    latest_exec = False
 
-    # specify bands (possible 1-16) to download #
+    if latest_exec:
+        datetime_now = datetime.datetime.utcnow()
+        datetime_latest = get_latest_scan(base_path, product, bands, datetime_now)
 
-    #bands = [2,5,6,7,8,10,13]
-    #bands = [5,6,7,8,10]
-    bands = [7, 13]
-    #bands = [11, 15]
-    #bands = list(range(1, 16+1))
+        print('now:'.ljust(8), datetime_now)
+        print('latest:'.ljust(8), datetime_latest)
+
+        year = datetime_latest.year
+        month = datetime_latest.month
+        days = [datetime_latest.day]
+        hours = [datetime_latest.hour]
+        minutes = [datetime_latest.minute]
+
+    else:
+        year = 2021
+        month = 4
+        days = [25]
+        #days = list(range(1, 31))
+        #hours = list(range(0, 6))
+        #hours = list(range(12, 17))
+        #minutes = list(range(0, 60, 10))
+        hours = [17]
+        minutes = [0]
 
 
     download_abi_files(base_path, distributed_exec, num_max_parallel_tasks, download_retries_per_file,
-                       product, region, bands, year, month, days, hours, minutes)
+                       product, region, bands, year, month, days, hours, minutes, task_priority, fetch_mode,
+                       output_profile, write_overviews, skip_existing, pipeline_exec, pipeline_settings,
+                       adaptive_concurrency)
+
+    if archive_quota_gb is not None:
+        scan_quota_folders(base_path)
+        enforce_archive_quota(base_path, archive_quota_gb * 1024**3)
 
     return
 
@@ -115,73 +264,79 @@ def main():
 ########################################################################################################################
 
 def download_abi_files(base_path, distributed_exec, num_max_parallel_tasks, download_retries_per_file,
-                       product, region, bands, year, month, days, hours, minutes):
+                       product, region, bands, year, month, days, hours, minutes,
+                       task_priority = 'chronological', fetch_mode = 'full_file', output_profile = 'default',
+                       write_overviews = False, skip_existing = 'size', pipeline_exec = False, pipeline_settings = None,
+                       adaptive_concurrency = False):
+
+    dates = expand_date_lists(year, month, days, hours, minutes)
+    if len(dates) == 0:
+        print('no valid dates to download')
+        return []
 
-    print('load:'.ljust(8), datetime.datetime(year, month, days[0], hours[0], minutes[0]), 'to',
-                            datetime.datetime(year, month, days[-1], hours[-1], minutes[-1]),
-           'region:', region)
+    print('load:'.ljust(8), dates[0], 'to', dates[-1], 'region:', region)
     print('------------------------------------------')
 
+    cleanup_archive_orphans(base_path, product)
+
+    date_bands = [[date, band] for date in dates for band in bands]
+    date_bands = order_download_tasks(date_bands, bands, task_priority)
+    print('total number of tasks:', len(date_bands))
+
+
+    results = []
+    controller = ConcurrencyController(1, num_max_parallel_tasks, adaptive = adaptive_concurrency)
+
+    # pipelined execution with separate fetch, crop and write stages, see run_download_pipeline #
+
+    if pipeline_exec:
+        results = run_download_pipeline(base_path, product, region, date_bands, output_profile, write_overviews,
+                                        skip_existing, pipeline_settings, controller, download_retries_per_file)
+
 
     # parallel execution with dask distributed #
+    #  a sliding window keeps as many downloads in flight as the concurrency controller allows and submits the next #
+    #  task in the queue as soon as any running task has finished, so a single slow file never stalls the others #
 
-    if distributed_exec:
+    elif distributed_exec:
         client = distributed.Client(n_workers = 1, processes = True, threads_per_worker = num_max_parallel_tasks)
         print(client)
 
-        for day in days:
-            date_bands = []
-            for hour in hours:
-                for minute in minutes:
-                    for band in bands:
-                        date_bands.append([datetime.datetime(year, month, day, hour, minute), band])
-        print('total number of tasks:', len(date_bands))
-
-        sub_date_bands = []
-        if num_max_parallel_tasks > len(date_bands):
-            num_max_parallel_tasks = len(date_bands)
-        for i in range(len(date_bands) // num_max_parallel_tasks):
-            sub_date_bands.append(date_bands[i * num_max_parallel_tasks : (i + 1) * num_max_parallel_tasks])
-        if len(date_bands) % num_max_parallel_tasks > 0:
-            sub_date_bands.append(date_bands[-1 * (len(date_bands) % num_max_parallel_tasks) : ])
-
-        all_tasks = []
-        for sub_date_band in sub_date_bands:
-            futures = []
-            for date_band in sub_date_band:
-                futures.append(client.submit(download_single_abi_file, base_path, product, date_band[0], date_band[1],
-                                             region, distributed_exec, retries = download_retries_per_file))
-            distributed.wait(futures)
-            all_tasks += futures
-
-        print('------------------------------------------')
-        try:
-            # uncomment the next three lines to print all filenames #
-            #print('all downloaded files:')
-            #for f in all_tasks:
-            #    print(f.result())
-
-            testlist = [f.result()[-10 - len(region):] for f in all_tasks]
-            if testlist.count('region-' + region + '.nc') == len(testlist):
-                print('                        #             ')
-                print('                     #                ')
-                print('                  #                   ')
-                print('     #         #                      ')
-                print('       #    #                         ')
-                print('         #                            ')
-                print('                                      ')
-                print('all tasks finished successfully       ')
-
-        except:
-                print('            #           #             ')
-                print('              #       #               ')
-                print('                #   #                 ')
-                print('                  #                   ')
-                print('                #   #                 ')
-                print('              #       #               ')
-                print('            #           #             ')
-                print('                                      ')
-                print('some tasks failed and some or all files could probably not be downloaded')
+        task_queue = collections.deque(date_bands)
+        running_tasks = dict()
+        futures_completed = distributed.as_completed()
+
+        def submit_next_task():
+            date, band = task_queue.popleft()
+            future = client.submit(run_download_task, base_path, product, date, band, region, distributed_exec,
+                                   fetch_mode, output_profile, write_overviews, skip_existing,
+                                   download_retries_per_file + 1,
+                                   pure = False)
+            running_tasks[future.key] = [date, band]
+            futures_completed.add(future)
+
+        while len(task_queue) > 0 and len(running_tasks) < controller.limit:
+            submit_next_task()
+
+        time_stats = time.time()
+        for future in futures_completed:
+            date, band = running_tasks.pop(future.key)
+            if future.status == 'finished':
+                results.append(future.result())
+                record_task_result(controller, results[-1])
+            else:
+                results.append(dict(product = product, band = band, date = date, status = 'failed',
+                                    filename = None, seconds = None, error = repr(future.exception())))
+                controller.record(0.0, 0, error = future.exception())
+                print('failed GOES-16 ABI {} B{:02d}, {}: {}'.format(product, band, date, results[-1]['error']))
+            future.release()
+
+            while len(task_queue) > 0 and len(running_tasks) < controller.limit:
+                submit_next_task()
+
+            if time.time() - time_stats > 30:
+                print(controller.format_stats())
+                time_stats = time.time()
 
         #client.restart()
         #print('client restarted')
@@ -192,22 +347,544 @@ def download_abi_files(base_path, distributed_exec, num_max_parallel_tasks, down
     # serial execution #
 
     else:
-        for day in days:
-            for hour in hours:
-                for minute in minutes:
-                    for band in bands:
-                        date_load = datetime.datetime(year, month, day, hour, minute)
-                        print('load:'.ljust(8), date_load)
-                        download_single_abi_file(base_path, product, date_load, band, region, distributed_exec)
+        for date_load, band in date_bands:
+            print('load:'.ljust(8), date_load)
+            try:
+                results.append(run_download_task(base_path, product, date_load, band, region, distributed_exec,
+                                                 fetch_mode, output_profile, write_overviews, skip_existing,
+                                                 download_retries_per_file + 1))
+                record_task_result(controller, results[-1])
+            except Exception as exception:
+                results.append(dict(product = product, band = band, date = date_load, status = 'failed',
+                                    filename = None, seconds = None, error = repr(exception)))
+                controller.record(0.0, 0, error = exception)
+                print('failed GOES-16 ABI {} B{:02d}, {}: {}'.format(product, band, date_load, results[-1]['error']))
 
 
+    print('------------------------------------------')
+
+    # uncomment the next three lines to print all filenames #
+    #print('all downloaded files:')
+    #for result in results:
+    #    print(result['filename'])
+
+    failed_results = [result for result in results if result['status'] == 'failed']
+    num_skipped = len([result for result in results if result['status'] == 'skipped'])
+    if num_skipped > 0:
+        print('skipped {:d} files already completed in the archive'.format(num_skipped))
+    print(controller.format_stats())
+
+    if len(failed_results) == 0:
+        print('                        #             ')
+        print('                     #                ')
+        print('                  #                   ')
+        print('     #         #                      ')
+        print('       #    #                         ')
+        print('         #                            ')
+        print('                                      ')
+        print('all tasks finished successfully       ')
+    else:
+        print('            #           #             ')
+        print('              #       #               ')
+        print('                #   #                 ')
+        print('                  #                   ')
+        print('                #   #                 ')
+        print('              #       #               ')
+        print('            #           #             ')
+        print('                                      ')
+        print('{:d} of {:d} tasks failed, these files could not be downloaded:'.format(
+               len(failed_results), len(results)))
+        for result in failed_results:
+            print('  B{:02d} {}: {}'.format(result['band'], result['date'], result['error']))
+
+
+    return results
+
+############################################################################
+############################################################################
+############################################################################
+
+def follow_abi_files(base_path, products, region, bands, num_max_parallel_tasks, download_retries_per_file,
+                     poll_seconds = 5, fetch_mode = 'memory', output_profile = 'default', write_overviews = False,
+                     skip_existing = 'size', render_function = None, follow_minutes = None, lookback_minutes = 10,
+                     adaptive_concurrency = False, archive_quota_gb = None):
+
+    # realtime follow mode: poll the s3 inventory of the current hourly folders and download new files right away #
+    #  every poll lists only the keys after the last known key of every product and band (see s3_inventory), new #
+    #  files are downloaded by a thread pool with the newest scans first, so a backlog never delays the latest scan #
+    #  the concurrency controller decides how many of the num_max_parallel_tasks threads download at the same time #
+    #  render_function(result) is called in the main thread for every finished file, e.g. to plot the new image #
+    #  runs until stopped with ctrl+c or for follow_minutes, files of the last lookback_minutes are also downloaded #
+    #  every poll only queries the files of the listed hourly folders, older keys are dropped from submitted_keys #
+    #  failed files are retried within run_download_task (download_retries_per_file) and not submitted again #
+    #  if archive_quota_gb is set, the quota folders are scanned and the quota is enforced every 10 minutes #
+
+    print('follow:'.ljust(8), ', '.join(products), 'region:', region)
+    print('------------------------------------------')
+
+    for product in products:
+        cleanup_archive_orphans(base_path, product)
+
+    s3_client = get_s3_client()
+    datetime_start = datetime.datetime.utcnow()
+    if follow_minutes is not None:
+        datetime_stop = datetime_start + datetime.timedelta(minutes = follow_minutes)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = num_max_parallel_tasks)
+    listing_executor = concurrent.futures.ThreadPoolExecutor(max_workers = 16)
+    controller = ConcurrencyController(1, num_max_parallel_tasks, adaptive = adaptive_concurrency)
+    pending_tasks = []
+    running_tasks = dict()
+    submitted_keys = dict()
+    results = []
+
+    def handle_finished_task(future):
+        s3_key, product, band, scan_start, scan_end = running_tasks.pop(future)
+        try:
+            result = future.result()
+        except Exception as exception:
+            controller.record(0.0, 0, error = exception)
+            print('failed GOES-16 ABI {} B{:02d}, {}: {!r}'.format(product, band, scan_start, exception))
+            results.append(dict(product = product, band = band, date = scan_start, status = 'failed',
+                                filename = None, seconds = None, error = repr(exception)))
+            return
+
+        result['latency'] = (datetime.datetime.utcnow() - scan_end).total_seconds()
+        results.append(result)
+        record_task_result(controller, result)
+        if result['status'] == 'finished':
+            print('available GOES-16 ABI {} B{:02d}, {}, latency since scan end: {:.1f}s'.format(
+                   product, band, scan_start, result['latency']))
+        if render_function is not None:
+            render_function(result)
+
+    try:
+        time_next_poll = time.time()
+        time_quota = time.time()
+        while follow_minutes is None or datetime.datetime.utcnow() < datetime_stop:
+
+            if archive_quota_gb is not None and time.time() - time_quota > 600:
+                scan_quota_folders(base_path)
+                enforce_archive_quota(base_path, archive_quota_gb * 1024**3)
+                time_quota = time.time()
+
+            # list the current hourly folders, the previous one only until all its late files have arrived #
+            #  a failed listing is only logged, the folders are listed again from their last key with the next poll #
+
+            datetime_now = datetime.datetime.utcnow()
+            listing_dates = [datetime_now]
+            if datetime_now.minute < 15:
+                listing_dates.append(datetime_now - datetime.timedelta(hours = 1))
+            listing_args = [(product, band, date) for product in products for band in bands for date in listing_dates]
+            try:
+                list(listing_executor.map(
+                    lambda args: update_inventory_hour(base_path, s3_client, s3_bucket_name, *args), listing_args))
+            except (BotoCoreError, ClientError) as exception:
+                print('listing the s3 inventory failed, retry with the next poll: {!r}'.format(exception))
+
+            # files can only be new in the listed folders, so the query window does not grow while following #
+
+            scan_start_min = max(datetime_start - datetime.timedelta(minutes = lookback_minutes),
+                                 min(listing_dates).replace(minute = 0, second = 0, microsecond = 0))
+            for s3_key in [s3_key for s3_key, scan_start in submitted_keys.items() if scan_start < scan_start_min]:
+                del submitted_keys[s3_key]
+
+            new_objects = [new_object for new_object in find_new_objects(base_path, products, bands, scan_start_min)
+                           if new_object[0] not in submitted_keys]
+
+            for s3_key, product, band, scan_start, scan_end, size in new_objects:
+                date = datetime.datetime(scan_start.year, scan_start.month, scan_start.day,
+                                         scan_start.hour, scan_start.minute)
+                pending_tasks.append([s3_key, product, band, date, scan_end])
+                submitted_keys[s3_key] = scan_start
+
+            if len(pending_tasks) > num_max_parallel_tasks:
+                print('falling behind, {:d} files in the download queue,'.format(len(pending_tasks)),
+                      controller.format_stats())
+
+
+            # handle finished downloads until the next poll #
+
+            time_next_poll += poll_seconds
+            while time.time() < time_next_poll:
+                pending_tasks.sort(key = lambda task: task[3])
+                while len(pending_tasks) > 0 and len(running_tasks) < controller.limit:
+                    s3_key, product, band, date, scan_end = pending_tasks.pop()
+                    future = executor.submit(run_download_task, base_path, product, date, band, region, False,
+                                             fetch_mode, output_profile, write_overviews, skip_existing,
+                                             download_retries_per_file + 1)
+                    running_tasks[future] = [s3_key, product, band, date, scan_end]
+
+                if len(running_tasks) == 0:
+                    time.sleep(max(time_next_poll - time.time(), 0))
+                    break
+                futures_done, futures_not_done = concurrent.futures.wait(
+                    list(running_tasks), timeout = max(time_next_poll - time.time(), 0),
+                    return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in futures_done:
+                    handle_finished_task(future)
+            time_next_poll = max(time_next_poll, time.time())
+
+    except KeyboardInterrupt:
+        print('follow mode stopped')
+
+    for future in concurrent.futures.as_completed(list(running_tasks)):
+        handle_finished_task(future)
+    executor.shutdown()
+    listing_executor.shutdown()
+
+    latencies = [result['latency'] for result in results if result['status'] == 'finished']
+    print('------------------------------------------')
+    print('downloaded {:d} files'.format(len(latencies)), end = '')
+    if len(latencies) > 0:
+        print(', latency since scan end: mean {:.1f}s, max {:.1f}s'.format(
+               sum(latencies) / len(latencies), max(latencies)), end = '')
+    print()
+    print(controller.format_stats())
+
+    return results
+
+############################################################################
+############################################################################
+############################################################################
+
+def run_backfill_job(base_path, product_fullname, region, bands, backfill_settings, download_retries_per_file,
+                     fetch_mode = 'full_file', output_profile = 'default', write_overviews = False,
+                     skip_existing = 'size', adaptive_concurrency = False):
+
+    # download all scans of a date range as one resumable job with a pool of worker processes #
+    #  the scan times are planned with the product cadence, files already in the archive manifest or finished in #
+    #  the job checkpoint are not planned again, the checkpoint is saved every 30s and when the job is stopped #
+
+    job_name = backfill_settings['job_name']
+    scan_times = plan_scan_times(product_fullname, backfill_settings['datetime_start'],
+                                 backfill_settings['datetime_end'], backfill_settings['step'],
+                                 backfill_settings['cron'])
+
+    job_spec = dict(product = product_fullname, region = region, bands = list(bands),
+                    datetime_start = backfill_settings['datetime_start'].isoformat(),
+                    datetime_end = backfill_settings['datetime_end'].isoformat(),
+                    step = None if backfill_settings['step'] is None else backfill_settings['step'].total_seconds(),
+                    cron = backfill_settings['cron'])
+    checkpoint = load_job_checkpoint(base_path, product_fullname, job_name, job_spec)
+
+    finished_keys = set(checkpoint['finished'])
+    if skip_existing != 'none' and len(scan_times) > 0:
+        for band, scan_start in find_completed_scans(base_path, product_fullname, region,
+                                                     scan_times[0], scan_times[-1]):
+            finished_keys.add(get_job_task_key(datetime.datetime.fromisoformat(scan_start), band))
+
+    task_queue = collections.deque([[date, band] for date in scan_times for band in bands
+                                    if get_job_task_key(date, band) not in finished_keys])
+
+    print('job:'.ljust(8), job_name, scan_times[0] if len(scan_times) > 0 else '', 'to',
+          scan_times[-1] if len(scan_times) > 0 else '', 'region:', region)
+    print('planned {:d} scans of {:d} bands, {:d} files already done, {:d} files still to download'.format(
+           len(scan_times), len(bands), len(scan_times) * len(bands) - len(task_queue), len(task_queue)))
+    print('------------------------------------------')
+
+    cleanup_archive_orphans(base_path, product_fullname)
+
+    controller = ConcurrencyController(1, backfill_settings['num_processes'], adaptive = adaptive_concurrency)
+    results = []
+    running_tasks = dict()
+    time_saved = time.time()
+
+    try:
+        # every worker process gets its share of the memory budget, so all of them together stay within it #
+
+        with concurrent.futures.ProcessPoolExecutor(
+               max_workers = backfill_settings['num_processes'], initializer = set_memory_budget,
+               initargs = (memory_budget_bytes // backfill_settings['num_processes'],)) as executor:
+            while len(task_queue) > 0 or len(running_tasks) > 0:
+                while len(task_queue) > 0 and len(running_tasks) < controller.limit:
+                    date, band = task_queue.popleft()
+                    future = executor.submit(run_download_task, base_path, product_fullname, date, band, region,
+                                             False, fetch_mode, output_profile, write_overviews, skip_existing,
+                                             download_retries_per_file + 1)
+                    running_tasks[future] = [date, band]
+
+                futures_done, futures_not_done = concurrent.futures.wait(
+                    list(running_tasks), return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in futures_done:
+                    date, band = running_tasks.pop(future)
+                    task_key = get_job_task_key(date, band)
+                    try:
+                        results.append(future.result())
+                        record_task_result(controller, results[-1])
+                        checkpoint['finished'].append(task_key)
+                        checkpoint['failed'].pop(task_key, None)
+                    except Exception as exception:
+                        results.append(dict(product = product_fullname, band = band, date = date, status = 'failed',
+                                            filename = None, seconds = None, error = repr(exception)))
+                        controller.record(0.0, 0, error = exception)
+                        checkpoint['failed'][task_key] = repr(exception)
+                        print('failed GOES-16 ABI {} B{:02d}, {}: {!r}'.format(product_fullname, band, date, exception))
+
+                if time.time() - time_saved > 30:
+                    save_job_checkpoint(base_path, product_fullname, job_name, checkpoint)
+                    print('{:d} files to go,'.format(len(task_queue) + len(running_tasks)), controller.format_stats())
+                    time_saved = time.time()
+
+    except KeyboardInterrupt:
+        print('job {} stopped, run it again to resume'.format(job_name))
+
+    save_job_checkpoint(base_path, product_fullname, job_name, checkpoint)
+
+    print('------------------------------------------')
+    print('job {}: {:d} files finished, {:d} failed'.format(
+           job_name, len(checkpoint['finished']), len(checkpoint['failed'])))
+    print(controller.format_stats())
+
+    return results
+
+############################################################################
+############################################################################
+############################################################################
+
+def run_download_pipeline(base_path, product_fullname, region, date_bands, output_profile, write_overviews,
+                          skip_existing, pipeline_settings, controller, download_retries_per_file):
+
+    # pipelined execution: I/O-bound fetch threads -> CPU-bound crop processes -> write threads #
+    #  every stage has its own concurrency and is connected to the next one by a bounded queue, so the network and #
+    #  the CPUs are busy at the same time and a slow stage blocks the stages before it instead of filling the memory #
+    #  the crop stage uses one thread per crop process that waits for its result, mesoscale files are not cropped #
+    #  the concurrency controller limits how many of the fetch threads download at the same time #
+
+    product = product_fullname[:8]
+    path = dict(base = base_path,
+                data = 'data/ABI/GOES-16/{}/'.format(product))
+
+    task_queue = queue.Queue()
+    crop_queue = queue.Queue(maxsize = pipeline_settings['queue_size'])
+    write_queue = queue.Queue(maxsize = pipeline_settings['queue_size'])
+    for date_band in date_bands:
+        task_queue.put(date_band)
+
+    results = []
+    results_lock = threading.Lock()
+
+    def add_result(date, band, status, filename, t1, error):
+        with results_lock:
+            results.append(dict(product = product_fullname, band = band, date = date, status = status,
+                                filename = filename, seconds = time.time() - t1, error = error))
+        if status == 'failed':
+            print('failed GOES-16 ABI {} B{:02d}, {}: {}'.format(product_fullname, band, date, error))
+
+    def fetch_stage():
+        s3_client = get_s3_client()
+        while True:
+            try:
+                date, band = task_queue.get_nowait()
+            except queue.Empty:
+                return
+            t1 = time.time()
+            try:
+                if skip_existing != 'none':
+                    filename = find_completed_file(base_path, product_fullname, band, date, region, skip_existing)
+                    if filename is not None:
+                        add_result(date, band, 'skipped', filename, t1, None)
+                        continue
+
+                s3_object = find_s3_object(base_path, s3_client, s3_bucket_name, product_fullname, band, date)
+                if s3_object is None:
+                    raise FileNotFoundError('GOES-16 ABI {} B{:02d} {} not found in s3 bucket {}'.format(
+                                             product_fullname, band, date, s3_bucket_name))
+
+                acquire_memory_budget(s3_object[1])
+                controller.acquire()
+                try:
+                    t2 = time.time()
+                    file_bytes, num_retries, num_throttled = call_with_backoff(
+                        fetch_file_bytes, (s3_client, s3_object[0]), download_retries_per_file + 1)
+                    controller.record(time.time() - t2, s3_object[1], num_retries, num_throttled)
+                except Exception:
+                    release_memory_budget(s3_object[1])
+                    raise
+                finally:
+                    controller.release()
+                crop_queue.put([date, band, s3_object, file_bytes, t1])
+                del file_bytes
+            except Exception as exception:
+                controller.record(0.0, 0, error = exception)
+                add_result(date, band, 'failed', None, t1, repr(exception))
+
+    def crop_stage(executor):
+        while True:
+            item = crop_queue.get()
+            if item is None:
+                return
+            date, band, s3_object, file_bytes, t1 = item
+            try:
+                if product == 'L2-CMIPF':
+                    dataset_region = executor.submit(crop_file_bytes, file_bytes, band, region).result()
+                    write_queue.put([date, band, s3_object, dataset_region, t1])
+                else:
+                    write_queue.put([date, band, s3_object, file_bytes, t1])
+            except Exception as exception:
+                add_result(date, band, 'failed', None, t1, repr(exception))
+            finally:
+                if product == 'L2-CMIPF':
+                    release_memory_budget(s3_object[1])
+            del item, file_bytes
+
+    def write_stage():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            date, band, s3_object, data, t1 = item
+            try:
+                os.makedirs(path['base'] + path['data'] + 'b{:02d}'.format(band), exist_ok = True)
+                if product == 'L2-CMIPF':
+                    filename = s3_object[0][28:-3] + '_region-' + region + '.nc'
+                    write_region_file(path, band, filename, data, output_profile, write_overviews)
+                else:
+                    filename = s3_object[0][28:]
+                    filepath = path['base'] + path['data'] + 'b{:02d}/'.format(band) + filename
+                    with open(filepath + '.part', 'wb') as file:
+                        file.write(data)
+                    os.replace(filepath + '.part', filepath)
+                record_archive_file(base_path, product_fullname, band, date, region, filename)
+                record_file_access(base_path, path['data'] + 'b{:02d}/'.format(band) + filename)
+                add_result(date, band, 'finished', filename, t1, None)
+                print('downloaded GOES-16 ABI {} B{:02d}, {:02d}.{:02d}.{:4d}, {:02d}:{:02d}UTC'.format(
+                       product_fullname, band, date.day, date.month, date.year, date.hour, date.minute))
+            except Exception as exception:
+                add_result(date, band, 'failed', None, t1, repr(exception))
+            finally:
+                if product != 'L2-CMIPF':
+                    release_memory_budget(s3_object[1])
+            del item, data
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = pipeline_settings['num_crop_processes']) as executor:
+        fetch_threads = [threading.Thread(target = fetch_stage)
+                         for i in range(pipeline_settings['num_fetch_threads'])]
+        crop_threads = [threading.Thread(target = crop_stage, args = (executor,))
+                        for i in range(pipeline_settings['num_crop_processes'])]
+        write_threads = [threading.Thread(target = write_stage)
+                         for i in range(pipeline_settings['num_write_threads'])]
+        for thread in fetch_threads + crop_threads + write_threads:
+            thread.start()
+
+        for thread in fetch_threads:
+            thread.join()
+        for thread in crop_threads:
+            crop_queue.put(None)
+        for thread in crop_threads:
+            thread.join()
+        for thread in write_threads:
+            write_queue.put(None)
+        for thread in write_threads:
+            thread.join()
+
+    return results
+
+############################################################################
+############################################################################
+############################################################################
+
+def fetch_file_bytes(s3_client, s3_key):
+
+    file_buffer = io.BytesIO()
+    s3_client.download_fileobj(s3_bucket_name, s3_key, file_buffer, Config = s3_transfer_config)
+
+    return file_buffer.getvalue()
+
+############################################################################
+
+def crop_file_bytes(file_bytes, band, region):
+
+    # crop stage of the pipeline, runs in a worker process and returns the loaded regional dataset #
+
+    dataset_full = xr.open_dataset(io.BytesIO(file_bytes), engine = 'h5netcdf')
+    dataset_region = crop_dataset_to_region(dataset_full, band, region).load()
+    dataset_full.close()
+
+    return dataset_region
+
+############################################################################
+############################################################################
+############################################################################
+
+def order_download_tasks(date_bands, bands, task_priority):
+
+    # sort the [date, band] tasks into the order in which they should be downloaded #
+    #  'chronological': oldest scan first, bands in the order of the bands list #
+    #  'newest_first':  newest scan first, bands in the order of the bands list #
+    #  'band_order':    all scans of the first band in the bands list first, e.g. the bands the next render needs #
+
+    if task_priority == 'chronological':
+        return sorted(date_bands, key = lambda date_band: (date_band[0], bands.index(date_band[1])))
+    elif task_priority == 'newest_first':
+        return sorted(date_bands, key = lambda date_band: (-date_band[0].timestamp(), bands.index(date_band[1])))
+    elif task_priority == 'band_order':
+        return sorted(date_bands, key = lambda date_band: (bands.index(date_band[1]), date_band[0]))
+    else:
+        print('task_priority {} not supported yet!'.format(task_priority))
+        exit()
+
+############################################################################
+############################################################################
+############################################################################
+
+def run_download_task(base_path, product_fullname, date, band, region, distributed_exec, fetch_mode, output_profile,
+                      write_overviews, skip_existing, max_attempts = 1):
+
+    # download one file and return its per-file result, exceptions are passed on to the caller #
+    #  files already completed according to the archive manifest are skipped unless skip_existing is 'none' #
+    #  throttling and transient errors are retried up to max_attempts with jittered exponential backoff #
+
+    t1 = time.time()
+
+    if skip_existing != 'none':
+        filename = find_completed_file(base_path, product_fullname, band, date, region, skip_existing)
+        if filename is not None:
+            return dict(product = product_fullname, band = band, date = date, status = 'skipped',
+                        filename = filename, seconds = time.time() - t1, error = None,
+                        bytes = 0, retries = 0, throttled = 0)
+
+    (filename, num_bytes), num_retries, num_throttled = call_with_backoff(
+        fetch_single_abi_file,
+        (base_path, product_fullname, date, band, region, distributed_exec, fetch_mode, output_profile,
+         write_overviews),
+        max_attempts)
+    record_archive_file(base_path, product_fullname, band, date, region, filename)
+    record_file_access(base_path, 'data/ABI/GOES-16/{}/b{:02d}/'.format(product_fullname[:8], band) + filename)
+
+    return dict(product = product_fullname, band = band, date = date, status = 'finished',
+                filename = filename, seconds = time.time() - t1, error = None,
+                bytes = num_bytes, retries = num_retries, throttled = num_throttled)
+
+############################################################################
+
+def record_task_result(controller, result):
+
+    # only downloaded files tell something about the network, skipped files are not recorded #
+
+    if result['status'] == 'finished':
+        controller.record(result['seconds'], result['bytes'], result['retries'], result['throttled'])
+
     return
 
 ############################################################################
 ############################################################################
 ############################################################################
 
-def download_single_abi_file(base_path, product_fullname, date, band, region, distributed_exec):
+def download_single_abi_file(base_path, product_fullname, date, band, region, distributed_exec,
+                             fetch_mode = 'full_file', output_profile = 'default', write_overviews = False):
+
+    # download one file and return its filename in the band folder, see fetch_single_abi_file #
+
+    return fetch_single_abi_file(base_path, product_fullname, date, band, region, distributed_exec,
+                                 fetch_mode, output_profile, write_overviews)[0]
+
+############################################################################
+
+def fetch_single_abi_file(base_path, product_fullname, date, band, region, distributed_exec,
+                          fetch_mode = 'full_file', output_profile = 'default', write_overviews = False):
+
+    # download one file and return its filename in the band folder and the number of bytes fetched from s3 #
 
     # cut the mesoscale sector number #
 
@@ -221,64 +898,271 @@ def download_single_abi_file(base_path, product_fullname, date, band, region, di
                 data = 'data/ABI/GOES-16/{}/'.format(product))
 
 
-    dayofyear = (date - datetime.datetime(date.year, 1, 1)).days + 1
+    # look up the object key in the local s3 inventory, the hourly prefix is listed only on inventory misses #
 
-    subfolder = 'ABI-{}/{:4d}/{:03d}/{:02d}'.format(product, date.year, dayofyear, date.hour)
+    s3_client = get_s3_client()
 
-    match_string = '*{}-M6C{:02d}_G16_s{:4d}{:03d}{:02d}{:02d}*'.format(
-                    product_fullname, band, date.year, dayofyear, date.hour, date.minute)
+    s3_object = find_s3_object(base_path, s3_client, s3_bucket_name, product_fullname, band, date)
+    if s3_object is None:
+        raise FileNotFoundError('GOES-16 ABI {} B{:02d} {} not found in s3 bucket {}'.format(
+                                 product_fullname, band, date, s3_bucket_name))
 
-    if distributed_exec:
-        s3 = resource('s3')
-    else:
-        s3 = resource('s3', config = Config(signature_version = UNSIGNED))
-
-    noaa_bucket = s3.Bucket('noaa-goes16')
-    file_list = []
-    for object in noaa_bucket.objects.filter(Prefix = subfolder):
-        file_list.append(object.key)
-    
-    filename = fnmatch.filter(file_list, match_string)[0]
-    #print('matched filename')
+    s3_key = s3_object[0]
+    filename = s3_key[28:]
 
-    obj = noaa_bucket.Object(filename)
-    filename = filename[28:]
-    with open(path['base'] + path['data'] + 'temp/' + filename, 'wb') as file:
-        obj.download_fileobj(file)
-
-    del s3
+    band_subfolder = 'b{:02d}'.format(band)
+    os.makedirs(path['base'] + path['data'] + band_subfolder, exist_ok = True)
 
     if product == 'L2-CMIPF':
-        filename_region = cut_file_to_region(path, filename, band, region)
-        band_subfolder = 'b{:02d}'.format(band)
-        if not band_subfolder in os.listdir(path['base'] + path['data']):
-            os.mkdir(path['base'] + path['data'] + band_subfolder)
-        os.rename(path['base'] + path['data'] + 'temp/' + filename_region,
-                  path['base'] + path['data'] + band_subfolder + '/' + filename_region)
-        os.remove(path['base'] + path['data'] + 'temp/' + filename)
+        if fetch_mode == 'byte_range':
+            filename_region, num_bytes = fetch_file_region_byte_range(
+                path, s3_client, s3_key, s3_object[1], filename, band, region, output_profile, write_overviews)
+        elif fetch_mode == 'memory':
+            filename_region, num_bytes = fetch_file_region_memory(
+                path, s3_client, s3_key, s3_object[1], filename, band, region, output_profile, write_overviews)
+        else:
+            with open(path['base'] + path['data'] + 'temp/' + filename, 'wb') as file:
+                s3_client.download_fileobj(s3_bucket_name, s3_key, file, Config = s3_transfer_config)
+            filename_region = cut_file_to_region(path, filename, band, region, output_profile,
+                                                 write_overviews)
+            os.remove(path['base'] + path['data'] + 'temp/' + filename)
+            os.rename(path['base'] + path['data'] + 'temp/' + filename_region,
+                      path['base'] + path['data'] + band_subfolder + '/' + filename_region)
+            num_bytes = s3_object[1]
         print('downloaded GOES-16 ABI {} B{:02d}, {:02d}.{:02d}.{:4d}, {:02d}:{:02d}UTC'.format(
                product_fullname, band, date.day, date.month, date.year, date.hour, date.minute))
-        return filename_region
+        return filename_region, num_bytes
 
     elif product == 'L2-CMIPM':
-        band_subfolder = 'b{:02d}'.format(band)
-        if not band_subfolder in os.listdir(path['base'] + path['data']):
-            os.mkdir(path['base'] + path['data'] + band_subfolder)
-        os.rename(path['base'] + path['data'] + 'temp/' + filename,
-                  path['base'] + path['data'] + band_subfolder + '/' + filename)
+        if fetch_mode == 'memory':
+            acquire_memory_budget(s3_object[1])
+            try:
+                file_buffer = io.BytesIO()
+                s3_client.download_fileobj(s3_bucket_name, s3_key, file_buffer, Config = s3_transfer_config)
+                filepath = path['base'] + path['data'] + band_subfolder + '/' + filename
+                with open(filepath + '.part', 'wb') as file:
+                    file.write(file_buffer.getbuffer())
+                os.replace(filepath + '.part', filepath)
+                del file_buffer
+            finally:
+                release_memory_budget(s3_object[1])
+        else:
+            with open(path['base'] + path['data'] + 'temp/' + filename, 'wb') as file:
+                s3_client.download_fileobj(s3_bucket_name, s3_key, file, Config = s3_transfer_config)
+            os.rename(path['base'] + path['data'] + 'temp/' + filename,
+                      path['base'] + path['data'] + band_subfolder + '/' + filename)
         print('downloaded GOES-16 ABI {} B{:02d}, {:02d}.{:02d}.{:02d}, {:02d}:{:02d}UTC'.format(
                product_fullname, band, date.day, date.month, date.year, date.hour, date.minute))
-        return filename
+        return filename, s3_object[1]
 
 ############################################################################
 ############################################################################
-############################################################################
 
-def cut_file_to_region(path, filename_full, band, region):
+def cut_file_to_region(path, filename_full, band, region, output_profile = 'default', write_overviews = False):
 
     filename_region = filename_full[:-3] + '_region-' + region + '.nc'
     dataset_full = xr.open_dataset(path['base'] + path['data'] + 'temp/' + filename_full)
 
+    dataset_region = crop_dataset_to_region(dataset_full, band, region)
+    if write_overviews:
+        dataset_region = add_overview_levels(dataset_region)
+    dataset_region.to_netcdf(path['base'] + path['data'] + 'temp/' + filename_region, format = 'NETCDF4',
+                             encoding = get_region_file_encoding(dataset_region, band, output_profile))
+
+    dataset_region.close()
+    dataset_full.close()
+
+
+    return filename_region
+
+############################################################################
+############################################################################
+############################################################################
+
+def crop_dataset_to_region(dataset_full, band, region):
+
+    # crop arrays to region boundaries #
+    #  isel on the lazily opened dataset only slices the CMI and DQF backend arrays, so only the region hyperslab is #
+    #  ever decoded when the result is loaded or written, all variables without x/y dims are carried over uncopied #
+
+    y_min, y_max, x_min, x_max = get_region_bounds(band, region)
+
+    dataset_region = dataset_full.isel(y = slice(y_min, y_max), x = slice(x_min, x_max))
+    dataset_region['x'].attrs['_FillValue'] = -1    # full disk variable range is -0.151844 to 0.151844
+    dataset_region['y'].attrs['_FillValue'] = -1    # full disk variable range is -0.151844 to 0.151844
+
+    return dataset_region
+
+############################################################################
+############################################################################
+############################################################################
+
+def fetch_file_region_byte_range(path, s3_client, s3_key, size, filename_full, band, region, output_profile,
+                                 write_overviews):
+
+    # read only the chunk index and the compressed CMI and DQF chunks inside the region with ranged GETs #
+    #  the full-disk file is never downloaded, the regional file is written directly into the band folder #
+    #  returns the regional filename and the number of bytes of all ranged GETs #
+
+    filename_region = filename_full[:-3] + '_region-' + region + '.nc'
+
+    y_min, y_max, x_min, x_max = get_region_bounds(band, region)
+
+    range_file = S3RangeFile(s3_client, s3_bucket_name, s3_key, size)
+    prefetch_chunks(range_file, ['CMI', 'DQF'], y_min, y_max, x_min, x_max)
+
+    dataset_full = xr.open_dataset(range_file, engine = 'h5netcdf')
+    dataset_region = crop_dataset_to_region(dataset_full, band, region).load()
+    write_region_file(path, band, filename_region, dataset_region, output_profile, write_overviews)
+
+    dataset_region.close()
+    dataset_full.close()
+
+    print('fetched {:.1f} of {:.1f} MB with {:d} ranged GET requests'.format(
+           range_file.bytes_fetched / 1024**2, size / 1024**2, range_file.num_requests))
+
+
+    return filename_region, range_file.bytes_fetched
+
+############################################################################
+############################################################################
+############################################################################
+
+def fetch_file_region_memory(path, s3_client, s3_key, size, filename_full, band, region, output_profile,
+                             write_overviews):
+
+    # download the full-disk file into memory and crop it there, only the regional file is written to disk #
+    #  the in-flight memory budget is acquired before the download and blocks while other threads hold too much #
+    #  returns the regional filename and the number of bytes downloaded #
+
+    filename_region = filename_full[:-3] + '_region-' + region + '.nc'
+
+    acquire_memory_budget(size)
+    try:
+        file_buffer = io.BytesIO()
+        s3_client.download_fileobj(s3_bucket_name, s3_key, file_buffer, Config = s3_transfer_config)
+        num_bytes = file_buffer.getbuffer().nbytes
+        file_buffer.seek(0)
+
+        dataset_full = xr.open_dataset(file_buffer, engine = 'h5netcdf')
+        dataset_region = crop_dataset_to_region(dataset_full, band, region).load()
+        dataset_full.close()
+        del file_buffer
+    finally:
+        release_memory_budget(size)
+
+    write_region_file(path, band, filename_region, dataset_region, output_profile, write_overviews)
+
+    dataset_region.close()
+
+
+    return filename_region, num_bytes
+
+############################################################################
+############################################################################
+############################################################################
+
+def write_region_file(path, band, filename_region, dataset_region, output_profile, write_overviews = False):
+
+    # write the regional file next to its final name first and rename it then, so a crash never leaves #
+    #  a partially written file under its final name in the band folder #
+
+    filepath = path['base'] + path['data'] + 'b{:02d}/'.format(band) + filename_region
+    if write_overviews:
+        dataset_region = add_overview_levels(dataset_region)
+    dataset_region.to_netcdf(filepath + '.part', format = 'NETCDF4',
+                             encoding = get_region_file_encoding(dataset_region, band, output_profile))
+    os.replace(filepath + '.part', filepath)
+
+    return
+
+############################################################################
+############################################################################
+############################################################################
+
+def get_region_file_encoding(dataset_region, band, output_profile):
+
+    # returns the netcdf encoding of CMI and DQF for the regional file #
+    #  'default':         encoding taken over from the full-disk file as it is #
+    #  'compressed':      CMI packed as scaled int16 with the original scale_factor and add_offset, zlib level 4 #
+    #  'compressed_fast': like compressed but zlib level 1, writes about twice as fast and is only slightly larger #
+    #  the chunks are 256 x 256 pixels at 2km resolution (scaled for the 1km and 0.5km bands), close to the size #
+    #  of the 300km domains, so loading a domain only decompresses a few chunks #
+    #  overview levels in the dataset are packed like CMI and DQF and compressed, see abi_overviews #
+
+    if output_profile == 'default':
+        return get_overview_encoding(dataset_region)
+    elif output_profile == 'compressed':
+        complevel = 4
+    elif output_profile == 'compressed_fast':
+        complevel = 1
+    else:
+        print('output_profile {} not supported yet!'.format(output_profile))
+        exit()
+
+    f_res = int(round(2.0 / get_band_info(band, 'resolution_nadir')))
+    chunksizes = (min(256 * f_res, dataset_region.sizes['y']), min(256 * f_res, dataset_region.sizes['x']))
+
+    encoding = dict()
+    for variable_name in ['CMI', 'DQF']:
+        encoding[variable_name] = dict(zlib = True, complevel = complevel, shuffle = True, chunksizes = chunksizes)
+        for packing_key in ['dtype', 'scale_factor', 'add_offset', '_FillValue', '_Unsigned']:
+            if packing_key in dataset_region[variable_name].encoding:
+                encoding[variable_name][packing_key] = dataset_region[variable_name].encoding[packing_key]
+
+    if 'dtype' not in encoding['CMI']:
+        encoding['CMI']['dtype'] = 'int16'
+        encoding['CMI']['scale_factor'] = dataset_region['CMI'].attrs.get('scale_factor', 1.0)
+        encoding['CMI']['add_offset'] = dataset_region['CMI'].attrs.get('add_offset', 0.0)
+        encoding['CMI']['_FillValue'] = -1
+
+    encoding.update(get_overview_encoding(dataset_region, complevel))
+
+    return encoding
+
+############################################################################
+############################################################################
+############################################################################
+
+def set_memory_budget(num_bytes):
+
+    # set the in-flight memory budget of this process, used as initializer of the worker processes of a pool #
+
+    global memory_budget_bytes
+    memory_budget_bytes = num_bytes
+
+    return
+
+############################################################################
+
+def acquire_memory_budget(num_bytes):
+
+    # wait until num_bytes fit into the in-flight memory budget of this process and reserve them #
+    #  a single file larger than the whole budget is let through once nothing else is in flight #
+
+    with memory_budget_condition:
+        while memory_in_flight['bytes'] > 0 and memory_in_flight['bytes'] + num_bytes > memory_budget_bytes:
+            memory_budget_condition.wait()
+        memory_in_flight['bytes'] += num_bytes
+
+    return
+
+def release_memory_budget(num_bytes):
+
+    with memory_budget_condition:
+        memory_in_flight['bytes'] -= num_bytes
+        memory_budget_condition.notify_all()
+
+    return
+
+############################################################################
+############################################################################
+############################################################################
+
+def get_region_bounds(band, region):
+
+    # returns the full-disk index bounds y_min, y_max, x_min, x_max (exclusive) of a region at the band resolution #
+
 
     # base resolution is 2km at nadir, bands 1,3,5 have 1km resolution at nadir and band 2 is 0.5km at nadir #
 
@@ -292,7 +1176,7 @@ def cut_file_to_region(path, filename_full, band, region):
         f_res = 1
 
 
-    # add new regions here #
+    # add new regions with fixed 2km indices here, regions made up of domains are defined in domain_definitions #
 
     if region == 'fulldisk':
         y_min = 0
@@ -314,27 +1198,36 @@ def cut_file_to_region(path, filename_full, band, region):
         y_max = 4400
         x_min = 2350
         x_max = 3450
+    else:
+        y_min, y_max, x_min, x_max = calc_domains_region_bounds(tuple(get_region_domain_names(region)))
 
 
-    # crop arrays to region boundaries #
+    return y_min * f_res, y_max * f_res, x_min * f_res, x_max * f_res
 
-    dataset_region = dataset_full.copy(deep = True)
-    dataset_region = dataset_region.drop_dims(['x', 'y'])
-    dataset_region['x'] = dataset_full['x'][x_min * f_res : x_max * f_res]
-    dataset_region['y'] = dataset_full['y'][y_min * f_res : y_max * f_res]
-    dataset_region['CMI'] = dataset_full['CMI'][y_min * f_res : y_max * f_res, x_min * f_res : x_max * f_res]
-    dataset_region['DQF'] = dataset_full['DQF'][y_min * f_res : y_max * f_res, x_min * f_res : x_max * f_res]
-    dataset_region['x'].attrs['_FillValue'] = -1    # full disk variable range is -0.151844 to 0.151844
-    dataset_region['y'].attrs['_FillValue'] = -1    # full disk variable range is -0.151844 to 0.151844
-    dataset_region.to_netcdf(path['base'] + path['data'] + 'temp/' + filename_region)
+############################################################################
+############################################################################
+############################################################################
 
-    dataset_region.close()
-    dataset_full.close()
+@functools.lru_cache(maxsize = None)
+def calc_domains_region_bounds(domain_names):
 
+    # returns the 2km index bounds of the union of the fixed grid boxes of all domains, cached per domain set #
+    #  every domain box contains the lat/lon box that load_data_single_band crops to (20% radius margin) #
+    #  the box is computed on the 2km grid and scaled for the finer bands, so all bands cover the same area #
 
-    return filename_region
+    y_min, y_max, x_min, x_max = 5424, 0, 5424, 0
+    for domain_name in domain_names:
+        domain = get_image_domain(domain_name)
+        cutout = get_domain_cutout(domain, 0.2 * domain['radius'] / 111)
+        domain_bounds = calc_latlon_box_index_bounds(cutout['lat_min'], cutout['lat_max'],
+                                                     cutout['lon_min'], cutout['lon_max'], 2.0)
+        y_min = min(y_min, domain_bounds[0])
+        y_max = max(y_max, domain_bounds[1])
+        x_min = min(x_min, domain_bounds[2])
+        x_max = max(x_max, domain_bounds[3])
+
+    return y_min, y_max, x_min, x_max
 
-############################################################################
 ############################################################################
 ############################################################################
 
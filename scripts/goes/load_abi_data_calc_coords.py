@@ -5,27 +5,35 @@
 ###                                                                                                                  ###
 ###  Author: Marco Wurth, July 2021                                                                                  ###
 ###  Tested with Python 3.9 and Fedora Linux                                                                         ###
-###  Non-standard packages needed: numpy, xarray, netcdf4, pyproj, xesmf                                             ###
+###  Non-standard packages needed: numpy, xarray, netcdf4, xesmf, dask                                               ###
 ###                                                                                                                  ###
 ###  Content:                                                                                                        ###
 ###   This module is for ABI's L2-CMIP file reading, geolocation calculation, domain cropping and downsampling       ###
+###   Single bands, band combinations and stacks of any number of bands can be loaded                                ###
+###   Time series of a single band are opened as lazy (time, y, x) cube with chunks of a few timesteps               ###
 ###                                                                                                                  ###
 ###  Usage:                                                                                                          ###
 ###   This module here containes functions that have to be imported by another function or script                    ###
 ###                                                                                                                  ###
 ########################################################################################################################
 
-import os
 import datetime
-import fnmatch
+import concurrent.futures
 
 import numpy as np
 import xarray as xr
-import pyproj
-import xesmf
+import dask
+import dask.array
 
 from general.domain_definitions import get_image_domain
-from general.crop_data import crop_data
+from general.crop_data import calc_crop_indices, get_domain_cutout
+from goes.abi_information import get_band_info
+from goes.abi_quota import record_file_access
+from goes.abi_archive import find_archive_file, find_archive_files
+from goes.abi_fixed_grid import calc_latlon_box_vector_index_bounds, upsample_blocks, downsample_blocks
+from goes.abi_geolocation import get_latlon_grids, get_projection, get_geolocation_key
+from goes.abi_regridding import get_regridder
+from goes.abi_overviews import select_overview_level, get_overview_names, sum_blocks
 
 ########################################################################################################################
 #  This function loads data from a single band and timestep, calculates its geolocation and performs domain cropping   #
@@ -64,25 +72,16 @@ def load_data_single_band(
 
     # search and open goes-16 file #
 
-    dayofyear = (date_data_file - datetime.datetime(date_data_file.year, 1, 1)).days + 1
-    match_string = '*{}-M6C{:02d}_G16_s{:4d}{:03d}{:02d}{:02d}*region-{}.nc'.format(
-                    product_fullname, band,
-                    date_data_file.year, dayofyear, date_data_file.hour, date_data_file.minute,
-                    region)
-    files_list = os.listdir(path['base'] + path['data'] + 'b{:02d}/'.format(band))
-
-    filename = None
-    for file in files_list:
-        if fnmatch.fnmatch(file, match_string):
-            filename = file
+    filename = find_archive_file(base_path, product_fullname, band, date_data_file, region)
     if filename == None:
         print('----- abi file not found -----')
-        print('----- match_string: {} -----'.format(match_string))
+        print('----- product: {}, band: {:d}, date: {}, region: {} -----'.format(
+               product_fullname, band, date_data_file, region))
         print('----- path: {} -----'.format(path['base'] + path['data'] + 'b{:02d}/'.format(band)))
         return
 
     goes_dataset = xr.open_dataset(path['base'] + path['data'] + 'b{:02d}/'.format(band) + filename)
-    image_array = goes_dataset['CMI'].values
+    record_file_access(base_path, path['data'] + 'b{:02d}/'.format(band) + filename)
 
 
     # set offset to the ABI file geolocation in metres #
@@ -91,44 +90,60 @@ def load_data_single_band(
     y_offset = 0
 
 
+    # read the largest overview level of the file that fits the downsampling factor, see abi_overviews #
+    #  only the remaining factor is done by nearest neighbor regridding below #
+
+    overview_factor, downsampling_factor = select_overview_level(goes_dataset, downsampling_factor)
+    names = get_overview_names(overview_factor)
+
+
     # calculate geographical coordinates of the data file coordinates #
 
-    x = goes_dataset['x'].values + x_offset
-    y = goes_dataset['y'].values + y_offset
+    x = goes_dataset[names['x']].values + x_offset
+    y = goes_dataset[names['y']].values + y_offset
 
     sat = dict(goes_number = 16)
     sat['h'] = goes_dataset['goes_imager_projection'].perspective_point_height
     sat['lon'] = goes_dataset['goes_imager_projection'].longitude_of_projection_origin
     sat['sweep'] = goes_dataset['goes_imager_projection'].sweep_angle_axis
 
-    p = pyproj.Proj(proj = 'geos', h = sat['h'], lon_0 = sat['lon'], sweep = sat['sweep'], ellps = 'GRS80')
-    xx, yy = np.meshgrid(x * sat['h'], y * sat['h'])
-    lons, lats = p(xx, yy, inverse = True)
+    # the lat/lon grids are read from the geolocation cache, off-disk pixels are nan #
+
+    lats, lons = get_latlon_grids(base_path, x, y, goes_dataset['goes_imager_projection'])
+
+
+    # decode only the hyperslab around the plotting domain, the data variable is still lazy up to here #
+
+    domain = get_image_domain(domain_name)
 
-    lats = np.ma.masked_outside(lats, -90.0, 90.0)
-    lons = np.ma.masked_outside(lons, -180.0, 180.0)
+    y_first, y_last, x_first, x_last = calc_domain_hyperslab(product, domain, x, y,
+                                                            goes_dataset['goes_imager_projection'])
+    image_array = goes_dataset[names['CMI']][y_first:y_last+1, x_first:x_last+1].values
+
+    lats = np.ma.masked_invalid(lats[y_first:y_last+1, x_first:x_last+1], copy = False)
+    lons = np.ma.masked_invalid(lons[y_first:y_last+1, x_first:x_last+1], copy = False)
     lats.fill_value = 1000
     lons.fill_value = 1000
 
-    del x, y, p, xx, yy
+    grid_key = '{}_y{:d}-{:d}_x{:d}-{:d}'.format(get_geolocation_key(x, y, goes_dataset['goes_imager_projection']),
+                                                 y_first, y_last, x_first, x_last)
+
+    del x, y
     goes_dataset.close()
 
 
     # crop data to plotting domain #
     # the cropping margin is dynamical and 20% degrees of the plot domain radius #
-
-    domain = get_image_domain(domain_name)
+    #  the hyperslab is a few pixels larger than the domain, the crop indices cut it to the exact pixel box #
 
     if product == 'L2-CMIPF' and domain['name'] != 'GOES-East_fulldisk':
-        try:
-            margin_deg = 0.2 * domain['radius'] / 111
-            index_x_first, index_x_last, index_y_first, index_y_last = crop_data(image_array, lats, lons, domain,
-                                                                                 margin_deg, False)
+        margin_deg = 0.2 * domain['radius'] / 111
+        crop_indices = calc_crop_indices(lats, lons, domain, margin_deg, grid_key, base_path)
+        if crop_indices is not None:
+            index_x_first, index_x_last, index_y_first, index_y_last = crop_indices
             image_array = image_array[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
             lats = lats[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
             lons = lons[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
-        except np.AxisError:
-            pass
 
 
     # do effective nearest neighbor regridding if set on #
@@ -137,9 +152,13 @@ def load_data_single_band(
         image_array = image_array[::downsampling_factor, ::downsampling_factor]
         lats = lats[::downsampling_factor, ::downsampling_factor]
         lons = lons[::downsampling_factor, ::downsampling_factor]
-        downsampling_str = '_NNx{:d}'.format(downsampling_factor)
+
+    if overview_factor > 1:
+        downsampling_str = '_AVx{:d}'.format(overview_factor)
     else:
         downsampling_str = ''
+    if downsampling_factor > 1:
+        downsampling_str += '_NNx{:d}'.format(downsampling_factor)
 
 
     lats = lats.filled()
@@ -201,25 +220,47 @@ def load_data_band_combination(
 
     # search and open goes-16 file A #
 
-    dayofyear = (date_data_file - datetime.datetime(date_data_file.year, 1, 1)).days + 1
-    match_string = '*{}-M6C{:02d}_G16_s{:4d}{:03d}{:02d}{:02d}*region-{}.nc'.format(
-                    product_fullname, band_combination[0],
-                    date_data_file.year, dayofyear, date_data_file.hour, date_data_file.minute,
-                    region)
-    files_list = os.listdir(path['base'] + path['data'] + 'b{:02d}/'.format(band_combination[0]))
-
-    filename = None
-    for file in files_list:
-        if fnmatch.fnmatch(file, match_string):
-            filename = file
+    filename = find_archive_file(base_path, product_fullname, band_combination[0], date_data_file, region)
     if filename == None:
         print('----- abi file not found -----')
-        print('----- match_string: {} -----'.format(match_string))
+        print('----- product: {}, band: {:d}, date: {}, region: {} -----'.format(
+               product_fullname, band_combination[0], date_data_file, region))
         print('----- path: {} -----'.format(path['base'] + path['data'] + 'b{:02d}/'.format(band_combination[0])))
         return
 
-    goes_dataset = xr.open_dataset(path['base'] + path['data'] + 'b{:02d}/'.format(band_combination[0]) + filename)
-    image_array_A = goes_dataset['CMI'].values
+    filepath_A = path['data'] + 'b{:02d}/'.format(band_combination[0]) + filename
+
+
+    # search goes-16 file B #
+
+    filename = find_archive_file(base_path, product_fullname, band_combination[1], date_data_file, region)
+    if filename == None:
+        print('----- abi file not found -----')
+        print('----- product: {}, band: {:d}, date: {}, region: {} -----'.format(
+               product_fullname, band_combination[1], date_data_file, region))
+        print('----- path: {} -----'.format(path['base'] + path['data'] + 'b{:02d}/'.format(band_combination[1])))
+        return
+
+    filepath_B = path['data'] + 'b{:02d}/'.format(band_combination[1]) + filename
+
+
+    # read the largest overview level both files have that fits the downsampling factor, see abi_overviews #
+    #  bands of different resolutions stay at full resolution, the overview blocks of their regional files are not #
+    #  aligned with each other in general and the resampling would fall back to xesmf #
+
+    if coordinates_are_equal:
+        overview_factor, downsampling_factor = select_common_overview_level(
+                                                [path['base'] + filepath_A, path['base'] + filepath_B],
+                                                downsampling_factor)
+    else:
+        overview_factor = 1
+    names = get_overview_names(overview_factor)
+
+
+    # open goes-16 file A #
+
+    goes_dataset = xr.open_dataset(path['base'] + filepath_A)
+    record_file_access(base_path, filepath_A)
 
 
     # set offset to the ABI file geolocation in metres #
@@ -230,52 +271,52 @@ def load_data_band_combination(
 
     # calculate geographical coordinates of the data file coordinates #
 
-    x = goes_dataset['x'].values + x_offset
-    y = goes_dataset['y'].values + y_offset
+    x = goes_dataset[names['x']].values + x_offset
+    y = goes_dataset[names['y']].values + y_offset
 
     sat = dict(goes_number = 16)
     sat['h'] = goes_dataset['goes_imager_projection'].perspective_point_height
     sat['lon'] = goes_dataset['goes_imager_projection'].longitude_of_projection_origin
     sat['sweep'] = goes_dataset['goes_imager_projection'].sweep_angle_axis
 
-    p = pyproj.Proj(proj = 'geos', h = sat['h'], lon_0 = sat['lon'], sweep = sat['sweep'], ellps = 'GRS80')
-    xx, yy = np.meshgrid(x * sat['h'], y * sat['h'])
-    lons_A, lats_A = p(xx, yy, inverse = True)
+    # the lat/lon grids are read from the geolocation cache, off-disk pixels are nan #
+
+    lats_A, lons_A = get_latlon_grids(base_path, x, y, goes_dataset['goes_imager_projection'])
+
+
+    # decode only the hyperslab around the plotting domain, the data variable is still lazy up to here #
+
+    domain = get_image_domain(domain_name)
+
+    y_first, y_last, x_first, x_last = calc_domain_hyperslab(product, domain, x, y,
+                                                            goes_dataset['goes_imager_projection'])
+    image_array_A = goes_dataset[names['CMI']][y_first:y_last+1, x_first:x_last+1].values
 
-    lats_A = np.ma.masked_outside(lats_A, -90.0, 90.0)
-    lons_A = np.ma.masked_outside(lons_A, -180.0, 180.0)
+    lats_A = np.ma.masked_invalid(lats_A[y_first:y_last+1, x_first:x_last+1], copy = False)
+    lons_A = np.ma.masked_invalid(lons_A[y_first:y_last+1, x_first:x_last+1], copy = False)
     lats_A.fill_value = np.nan
     lons_A.fill_value = np.nan
     #lats_A = lats_A.filled()
     #lons_A = lons_A.filled()
 
-    del x, y, p, xx, yy
+    grid_key_A = '{}_y{:d}-{:d}_x{:d}-{:d}'.format(get_geolocation_key(x, y, goes_dataset['goes_imager_projection']),
+                                                   y_first, y_last, x_first, x_last)
+    x_A = x[x_first:x_last+1]
+    y_A = y[y_first:y_last+1]
+
+    del x, y
     goes_dataset.close()
 
 
-    # search and open goes-16 file B #
+    # open goes-16 file B #
 
-    dayofyear = (date_data_file - datetime.datetime(date_data_file.year, 1, 1)).days + 1
-    match_string = '*{}-M6C{:02d}_G16_s{:4d}{:03d}{:02d}{:02d}*region-{}.nc'.format(
-                    product_fullname, band_combination[1],
-                    date_data_file.year, dayofyear, date_data_file.hour, date_data_file.minute,
-                    region)
-    files_list = os.listdir(path['base'] + path['data'] + 'b{:02d}/'.format(band_combination[1]))
+    goes_dataset = xr.open_dataset(path['base'] + filepath_B)
+    record_file_access(base_path, filepath_B)
 
-    filename = None
-    for file in files_list:
-        if fnmatch.fnmatch(file, match_string):
-            filename = file
-    if filename == None:
-        print('----- abi file not found -----')
-        print('----- match_string: {} -----'.format(match_string))
-        print('----- path: {} -----'.format(path['base'] + path['data'] + 'b{:02d}/'.format(band_combination[1])))
-        return
-
-    goes_dataset = xr.open_dataset(path['base'] + path['data'] + 'b{:02d}/'.format(band_combination[1]) + filename)
-    image_array_B = goes_dataset['CMI'].values
+    if coordinates_are_equal:
+        image_array_B = goes_dataset[names['CMI']][y_first:y_last+1, x_first:x_last+1].values
 
-    if not coordinates_are_equal:
+    else:
 
         # set offset to the ABI file geolocation in metres #
 
@@ -293,46 +334,60 @@ def load_data_band_combination(
         sat['lon'] = goes_dataset['goes_imager_projection'].longitude_of_projection_origin
         sat['sweep'] = goes_dataset['goes_imager_projection'].sweep_angle_axis
 
-        p = pyproj.Proj(proj = 'geos', h = sat['h'], lon_0 = sat['lon'], sweep = sat['sweep'], ellps = 'GRS80')
-        xx, yy = np.meshgrid(x * sat['h'], y * sat['h'])
-        lons_B, lats_B = p(xx, yy, inverse = True)
+        # the lat/lon grids are read from the geolocation cache, off-disk pixels are nan #
+
+        lats_B, lons_B = get_latlon_grids(base_path, x, y, goes_dataset['goes_imager_projection'])
 
-        lats_B = np.ma.masked_outside(lats_B, -90.0, 90.0)
-        lons_B = np.ma.masked_outside(lons_B, -180.0, 180.0)
+        y_first, y_last, x_first, x_last = calc_domain_hyperslab(product, domain, x, y,
+                                                                goes_dataset['goes_imager_projection'])
+        image_array_B = goes_dataset['CMI'][y_first:y_last+1, x_first:x_last+1].values
+
+        lats_B = np.ma.masked_invalid(lats_B[y_first:y_last+1, x_first:x_last+1], copy = False)
+        lons_B = np.ma.masked_invalid(lons_B[y_first:y_last+1, x_first:x_last+1], copy = False)
         lats_B.fill_value = np.nan
         lons_B.fill_value = np.nan
         #lats_B = lats_B.filled()
         #lons_B = lons_B.filled()
 
-        del x, y, p, xx, yy
+        grid_key_B = '{}_y{:d}-{:d}_x{:d}-{:d}'.format(
+                      get_geolocation_key(x, y, goes_dataset['goes_imager_projection']),
+                      y_first, y_last, x_first, x_last)
+        x_B = x[x_first:x_last+1]
+        y_B = y[y_first:y_last+1]
+
+        del x, y
     goes_dataset.close()
 
 
     # crop data to plotting domain #
     # the cropping margin is dynamical and 20% degrees of the plot domain radius #
-
-    domain = get_image_domain(domain_name)
+    #  the hyperslabs are a few pixels larger than the domain, the crop indices cut them to the exact pixel boxes #
 
     if product == 'L2-CMIPF' and domain['name'] != 'GOES-East_fulldisk':
-        try:
-            margin_deg = 0.2 * domain['radius'] / 111
-            index_x_first, index_x_last, index_y_first, index_y_last = crop_data(image_array_A, lats_A, lons_A,
-                                                                                 domain, margin_deg, False)
+        margin_deg = 0.2 * domain['radius'] / 111
+        crop_indices = calc_crop_indices(lats_A, lons_A, domain, margin_deg, grid_key_A, base_path)
+        if crop_indices is not None:
+            index_x_first, index_x_last, index_y_first, index_y_last = crop_indices
             image_array_A = image_array_A[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
             lats_A = lats_A[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
             lons_A = lons_A[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
+            grid_key_A += '_crop{:d}-{:d}-{:d}-{:d}'.format(*crop_indices)
+            x_A = x_A[index_x_first:index_x_last+1]
+            y_A = y_A[index_y_first:index_y_last+1]
 
             if coordinates_are_equal:
                 image_array_B = image_array_B[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
-            else:
-                index_x_first, index_x_last, index_y_first, index_y_last = crop_data(image_array_B, lats_B, lons_B,
-                                                                                     domain, margin_deg, False)
+
+        if not coordinates_are_equal:
+            crop_indices = calc_crop_indices(lats_B, lons_B, domain, margin_deg, grid_key_B, base_path)
+            if crop_indices is not None:
+                index_x_first, index_x_last, index_y_first, index_y_last = crop_indices
                 image_array_B = image_array_B[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
                 lats_B = lats_B[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
                 lons_B = lons_B[index_y_first:index_y_last+1, index_x_first:index_x_last+1]
-
-        except np.AxisError:
-            pass
+                grid_key_B += '_crop{:d}-{:d}-{:d}-{:d}'.format(*crop_indices)
+                x_B = x_B[index_x_first:index_x_last+1]
+                y_B = y_B[index_y_first:index_y_last+1]
 
 
     if coordinates_are_equal:
@@ -369,25 +424,27 @@ def load_data_band_combination(
             lons = lons_A'''
 
 
-        # resampling with xesmf works but is quite slow for larger domains #
+        # both bands are on the same fixed grid, so the coarser band is replicated block by block in index space #
+        #  resampling with xesmf works but is quite slow for larger domains, it is only used for grids not aligned #
+        #  the regridding weights are only calculated once per domain and stored for later timesteps and runs #
 
         if get_band_info(band_combination[0], 'resolution_nadir') \
          > get_band_info(band_combination[1], 'resolution_nadir'):
-            regridder_1km_to_500m = xesmf.Regridder(dict(lat = np.ascontiguousarray(lats_A),
-                                                         lon = np.ascontiguousarray(lons_A)),
-                                                    dict(lat = np.ascontiguousarray(lats_B),
-                                                         lon = np.ascontiguousarray(lons_B)),
-                                                    'nearest_s2d')
-            image_array_A = regridder_1km_to_500m(np.ascontiguousarray(image_array_A))
+            image_array_upsampled = upsample_blocks(image_array_A, x_A, y_A, x_B, y_B)
+            if image_array_upsampled is None:
+                regridder_1km_to_500m = get_regridder(base_path, lats_A, lons_A, grid_key_A,
+                                                      lats_B, lons_B, grid_key_B, 'nearest_s2d')
+                image_array_upsampled = regridder_1km_to_500m(np.ascontiguousarray(image_array_A))
+            image_array_A = image_array_upsampled
             lats = lats_B
             lons = lons_B
         else:
-            regridder_1km_to_500m = xesmf.Regridder(dict(lat = np.ascontiguousarray(lats_B),
-                                                         lon = np.ascontiguousarray(lons_B)),
-                                                    dict(lat = np.ascontiguousarray(lats_A),
-                                                         lon = np.ascontiguousarray(lons_A)),
-                                                    'nearest_s2d')
-            image_array_B = regridder_1km_to_500m(np.ascontiguousarray(image_array_B))
+            image_array_upsampled = upsample_blocks(image_array_B, x_B, y_B, x_A, y_A)
+            if image_array_upsampled is None:
+                regridder_1km_to_500m = get_regridder(base_path, lats_B, lons_B, grid_key_B,
+                                                      lats_A, lons_A, grid_key_A, 'nearest_s2d')
+                image_array_upsampled = regridder_1km_to_500m(np.ascontiguousarray(image_array_B))
+            image_array_B = image_array_upsampled
             lats = lats_A
             lons = lons_A
 
@@ -400,9 +457,12 @@ def load_data_band_combination(
         lats = lats[::downsampling_factor, ::downsampling_factor]
         lons = lons[::downsampling_factor, ::downsampling_factor]
 
-        downsampling_str = '_NNx{:d}'.format(downsampling_factor)
+    if overview_factor > 1:
+        downsampling_str = '_AVx{:d}'.format(overview_factor)
     else:
         downsampling_str = ''
+    if downsampling_factor > 1:
+        downsampling_str += '_NNx{:d}'.format(downsampling_factor)
 
 
     lats = lats.filled()
@@ -411,3 +471,385 @@ def load_data_band_combination(
 
     return date_sensed, path, sat, domain, downsampling_str, \
            lons, lats, image_array_A, image_array_B
+
+########################################################################################################################
+########################################################################################################################
+########################################################################################################################
+
+########################################################################################################################
+#  This function loads data from any list of bands but one timestep into one (band, y, x) array on the grid of one     #
+#  resolution, geolocation and cropping are done once per resolution and the band files are read concurrently        #
+########################################################################################################################
+
+def load_data_band_stack(
+        base_path, product_fullname, region, mode, bands,
+        date_data_file, sensing_timedelta,
+        domain_name, downsampling_factor,
+        resolution_target = None, block_method = 'mean', num_threads = 8):
+
+    # resolution_target: nadir resolution in km of the stack grid, one of the resolutions of the bands #
+    #  None takes the finest, coarser bands are replicated block by block and finer bands are reduced with the #
+    #  block_method 'mean', 'min' or 'max' #
+
+    # divide product_fullname string into product only and mesoscale sector number #
+
+    if product_fullname == 'L2-CMIPF':
+        product = product_fullname
+    elif product_fullname[:-1] == 'L2-CMIPM':
+        product = product_fullname[:-1]
+        meso_num = int(product_fullname[-1])
+
+
+    # set all paths required in this function #
+
+    path = dict(base = base_path,
+                data = 'data/ABI/GOES-16/{}/'.format(product),
+                image = 'images/GOES-16/{}/'.format(mode),
+                colorpalette = 'data/additional_data/colorpalettes/')
+
+
+    # apply sensing timedelta #
+
+    if product == 'L2-CMIPF':
+        date_sensed = date_data_file + datetime.timedelta(minutes = sensing_timedelta)
+    elif product == 'L2-CMIPM':
+        date_sensed = date_data_file
+
+
+    # search goes-16 files of all bands #
+
+    filepaths = []
+    for band in bands:
+        filename = find_archive_file(base_path, product_fullname, band, date_data_file, region)
+        if filename == None:
+            print('----- abi file not found -----')
+            print('----- product: {}, band: {:d}, date: {}, region: {} -----'.format(
+                   product_fullname, band, date_data_file, region))
+            print('----- path: {} -----'.format(path['base'] + path['data'] + 'b{:02d}/'.format(band)))
+            return
+        filepaths.append(path['data'] + 'b{:02d}/'.format(band) + filename)
+
+    resolutions = [get_band_info(band, 'resolution_nadir') for band in bands]
+    if resolution_target is None:
+        resolution_target = min(resolutions)
+    elif resolution_target not in resolutions:
+        print('stack resolution {} without a band of this resolution not supported yet!'.format(resolution_target))
+        exit()
+
+
+    # read the largest overview level all files have that fits the downsampling factor, see abi_overviews #
+    #  stacks of different resolutions stay at full resolution, the overview blocks of their regional files are not #
+    #  aligned with each other in general and the resampling would fall back to xesmf #
+
+    if len(set(resolutions)) == 1:
+        overview_factor, downsampling_factor = select_common_overview_level(
+                                                [path['base'] + filepath for filepath in filepaths],
+                                                downsampling_factor)
+    else:
+        overview_factor = 1
+
+
+    # calculate geolocation and crop indices once per resolution from the first band file of this resolution #
+
+    domain = get_image_domain(domain_name)
+
+    grids = dict()
+    for resolution, filepath in zip(resolutions, filepaths):
+        if resolution not in grids:
+            grids[resolution] = calc_band_grid(base_path, path['base'] + filepath, product, domain, overview_factor)
+
+    grid_target = grids[resolution_target]
+
+
+    # read the hyperslabs of all band files concurrently #
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = min(num_threads, len(bands))) as executor:
+        image_arrays = list(executor.map(read_band_hyperslab, [path['base'] + filepath for filepath in filepaths],
+                                         [grids[resolution] for resolution in resolutions]))
+
+    for filepath in filepaths:
+        record_file_access(base_path, filepath)
+
+
+    # resample all bands to the stack grid in index space, xesmf is only used for grids not aligned #
+
+    image_stack = np.empty((len(bands), len(grid_target['y']), len(grid_target['x'])), dtype = np.float32)
+
+    for index_band, (resolution, image_array) in enumerate(zip(resolutions, image_arrays)):
+        grid = grids[resolution]
+        if resolution == resolution_target:
+            image_array_resampled = image_array
+        elif resolution > resolution_target:
+            image_array_resampled = upsample_blocks(image_array, grid['x'], grid['y'],
+                                                    grid_target['x'], grid_target['y'])
+        else:
+            image_array_resampled = downsample_blocks(image_array, grid['x'], grid['y'],
+                                                      grid_target['x'], grid_target['y'], block_method)
+
+        if image_array_resampled is None:
+            regridder = get_regridder(base_path, grid['lats'], grid['lons'], grid['grid_key'],
+                                      grid_target['lats'], grid_target['lons'], grid_target['grid_key'],
+                                      'nearest_s2d')
+            image_array_resampled = regridder(np.ascontiguousarray(image_array))
+
+        image_stack[index_band] = image_array_resampled
+
+    sat = grid_target['sat']
+    lats = grid_target['lats']
+    lons = grid_target['lons']
+
+
+    # do effective nearest neighbor regridding if set on #
+
+    if downsampling_factor > 1:
+        image_stack = image_stack[:, ::downsampling_factor, ::downsampling_factor]
+        lats = lats[::downsampling_factor, ::downsampling_factor]
+        lons = lons[::downsampling_factor, ::downsampling_factor]
+
+    if overview_factor > 1:
+        downsampling_str = '_AVx{:d}'.format(overview_factor)
+    else:
+        downsampling_str = ''
+    if downsampling_factor > 1:
+        downsampling_str += '_NNx{:d}'.format(downsampling_factor)
+
+
+    return date_sensed, path, sat, domain, downsampling_str, lons, lats, image_stack
+
+########################################################################################################################
+########################################################################################################################
+########################################################################################################################
+
+########################################################################################################################
+#  This function opens a time range of a single band as lazy (time, y, x) cube with chunks of a few timesteps, the     #
+#  geolocation and crop are calculated once, the data is only read when the cube or a reduction of it is computed      #
+########################################################################################################################
+
+def load_data_time_series(
+        base_path, product_fullname, region, band,
+        datetime_first, datetime_last, sensing_timedelta,
+        domain_name, downsampling_factor, num_chunk_times = 8):
+
+    # returns the sensing dates and a dask array (time, y, x) of all files between datetime_first and datetime_last #
+    #  e.g. image_cube.mean(axis = 0).compute() reads num_chunk_times files at a time and never holds the whole cube #
+    #  all files have to be on the grid of the first file, files of another grid are nan #
+
+    # divide product_fullname string into product only and mesoscale sector number #
+
+    if product_fullname == 'L2-CMIPF':
+        product = product_fullname
+    elif product_fullname[:-1] == 'L2-CMIPM':
+        product = product_fullname[:-1]
+        meso_num = int(product_fullname[-1])
+
+
+    # set all paths required in this function #
+
+    path = dict(base = base_path,
+                data = 'data/ABI/GOES-16/{}/'.format(product),
+                image = 'images/GOES-16/time_series/b{:02d}/'.format(band),
+                colorpalette = 'data/additional_data/colorpalettes/')
+
+
+    # search goes-16 files of the time range #
+
+    files = find_archive_files(base_path, product_fullname, band, region, datetime_first, datetime_last)
+    if len(files) == 0:
+        print('----- no abi files found -----')
+        print('----- product: {}, band: {:d}, dates: {} - {}, region: {} -----'.format(
+               product_fullname, band, datetime_first, datetime_last, region))
+        print('----- path: {} -----'.format(path['base'] + path['data'] + 'b{:02d}/'.format(band)))
+        return
+
+    filepaths = [path['data'] + 'b{:02d}/'.format(band) + filename for date_data_file, filename in files]
+
+
+    # apply sensing timedelta #
+
+    if product == 'L2-CMIPF':
+        dates_sensed = [date_data_file + datetime.timedelta(minutes = sensing_timedelta)
+                        for date_data_file, filename in files]
+    elif product == 'L2-CMIPM':
+        dates_sensed = [date_data_file for date_data_file, filename in files]
+
+
+    # calculate geolocation and crop indices once from the first file #
+
+    #  the largest overview level of the first file that fits the downsampling factor is read, see abi_overviews #
+    #  files without this level are averaged from their full resolution in read_time_chunk #
+
+    domain = get_image_domain(domain_name)
+
+    goes_dataset = xr.open_dataset(path['base'] + filepaths[0])
+    overview_factor, downsampling_factor = select_overview_level(goes_dataset, downsampling_factor)
+    goes_dataset.close()
+
+    grid = calc_band_grid(base_path, path['base'] + filepaths[0], product, domain, overview_factor)
+
+    sat = grid['sat']
+    lats = grid['lats'][::downsampling_factor, ::downsampling_factor]
+    lons = grid['lons'][::downsampling_factor, ::downsampling_factor]
+
+    if overview_factor > 1:
+        downsampling_str = '_AVx{:d}'.format(overview_factor)
+    else:
+        downsampling_str = ''
+    if downsampling_factor > 1:
+        downsampling_str += '_NNx{:d}'.format(downsampling_factor)
+
+
+    # one delayed read per chunk of timesteps, the chunks are concatenated along time without reading anything #
+
+    chunks = []
+    for index_first in range(0, len(filepaths), num_chunk_times):
+        filepaths_chunk = filepaths[index_first:index_first+num_chunk_times]
+        chunks.append(dask.array.from_delayed(
+                       dask.delayed(read_time_chunk)(base_path, filepaths_chunk, grid, downsampling_factor),
+                       shape = (len(filepaths_chunk),) + lats.shape, dtype = np.float32))
+
+    image_cube = dask.array.concatenate(chunks, axis = 0)
+
+
+    return dates_sensed, path, sat, domain, downsampling_str, lons, lats, image_cube
+
+########################################################################################################################
+########################################################################################################################
+########################################################################################################################
+
+def calc_domain_hyperslab(product, domain, x, y, imager_projection):
+
+    # returns the index bounds y_first, y_last, x_first, x_last (inclusive) of the file part that has to be decoded #
+    #  for full disk products the cropping box of the domain is projected into scan angles and looked up in the x/y #
+    #  vectors, mesoscale sectors, the full disk domain and boxes not fully visible are read completely #
+
+    if product == 'L2-CMIPF' and domain['name'] != 'GOES-East_fulldisk':
+        margin_deg = 0.2 * domain['radius'] / 111
+        cutout = get_domain_cutout(domain, margin_deg)
+        index_bounds = calc_latlon_box_vector_index_bounds(x, y, cutout['lat_min'], cutout['lat_max'],
+                                                           cutout['lon_min'], cutout['lon_max'],
+                                                           projection = get_projection(imager_projection))
+        if index_bounds is not None:
+            return index_bounds
+
+    return 0, len(y) - 1, 0, len(x) - 1
+
+########################################################################################################################
+
+def select_common_overview_level(filepaths, downsampling_factor):
+
+    # returns the largest overview factor all files have that divides the downsampling factor and the remaining #
+    #  stride, only the variable names of the files are read #
+
+    overview_factor = downsampling_factor
+    for filepath in filepaths:
+        goes_dataset = xr.open_dataset(filepath)
+        overview_factor = select_overview_level(goes_dataset, overview_factor)[0]
+        goes_dataset.close()
+
+    return overview_factor, downsampling_factor // overview_factor
+
+########################################################################################################################
+
+def calc_band_grid(base_path, filepath, product, domain, overview_factor = 1):
+
+    # returns the grid of a band file cropped to the plotting domain as dict: satellite info, scan angle vectors #
+    #  x, y and lat/lon grids (nan off-disk) of the crop, its index bounds in the file and its grid key #
+    #  only the coordinates of the file are read, of the overview level overview_factor if it is larger than 1 #
+
+    goes_dataset = xr.open_dataset(filepath)
+    imager_projection = goes_dataset['goes_imager_projection']
+    names = get_overview_names(overview_factor)
+
+    x = goes_dataset[names['x']].values
+    y = goes_dataset[names['y']].values
+
+    sat = dict(goes_number = 16)
+    sat['h'] = imager_projection.perspective_point_height
+    sat['lon'] = imager_projection.longitude_of_projection_origin
+    sat['sweep'] = imager_projection.sweep_angle_axis
+
+    lats, lons = get_latlon_grids(base_path, x, y, imager_projection)
+
+    y_first, y_last, x_first, x_last = calc_domain_hyperslab(product, domain, x, y, imager_projection)
+    grid_key = '{}_y{:d}-{:d}_x{:d}-{:d}'.format(get_geolocation_key(x, y, imager_projection),
+                                                 y_first, y_last, x_first, x_last)
+
+    # the cropping margin is dynamical and 20% degrees of the plot domain radius #
+
+    if product == 'L2-CMIPF' and domain['name'] != 'GOES-East_fulldisk':
+        margin_deg = 0.2 * domain['radius'] / 111
+        crop_indices = calc_crop_indices(lats[y_first:y_last+1, x_first:x_last+1],
+                                         lons[y_first:y_last+1, x_first:x_last+1],
+                                         domain, margin_deg, grid_key, base_path)
+        if crop_indices is not None:
+            grid_key += '_crop{:d}-{:d}-{:d}-{:d}'.format(*crop_indices)
+            x_first, x_last = x_first + crop_indices[0], x_first + crop_indices[1]
+            y_first, y_last = y_first + crop_indices[2], y_first + crop_indices[3]
+
+    grid = dict(sat = sat, grid_key = grid_key, overview_factor = overview_factor,
+                y_first = y_first, y_last = y_last, x_first = x_first, x_last = x_last,
+                x = x[x_first:x_last+1],
+                y = y[y_first:y_last+1],
+                lats = np.array(lats[y_first:y_last+1, x_first:x_last+1]),
+                lons = np.array(lons[y_first:y_last+1, x_first:x_last+1]))
+
+    goes_dataset.close()
+
+    return grid
+
+########################################################################################################################
+
+def read_band_hyperslab(filepath, grid):
+
+    # returns the cropped CMI array of a band file as float32, only this hyperslab is decoded #
+
+    goes_dataset = xr.open_dataset(filepath)
+    names = get_overview_names(grid['overview_factor'])
+    image_array = goes_dataset[names['CMI']][grid['y_first']:grid['y_last']+1,
+                                             grid['x_first']:grid['x_last']+1].values.astype(np.float32, copy = False)
+    goes_dataset.close()
+
+    return image_array
+
+########################################################################################################################
+
+def read_time_chunk(base_path, filepaths, grid, downsampling_factor):
+
+    # returns the cropped and downsampled CMI arrays of some files of one band as (time, y, x) float32 array #
+    #  a file whose crop doesn't start at the scan angles of the grid is not on the same grid and stays nan #
+    #  a file without the overview level of the grid is averaged from its full resolution like in abi_overviews #
+
+    image_arrays = np.full((len(filepaths),) + grid['lats'][::downsampling_factor, ::downsampling_factor].shape,
+                           np.nan, dtype = np.float32)
+
+    for index_time, filepath in enumerate(filepaths):
+        goes_dataset = xr.open_dataset(base_path + filepath)
+
+        if get_overview_names(grid['overview_factor'])['CMI'] in goes_dataset:
+            names = get_overview_names(grid['overview_factor'])
+            block_factor = 1
+        else:
+            names = get_overview_names(1)
+            block_factor = grid['overview_factor']
+
+        y_first, y_last = grid['y_first'] * block_factor, (grid['y_last'] + 1) * block_factor - 1
+        x_first, x_last = grid['x_first'] * block_factor, (grid['x_last'] + 1) * block_factor - 1
+
+        if goes_dataset.sizes[names['x']] > x_last and goes_dataset.sizes[names['y']] > y_last \
+          and np.isclose(goes_dataset[names['x']][x_first:x_first+block_factor].values.mean(), grid['x'][0],
+                         rtol = 0, atol = 1e-6) \
+          and np.isclose(goes_dataset[names['y']][y_first:y_first+block_factor].values.mean(), grid['y'][0],
+                         rtol = 0, atol = 1e-6):
+            image_array = goes_dataset[names['CMI']][y_first:y_last+1, x_first:x_last+1].values
+            if block_factor > 1:
+                block_sums, block_counts = sum_blocks(image_array, None, block_factor,
+                                                      len(grid['y']), len(grid['x']))
+                with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                    image_array = np.where(block_counts > 0, block_sums / block_counts, np.nan)
+            image_arrays[index_time] = image_array[::downsampling_factor, ::downsampling_factor]
+        else:
+            print('grid of {} differs from the first file, set to nan'.format(filepath))
+        goes_dataset.close()
+        record_file_access(base_path, filepath)
+
+    return image_arrays
@@ -5,7 +5,7 @@
 ###                                                                                                                  ###
 ###  Author: Marco Wurth, July 2021                                                                                  ###
 ###  Tested with Python 3.9 and Fedora Linux                                                                         ###
-###  Non-standard packages needed: None                                                                              ###
+###  Non-standard packages needed: boto3, numpy                                                                      ###
 ###                                                                                                                  ###
 ###  Usage:                                                                                                          ###
 ###   1) Execute in terminal folder>python plot_abi.py                                                               ###
@@ -16,12 +16,19 @@
 import sys
 import datetime
 
+import numpy as np
+
 base_path = ''
 sys.path.append(base_path + 'scripts')
 
 from goes.load_abi_data_calc_coords import load_data_single_band, load_data_band_combination
 from goes.calc_image import calculate_rv_or_bt, calculate_band_difference, calculate_ndvi
 from goes.plot_image import plot_image
+from goes.s3_inventory import get_latest_scan
+from goes.abi_planner import expand_date_lists
+from goes.abi_information import get_band_info
+from goes.abi_fixed_grid import calc_pixel_size
+from general.domain_definitions import get_image_domain
 
 
 def plot_abi():
@@ -38,39 +45,44 @@ def plot_abi():
     #region = 'atacama_squared'
 
 
-    # get latest available image time #
+    # plot the latest available scan or a specified time #
+    #  the s3 inventory is only listed for the latest scan (of any band), it is estimated if s3 is offline #
 
-    if product == 'L2-CMIPF':
-        timediff_minutes = 20   # if not enough raise to 30min
-        datetime_now = datetime.datetime.utcnow()
-        datetime_latest = datetime_now - datetime.timedelta(
-                            seconds = (datetime_now.minute % 10 + timediff_minutes) * 60 + datetime_now.second)
-    elif product == 'L2-CMIPM1' or product == 'L2-CMIPM2':
-        timediff_minutes = 2
+    #latest_exec = True
+    latest_exec = False
+
+    if latest_exec:
         datetime_now = datetime.datetime.utcnow()
-        datetime_latest = datetime_now - datetime.timedelta(seconds = timediff_minutes * 60 + datetime_now.second)
+        datetime_latest = get_latest_scan(base_path, product, None, datetime_now)
 
-    print('now:'.ljust(8), datetime_now)
-    print('latest:'.ljust(8), datetime_latest)
+        print('now:'.ljust(8), datetime_now)
+        print('latest:'.ljust(8), datetime_latest)
 
-    year = datetime_latest.year
-    month = datetime_latest.month
-    days = [datetime_latest.day]
-    hours = [datetime_latest.hour]
-    minutes = [datetime_latest.minute]
+        year = datetime_latest.year
+        month = datetime_latest.month
+        days = [datetime_latest.day]
+        hours = [datetime_latest.hour]
+        minutes = [datetime_latest.minute]
+
+    else:
+        year = 2021
+        month = 4
+        days = [25]
+        #days = list(range(1, 31))
+        #hours = list(range(0, 10))
+        #hours = list(range(12, 17))
+        #minutes = list(range(0, 60, 10))
+        hours = [17]
+        minutes = [0]
 
+    dates_data_file = expand_date_lists(year, month, days, hours, minutes)
 
-    # override latest time with specified time #
 
-    #year = 2021
-    #month = 4
-    days = [25]
-    #days = list(range(1, 31))
-    #hours = list(range(0, 10))
-    #hours = list(range(12, 17))
-    #minutes = list(range(0, 60, 10))
-    hours = [17]
-    minutes = [0]
+    # or plot a date range, also across months, with the scan times of the product, see plan_scan_times in abi_planner #
+
+    #dates_data_file = plan_scan_times(product, datetime.datetime(2021, 3, 28, 12, 0),
+    #                                  datetime.datetime(2021, 4, 2, 12, 0), step = datetime.timedelta(hours = 1),
+    #                                  cron = dict(hours = list(range(6, 16))))
 
 
     # set plot mode #
@@ -127,10 +139,13 @@ def plot_abi():
     resolution = 1000
 
 
-    # set downsampling factor (via nearest neighbor regridding), 1 means downsampling is skipped #
+    # set downsampling factor (via overview levels and nearest neighbor regridding), 1 means downsampling is skipped #
+    #  'auto' takes the largest power of two that still leaves 1-2 data cells per image pixel, derived from the #
+    #  domain radius, the resolution above and the pixel size of the band at the domain center #
 
     #downsampling_factor = 1
     downsampling_factor = 4
+    #downsampling_factor = 'auto'
 
 
     # set data normalization method, only applied if vis single-band used #
@@ -190,74 +205,95 @@ def plot_abi():
 
     # serial execution #
 
-    for day in days:
-        for hour in hours:
-            for minute in minutes:
-
-                if mode == 'single_band':
-                    for band in bands:
-                        for domain_name in domain_names:
-                            date_data_file = datetime.datetime(year, month, day, hour, minute)
-                            print('plot:'.ljust(8), date_data_file, 'band:', band, 'domain:', domain_name)
-
-                            date_sensed, path, sat, domain, downsampling_str, lons, lats, image_array \
-                             = load_data_single_band(
-                                   base_path, product, region, mode, band,
-                                   date_data_file, sensing_timedelta,
-                                   domain_name, downsampling_factor)
-
-                            image_array = calculate_rv_or_bt(
-                                band, normalization, date_sensed, lons, lats, image_array)
-
-                            plot_image(
-                                   path, mode, band, date_sensed, sat, lons, lats, image_array,
-                                   domain, projection, resolution, downsampling_str, normalization,
-                                   colorpalette, cmap_reversed, cmap_range_min, cmap_range_max, cmap_num_colors_between,
-                                   missing_value_color, border_color, gridlines_on, render_type)
-
-                elif mode == 'band_difference':
-                    for band_combination in band_combinations:
-                        for domain_name in domain_names:
-                            date_data_file = datetime.datetime(year, month, day, hour, minute)
-                            print('plot:'.ljust(8), date_data_file, 'band_combination', band_combination, 'domain:', domain_name)
-
-                            date_sensed, path, sat, domain, downsampling_str, \
-                            lons, lats, image_array_A, image_array_B \
-                             = load_data_band_combination(
-                                   base_path, product, region, mode, band_combination,
-                                   date_data_file, sensing_timedelta,
-                                   domain_name, downsampling_factor)
-
-                            image_array = calculate_band_difference(image_array_A, image_array_B)
-
-                            plot_image(
-                                   path, mode, band_combination, date_sensed, sat, lons, lats, image_array,
-                                   domain, projection, resolution, downsampling_str, normalization,
-                                   colorpalette, cmap_reversed, cmap_range_min, cmap_range_max, cmap_num_colors_between,
-                                   missing_value_color, border_color, gridlines_on, render_type)
-
-                elif mode == 'ndvi':
-                    for domain_name in domain_names:
-                        date_data_file = datetime.datetime(year, month, day, hour, minute)
-                        print('plot:'.ljust(8), date_data_file, 'ndvi', 'domain:', domain_name)
-
-                        date_sensed, path, sat, domain, downsampling_str, \
-                        lons, lats, image_array_A, image_array_B \
-                         = load_data_band_combination(
-                               base_path, product, region, mode, band_combination,
-                               date_data_file, sensing_timedelta,
-                               domain_name, downsampling_factor)
-
-                        image_array = calculate_ndvi(image_array_A, image_array_B)
-
-                        plot_image(
-                               path, mode, band_combination, date_sensed, sat, lons, lats, image_array,
-                               domain, projection, resolution, downsampling_str, normalization,
-                               colorpalette, cmap_reversed, cmap_range_min, cmap_range_max, cmap_num_colors_between,
-                               missing_value_color, border_color, gridlines_on, render_type)
+    for date_data_file in dates_data_file:
+
+        if mode == 'single_band':
+            for band in bands:
+                for domain_name in domain_names:
+                    print('plot:'.ljust(8), date_data_file, 'band:', band, 'domain:', domain_name)
+
+                    date_sensed, path, sat, domain, downsampling_str, lons, lats, image_array \
+                     = load_data_single_band(
+                           base_path, product, region, mode, band,
+                           date_data_file, sensing_timedelta,
+                           domain_name, get_downsampling_factor(downsampling_factor, domain_name, resolution, [band]))
+
+                    image_array = calculate_rv_or_bt(
+                        band, normalization, date_sensed, lons, lats, image_array)
+
+                    plot_image(
+                           path, mode, band, date_sensed, sat, lons, lats, image_array,
+                           domain, projection, resolution, downsampling_str, normalization,
+                           colorpalette, cmap_reversed, cmap_range_min, cmap_range_max, cmap_num_colors_between,
+                           missing_value_color, border_color, gridlines_on, render_type)
+
+        elif mode == 'band_difference':
+            for band_combination in band_combinations:
+                for domain_name in domain_names:
+                    print('plot:'.ljust(8), date_data_file, 'band_combination', band_combination, 'domain:', domain_name)
+
+                    date_sensed, path, sat, domain, downsampling_str, \
+                    lons, lats, image_array_A, image_array_B \
+                     = load_data_band_combination(
+                           base_path, product, region, mode, band_combination,
+                           date_data_file, sensing_timedelta,
+                           domain_name, get_downsampling_factor(downsampling_factor, domain_name, resolution,
+                                                                band_combination))
+
+                    image_array = calculate_band_difference(image_array_A, image_array_B)
+
+                    plot_image(
+                           path, mode, band_combination, date_sensed, sat, lons, lats, image_array,
+                           domain, projection, resolution, downsampling_str, normalization,
+                           colorpalette, cmap_reversed, cmap_range_min, cmap_range_max, cmap_num_colors_between,
+                           missing_value_color, border_color, gridlines_on, render_type)
+
+        elif mode == 'ndvi':
+            for domain_name in domain_names:
+                print('plot:'.ljust(8), date_data_file, 'ndvi', 'domain:', domain_name)
+
+                date_sensed, path, sat, domain, downsampling_str, \
+                lons, lats, image_array_A, image_array_B \
+                 = load_data_band_combination(
+                       base_path, product, region, mode, band_combination,
+                       date_data_file, sensing_timedelta,
+                       domain_name, get_downsampling_factor(downsampling_factor, domain_name, resolution,
+                                                            band_combination))
+
+                image_array = calculate_ndvi(image_array_A, image_array_B)
+
+                plot_image(
+                       path, mode, band_combination, date_sensed, sat, lons, lats, image_array,
+                       domain, projection, resolution, downsampling_str, normalization,
+                       colorpalette, cmap_reversed, cmap_range_min, cmap_range_max, cmap_num_colors_between,
+                       missing_value_color, border_color, gridlines_on, render_type)
 
     return
 
+########################################################################################################################
+########################################################################################################################
+########################################################################################################################
+
+def get_downsampling_factor(downsampling_factor, domain_name, resolution, bands):
+
+    # returns the downsampling factor as set or, for 'auto', the largest power of two with at least one data cell #
+    #  per image pixel, i.e. 1-2 cells per pixel across the domain width of 2 * radius km and resolution pixels #
+    #  the data cell size is the pixel size of the finest band at the domain center, larger off nadir #
+
+    if downsampling_factor != 'auto':
+        return downsampling_factor
+
+    domain = get_image_domain(domain_name)
+    resolution_nadir = min([get_band_info(band, 'resolution_nadir') for band in bands])
+    pixel_size = calc_pixel_size(domain['centerlat'], domain['centerlon'], resolution_nadir)
+
+    cells_per_pixel = 2 * domain['radius'] / resolution / pixel_size
+    downsampling_factor = 2**int(np.floor(np.log2(max(cells_per_pixel, 1))))
+
+    print('auto downsampling: {:.1f} data cells per pixel, factor {:d}'.format(cells_per_pixel, downsampling_factor))
+
+    return downsampling_factor
+
 ############################################################################
 ############################################################################
 ############################################################################
@@ -30,6 +30,7 @@ from PIL import Image
 
 from general.make_my_colormap import generate_cmap
 from goes.abi_information import get_band_info
+from goes.abi_quota import record_file_access
 
 ########################################################################################################################
 #  Plotting part                                                                                                       #
@@ -113,6 +114,17 @@ def plot_image(
         ext_regular = [domain_limits['lon_min'], domain_limits['lon_max'],
                        domain_limits['lat_min'], domain_limits['lat_max']]
 
+    elif domain['limits_type'] == 'latlon':
+        domain_limits = dict(lat_min = domain['lat_min'], lat_max = domain['lat_max'],
+                             lon_min = domain['lon_min'], lon_max = domain['lon_max'])
+
+        ext_regular = [domain_limits['lon_min'], domain_limits['lon_max'],
+                       domain_limits['lat_min'], domain_limits['lat_max']]
+
+    else:
+        print('domain limits_type {} not supported yet!'.format(domain['limits_type']))
+        exit()
+
 
     # create needed cartopy projections for the map and the pcolormesh() function #
 
@@ -271,6 +283,7 @@ def plot_image(
         im.close()
         im_cropped.save(path['base'] + path['image'] + imagename, 'png')
         im_cropped.close()
+        record_file_access(path['base'], path['image'] + imagename)
 
         return
 
@@ -0,0 +1,138 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This module uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: h5py                                                                              ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   This module provides read access to single S3 objects via ranged GET requests                                  ###
+###   S3RangeFile is a seekable file object for h5py/h5netcdf that only fetches the blocks that are actually read    ###
+###   prefetch_chunks reads the HDF5 chunk index of netcdf4 variables and fetches only the compressed chunks that    ###
+###    intersect a y/x index box with a few coalesced and parallel ranged GET requests                               ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   This module here containes functions that have to be imported by another function or script                    ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import io
+import concurrent.futures
+
+import h5py
+
+
+class S3RangeFile(io.RawIOBase):
+
+    # seekable read-only file object of one S3 object, all reads are served from a cache of fixed-size blocks #
+    #  missing blocks are fetched with one ranged GET per contiguous run of blocks #
+
+    def __init__(self, s3_client, s3_bucket_name, s3_key, size, block_size = 128 * 1024):
+        self.s3_client = s3_client
+        self.s3_bucket_name = s3_bucket_name
+        self.s3_key = s3_key
+        self.size = size
+        self.block_size = block_size
+        self.blocks = dict()
+        self.position = 0
+        self.num_requests = 0
+        self.bytes_fetched = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+
+        block_first = self.position // self.block_size
+        block_last = (self.position + length - 1) // self.block_size
+        self.fetch_blocks(block_first, block_last)
+
+        data = b''.join([self.blocks[block] for block in range(block_first, block_last + 1)])
+        start = self.position - block_first * self.block_size
+        buffer[:length] = data[start : start + length]
+        self.position += length
+
+        return length
+
+    def fetch_blocks(self, block_first, block_last):
+
+        # fetch all missing blocks between block_first and block_last (inclusive) #
+
+        missing_blocks = [block for block in range(block_first, block_last + 1) if block not in self.blocks]
+        if len(missing_blocks) > 0:
+            self.fetch_range(missing_blocks[0] * self.block_size,
+                             min((missing_blocks[-1] + 1) * self.block_size, self.size))
+
+    def fetch_range(self, byte_first, byte_end):
+
+        # fetch the block-aligned byte range [byte_first, byte_end) with a single ranged GET and cache its blocks #
+
+        response = self.s3_client.get_object(Bucket = self.s3_bucket_name, Key = self.s3_key,
+                                             Range = 'bytes={:d}-{:d}'.format(byte_first, byte_end - 1))
+        data = response['Body'].read()
+        self.num_requests += 1
+        self.bytes_fetched += len(data)
+
+        for i in range(0, len(data), self.block_size):
+            self.blocks[(byte_first + i) // self.block_size] = data[i : i + self.block_size]
+
+########################################################################################################################
+#  Chunk prefetching                                                                                                   #
+########################################################################################################################
+
+def prefetch_chunks(range_file, variable_names, y_first, y_end, x_first, x_end, max_gap = 256 * 1024,
+                    num_threads = 8):
+
+    # read the chunk index of all (y, x) variables and fetch all chunks intersecting the index box in parallel #
+    #  byte ranges closer than max_gap are coalesced into one request #
+
+    chunk_ranges = []
+    with h5py.File(range_file, 'r') as h5_file:
+        for variable_name in variable_names:
+            dataset_id = h5_file[variable_name].id
+            chunk_shape = h5_file[variable_name].chunks
+            if chunk_shape is None:
+                offset = dataset_id.get_offset()
+                if offset is not None:
+                    chunk_ranges.append((offset, offset + dataset_id.get_storage_size()))
+                continue
+
+            for chunk_y in range(y_first // chunk_shape[0] * chunk_shape[0], y_end, chunk_shape[0]):
+                for chunk_x in range(x_first // chunk_shape[1] * chunk_shape[1], x_end, chunk_shape[1]):
+                    chunk_info = dataset_id.get_chunk_info_by_coord((chunk_y, chunk_x))
+                    if chunk_info.byte_offset is not None:
+                        chunk_ranges.append((chunk_info.byte_offset, chunk_info.byte_offset + chunk_info.size))
+
+    block_size = range_file.block_size
+    block_ranges = []
+    for byte_first, byte_end in sorted(chunk_ranges):
+        block_first = byte_first // block_size
+        block_last = (byte_end - 1) // block_size
+        if len(block_ranges) > 0 and (block_first - block_ranges[-1][1]) * block_size <= max_gap:
+            block_ranges[-1][1] = max(block_ranges[-1][1], block_last)
+        else:
+            block_ranges.append([block_first, block_last])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = num_threads) as executor:
+        list(executor.map(lambda block_range: range_file.fetch_blocks(*block_range), block_ranges))
+
+    return
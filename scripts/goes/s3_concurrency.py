@@ -0,0 +1,209 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This module uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: botocore                                                                          ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   ConcurrencyController adapts the number of downloads in flight to the observed throughput and errors: it adds  ###
+###    or removes one download as long as the bytes/s keep growing and halves the number on throttling, so the same  ###
+###    settings work on a slow laptop link and on a fast server                                                      ###
+###   call_with_backoff retries throttling and transient errors after a jittered exponential delay                   ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   This module here containes functions that have to be imported by another function or script                    ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import time
+import random
+import threading
+import collections
+
+import botocore.exceptions
+
+
+# s3 error codes that mean too many requests and those that are worth a retry #
+
+throttling_error_codes = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequests',
+                          '429', '503'}
+transient_error_codes = {'RequestTimeout', 'RequestTimeTooSkewed', 'InternalError', 'ServiceUnavailable',
+                         '500', '502', '504'}
+
+
+class ConcurrencyController:
+
+    # thread-safe limit of the downloads in flight between num_min and num_max #
+    #  every finished or failed download is recorded and the limit is adapted by one step once per adjust interval: #
+    #  the last step is repeated if the throughput grew by more than 5% and reversed if it dropped by more than 5%, #
+    #  a constant throughput means one download less, so the limit oscillates around the smallest number of #
+    #  downloads that saturates the link, it is halved on throttling and on failure rates above 10% #
+    #  with adaptive = False the limit stays at num_max and only the statistics are kept #
+
+    def __init__(self, num_min, num_max, num_start = 8, adaptive = True, window_seconds = 30.0):
+        self.num_min = num_min
+        self.num_max = num_max
+        self.adaptive = adaptive
+        self.limit = min(max(num_start, num_min), num_max) if adaptive else num_max
+        self.window_seconds = window_seconds
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.time_start = time.time()
+        self.time_adjusted = self.time_start
+        self.throughput_adjusted = None
+        self.step = 1
+        self.samples = collections.deque()
+        self.counts = collections.Counter()
+
+    def acquire(self):
+
+        # block until one more download fits into the current limit #
+
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def record(self, seconds, num_bytes, num_retries = 0, num_throttled = 0, error = None):
+
+        # record one finished (error None) or failed download and adapt the limit #
+
+        error_class = None if error is None else classify_error(error)
+
+        with self.condition:
+            time_now = time.time()
+            self.samples.append((time_now, seconds, num_bytes, error_class))
+            while self.samples[0][0] < time_now - self.window_seconds:
+                self.samples.popleft()
+
+            self.counts['finished' if error is None else 'failed'] += 1
+            self.counts['bytes'] += num_bytes if error is None else 0
+            self.counts['retries'] += num_retries
+            self.counts['throttled'] += num_throttled
+            if error is not None:
+                self.counts[error_class] += 1
+
+            if not self.adaptive:
+                return
+
+            # decrease multiplicatively at most once per second, a burst of errors counts only once #
+            #  fatal errors like missing files say nothing about the load and are not counted #
+
+            throttled = num_throttled > 0 or error_class == 'throttling'
+            num_failed = len([sample for sample in self.samples if sample[3] in ['throttling', 'transient']])
+
+            if (throttled or num_failed > 0.1 * len(self.samples)) and self.time_adjusted < time_now - 1.0:
+                self.set_limit(self.limit // 2, time_now)
+                self.throughput_adjusted = None
+                self.step = 1
+
+            # every limit-th download after the last adjustment, but at least after 2 seconds, #
+            #  compare the throughput since then with the throughput before #
+
+            elif len([sample for sample in self.samples if sample[0] > self.time_adjusted]) >= self.limit \
+              and time_now - self.time_adjusted >= 2.0:
+                throughput = self.calc_throughput(self.time_adjusted, time_now)
+                if self.throughput_adjusted is None or throughput > 1.05 * self.throughput_adjusted:
+                    step = self.step
+                elif throughput < 0.95 * self.throughput_adjusted:
+                    step = -self.step
+                else:
+                    step = -1
+                self.step = step
+                self.set_limit(self.limit + step, time_now)
+                self.throughput_adjusted = throughput
+
+    def set_limit(self, limit, time_now):
+        self.limit = min(max(limit, self.num_min), self.num_max)
+        self.time_adjusted = time_now
+        self.condition.notify_all()
+
+    def calc_throughput(self, time_first, time_last):
+
+        # bytes/s of the downloads finished in the time interval #
+
+        num_bytes = sum([sample[2] for sample in self.samples
+                         if time_first < sample[0] <= time_last and sample[3] is None])
+
+        return num_bytes / max(time_last - time_first, 1e-3)
+
+    def get_stats(self):
+
+        # returns current limit, downloads in flight, files/s, bytes/s and mean seconds per file of the last window #
+        #  and the total counts of finished and failed files, bytes, retries and errors #
+
+        with self.condition:
+            time_now = time.time()
+            window = min(self.window_seconds, max(time_now - self.time_start, 1e-3))
+            samples_finished = [sample for sample in self.samples
+                                if sample[3] is None and sample[0] > time_now - window]
+            stats = dict(limit = self.limit,
+                         in_flight = self.in_flight,
+                         files_per_s = len(samples_finished) / window,
+                         bytes_per_s = sum([sample[2] for sample in samples_finished]) / window,
+                         mean_seconds = sum([sample[1] for sample in samples_finished]) / max(len(samples_finished), 1))
+            for count in ['finished', 'failed', 'bytes', 'retries', 'throttled', 'transient', 'fatal']:
+                stats[count] = self.counts[count]
+
+        return stats
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return 'concurrency {:d} ({:d} in flight), {:.2f} files/s, {:.1f} MB/s, {:.1f}s per file, ' \
+               '{:d} finished, {:d} failed, {:d} retries, {:d} throttled'.format(
+                stats['limit'], stats['in_flight'], stats['files_per_s'], stats['bytes_per_s'] / 1024**2,
+                stats['mean_seconds'], stats['finished'], stats['failed'], stats['retries'], stats['throttled'])
+
+########################################################################################################################
+#  Backoff                                                                                                             #
+########################################################################################################################
+
+def classify_error(exception):
+
+    # returns 'throttling', 'transient' or 'fatal', only throttling and transient errors are retried #
+
+    if isinstance(exception, botocore.exceptions.ClientError):
+        error_code = str(exception.response.get('Error', {}).get('Code', ''))
+        status_code = str(exception.response.get('ResponseMetadata', {}).get('HTTPStatusCode', ''))
+        if error_code in throttling_error_codes or status_code in throttling_error_codes:
+            return 'throttling'
+        elif error_code in transient_error_codes or status_code in transient_error_codes:
+            return 'transient'
+        else:
+            return 'fatal'
+
+    elif isinstance(exception, (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError,
+                                botocore.exceptions.IncompleteReadError, ConnectionError, TimeoutError)):
+        return 'transient'
+
+    else:
+        return 'fatal'
+
+########################################################################################################################
+
+def call_with_backoff(function, args, max_attempts, base_delay = 1.0, max_delay = 60.0):
+
+    # call function(*args) up to max_attempts times and return its result, the number of retries and throttled calls #
+    #  before every retry the caller sleeps a random time between 0 and base_delay * 2**attempt (full jitter), #
+    #  so many threads hitting the same throttling limit do not retry in lockstep, fatal errors are raised at once #
+
+    num_throttled = 0
+    for attempt in range(max_attempts):
+        try:
+            return function(*args), attempt, num_throttled
+        except Exception as exception:
+            error_class = classify_error(exception)
+            if error_class == 'fatal' or attempt == max_attempts - 1:
+                raise
+            if error_class == 'throttling':
+                num_throttled += 1
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            print('retry in {:.1f}s after {} error: {!r}'.format(delay, error_class, exception))
+            time.sleep(delay)
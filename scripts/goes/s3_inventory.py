@@ -0,0 +1,291 @@
+########################################################################################################################
+###                                                                                                                  ###
+###  This module uses a width of max. 120 characters                                                                 ###
+###                                                                                                                  ###
+###  Author: Marco Wurth, July 2021                                                                                  ###
+###  Tested with Python 3.9 and Fedora Linux                                                                         ###
+###  Non-standard packages needed: boto3                                                                             ###
+###                                                                                                                  ###
+###  Content:                                                                                                        ###
+###   This module keeps a local SQLite inventory of the object keys in the noaa-goes16 S3 bucket                     ###
+###   The files of every band in an hourly folder ABI-<product>/<year>/<doy>/<hour> are listed incrementally         ###
+###    (StartAfter the last known key) and never again once the hour is old enough, downloads then look up their     ###
+###    object key with an indexed query instead of listing the whole folder for every single file                    ###
+###   The anonymous s3 client shared by all download and plot scripts is created here as well                        ###
+###                                                                                                                  ###
+###  Usage:                                                                                                          ###
+###   This module here containes functions that have to be imported by another function or script                    ###
+###                                                                                                                  ###
+########################################################################################################################
+
+import os
+import re
+import datetime
+import sqlite3
+import threading
+
+from boto3.session import Session       # provides access to the Amazon Simple Storage Service (Amazon S3)
+from botocore import UNSIGNED
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from goes.abi_information import get_scan_mode
+
+
+# settings of the shared anonymous s3 client #
+#  max_pool_connections has to be at least the number of threads per worker times the transfer max_concurrency #
+
+s3_bucket_name = 'noaa-goes16'
+s3_client_config = Config(signature_version = UNSIGNED,
+                          max_pool_connections = 64,
+                          connect_timeout = 10,
+                          read_timeout = 60,
+                          retries = dict(max_attempts = 5, mode = 'standard'))
+
+s3_clients = dict()
+s3_clients_lock = threading.Lock()
+
+
+# an hourly prefix is complete and never listed again once its hour ended this long ago #
+
+prefix_complete_delay = datetime.timedelta(hours = 1)
+
+filename_pattern = re.compile(r'OR_ABI-(L2-CMIP[FCM]\d?)-M(\d)C(\d{2})_G16_s(\d{13})\d_e(\d{13})\d_c\d{14}\.nc$')
+
+prefix_locks = dict()
+prefix_locks_lock = threading.Lock()
+
+########################################################################################################################
+
+def get_s3_client():
+
+    # return the anonymous s3 client of this process and create it on first use #
+    #  botocore clients are thread-safe, so all threads of a worker share one client and its connection pool #
+    #  the client is created from its own session under a lock, concurrent creation from the default session is #
+    #  what caused the KeyError('endpoint_resolver') and KeyError('credential_provider') errors in the past #
+    #  the process id is part of the key so that forked worker processes never reuse the client of their parent #
+
+    pid = os.getpid()
+    with s3_clients_lock:
+        if pid not in s3_clients:
+            s3_clients[pid] = Session().client('s3', config = s3_client_config)
+
+    return s3_clients[pid]
+
+########################################################################################################################
+#  Database handling                                                                                                   #
+########################################################################################################################
+
+def open_inventory(base_path):
+
+    # every caller opens its own connection, sqlite connections can not be shared between threads #
+
+    connection = sqlite3.connect(base_path + 'data/ABI/GOES-16/s3_inventory.sqlite', timeout = 60)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('''CREATE TABLE IF NOT EXISTS objects (
+                              key TEXT PRIMARY KEY,
+                              product TEXT NOT NULL,
+                              band INTEGER NOT NULL,
+                              scan_start TEXT NOT NULL,
+                              scan_end TEXT NOT NULL,
+                              size INTEGER NOT NULL)''')
+    connection.execute('CREATE INDEX IF NOT EXISTS objects_scan ON objects (product, band, scan_start)')
+    connection.execute('''CREATE TABLE IF NOT EXISTS prefixes (
+                              prefix TEXT PRIMARY KEY,
+                              last_key TEXT,
+                              complete INTEGER NOT NULL DEFAULT 0,
+                              listed TEXT)''')
+
+    return connection
+
+########################################################################################################################
+
+def get_listing_prefix(product_fullname, band, date):
+
+    # returns the prefix of all files of one product and band in an hourly folder ABI-<product>/<year>/<doy>/<hour> #
+    #  keys in the hourly folder are sorted by product, scan mode and band first and only then by scan time, #
+    #  so the listing prefix has to contain the band for StartAfter the last key to find all new files #
+
+    dayofyear = (date - datetime.datetime(date.year, 1, 1)).days + 1
+
+    return 'ABI-{}/{:4d}/{:03d}/{:02d}/OR_ABI-{}-M{:d}C{:02d}_'.format(
+            product_fullname[:8], date.year, dayofyear, date.hour, product_fullname, get_scan_mode(date), band)
+
+########################################################################################################################
+
+def parse_object_key(key):
+
+    # returns product_fullname, band, scan start and scan end time of an object key or None for unknown keys #
+
+    match = filename_pattern.search(key)
+    if match is None:
+        return None
+
+    product_fullname, scan_mode, band, scan_start, scan_end = match.groups()
+
+    return product_fullname, int(band), \
+           datetime.datetime.strptime(scan_start, '%Y%j%H%M%S'), \
+           datetime.datetime.strptime(scan_end, '%Y%j%H%M%S')
+
+########################################################################################################################
+#  Incremental listing                                                                                                 #
+########################################################################################################################
+
+def update_inventory_hour(base_path, s3_client, s3_bucket_name, product_fullname, band, date):
+
+    # list only the keys after the last known key of this band in the hourly folder and store them #
+    #  returns the number of new objects, complete prefixes are not listed again #
+
+    prefix = get_listing_prefix(product_fullname, band, date)
+
+    with prefix_locks_lock:
+        if prefix not in prefix_locks:
+            prefix_locks[prefix] = threading.Lock()
+
+    with prefix_locks[prefix]:
+        connection = open_inventory(base_path)
+        row = connection.execute('SELECT last_key, complete FROM prefixes WHERE prefix = ?', (prefix,)).fetchone()
+        if row is not None and row[1]:
+            connection.close()
+            return 0
+
+        list_kwargs = dict(Bucket = s3_bucket_name, Prefix = prefix)
+        if row is not None and row[0] is not None:
+            list_kwargs['StartAfter'] = row[0]
+
+        datetime_listed = datetime.datetime.utcnow()
+        last_key = None if row is None else row[0]
+        new_objects = []
+        for page in s3_client.get_paginator('list_objects_v2').paginate(**list_kwargs):
+            for object in page.get('Contents', []):
+                last_key = object['Key']
+                key_info = parse_object_key(object['Key'])
+                if key_info is not None:
+                    new_objects.append((object['Key'], key_info[0], key_info[1],
+                                        key_info[2].isoformat(), key_info[3].isoformat(), object['Size']))
+
+        hour_end = datetime.datetime(date.year, date.month, date.day, date.hour) + datetime.timedelta(hours = 1)
+        complete = int(datetime_listed - hour_end > prefix_complete_delay)
+
+        with connection:
+            connection.executemany('INSERT OR IGNORE INTO objects VALUES (?, ?, ?, ?, ?, ?)', new_objects)
+            connection.execute('INSERT OR REPLACE INTO prefixes VALUES (?, ?, ?, ?)',
+                               (prefix, last_key, complete, datetime_listed.isoformat()))
+        connection.close()
+
+    return len(new_objects)
+
+########################################################################################################################
+#  Queries                                                                                                             #
+########################################################################################################################
+
+def find_s3_object(base_path, s3_client, s3_bucket_name, product_fullname, band, date):
+
+    # returns key and size of the file with a scan start within the minute of date or None if it doesn't exist #
+    #  the prefix is only listed if the object is not yet in the inventory #
+
+    scan_start_min = datetime.datetime(date.year, date.month, date.day, date.hour, date.minute)
+    scan_start_max = scan_start_min + datetime.timedelta(minutes = 1)
+    query = 'SELECT key, size FROM objects WHERE product = ? AND band = ? AND scan_start >= ? AND scan_start < ?'
+    query_args = (product_fullname, band, scan_start_min.isoformat(), scan_start_max.isoformat())
+
+    connection = open_inventory(base_path)
+    row = connection.execute(query, query_args).fetchone()
+    connection.close()
+
+    if row is None:
+        if update_inventory_hour(base_path, s3_client, s3_bucket_name, product_fullname, band, date) > 0:
+            connection = open_inventory(base_path)
+            row = connection.execute(query, query_args).fetchone()
+            connection.close()
+
+    return row
+
+########################################################################################################################
+
+def find_latest_scan(base_path, s3_client, s3_bucket_name, product_fullname, bands, datetime_now, num_hours = 3):
+
+    # returns the latest scan start time (cut to minutes) for which files of all bands are available #
+    #  if bands is None the latest scan of any band is returned, the last num_hours prefixes are updated first #
+
+    for hour in range(num_hours):
+        for band in (range(1, 16+1) if bands is None else bands):
+            update_inventory_hour(base_path, s3_client, s3_bucket_name, product_fullname, band,
+                                  datetime_now - datetime.timedelta(hours = hour))
+
+    if bands is None:
+        query = 'SELECT substr(scan_start, 1, 16) AS scan_minute FROM objects WHERE product = ? AND scan_start >= ? ' \
+                'ORDER BY scan_minute DESC LIMIT 1'
+        query_args = (product_fullname, (datetime_now - datetime.timedelta(hours = num_hours)).isoformat())
+    else:
+        query = 'SELECT substr(scan_start, 1, 16) AS scan_minute FROM objects ' \
+                'WHERE product = ? AND band IN ({}) AND scan_start >= ? ' \
+                'GROUP BY scan_minute HAVING COUNT(DISTINCT band) = ? ' \
+                'ORDER BY scan_minute DESC LIMIT 1'.format(','.join('?' * len(bands)))
+        query_args = (product_fullname, *bands, (datetime_now - datetime.timedelta(hours = num_hours)).isoformat(),
+                      len(set(bands)))
+
+    connection = open_inventory(base_path)
+    row = connection.execute(query, query_args).fetchone()
+    connection.close()
+
+    if row is None:
+        return None
+
+    return datetime.datetime.fromisoformat(row[0])
+
+########################################################################################################################
+
+def estimate_latest_scan(product_fullname, datetime_now):
+
+    # returns the scan time that is usually available at datetime_now, used if the s3 inventory can not be listed #
+
+    if product_fullname == 'L2-CMIPF':
+        timediff_minutes = 20   # if not enough raise to 30min
+        datetime_latest = datetime_now - datetime.timedelta(
+                            seconds = (datetime_now.minute % 10 + timediff_minutes) * 60 + datetime_now.second)
+    elif product_fullname == 'L2-CMIPM1' or product_fullname == 'L2-CMIPM2':
+        timediff_minutes = 2
+        datetime_latest = datetime_now - datetime.timedelta(seconds = timediff_minutes * 60 + datetime_now.second)
+    else:
+        print('product_fullname not supported yet!')
+        exit()
+
+    return datetime_latest.replace(second = 0, microsecond = 0)
+
+########################################################################################################################
+
+def get_latest_scan(base_path, product_fullname, bands, datetime_now):
+
+    # returns the latest scan time from the s3 inventory, or the estimated one if s3 is not reachable or no scan of #
+    #  the bands is found in the last hours #
+
+    try:
+        datetime_latest = find_latest_scan(base_path, get_s3_client(), s3_bucket_name, product_fullname, bands,
+                                           datetime_now)
+    except (BotoCoreError, ClientError) as exception:
+        print('s3 inventory could not be updated ({}), estimate latest scan'.format(exception))
+        datetime_latest = None
+
+    if datetime_latest is None:
+        datetime_latest = estimate_latest_scan(product_fullname, datetime_now)
+
+    return datetime_latest
+
+########################################################################################################################
+
+def find_new_objects(base_path, product_fullnames, bands, scan_start_min):
+
+    # returns key, product, band, scan start, scan end and size of all objects with a scan start after scan_start_min #
+
+    query = 'SELECT key, product, band, scan_start, scan_end, size FROM objects ' \
+            'WHERE product IN ({}) AND band IN ({}) AND scan_start >= ? ORDER BY scan_start'.format(
+             ','.join('?' * len(product_fullnames)), ','.join('?' * len(bands)))
+
+    connection = open_inventory(base_path)
+    rows = connection.execute(query, (*product_fullnames, *bands, scan_start_min.isoformat())).fetchall()
+    connection.close()
+
+    return [(key, product_fullname, band,
+             datetime.datetime.fromisoformat(scan_start), datetime.datetime.fromisoformat(scan_end), size)
+            for key, product_fullname, band, scan_start, scan_end, size in rows]
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+
+# the scripts import each other as goes.* and general.* from the scripts folder #
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+
+@pytest.fixture
+def base_path(tmp_path):
+
+    # data folders like created by setup_paths.py, the modules expect base_path to end with a slash #
+
+    for product in ['L2-CMIPF', 'L2-CMIPM']:
+        os.makedirs(tmp_path / 'data/ABI/GOES-16' / product / 'temp')
+
+    return str(tmp_path) + '/'
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+
+    # empty noaa-goes16 bucket in moto, the anonymous client of s3_inventory is created again inside the mock #
+
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    from goes import s3_inventory
+
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.delenv('AWS_ENDPOINT_URL_S3', raising = False)
+    monkeypatch.delenv('AWS_ENDPOINT_URL', raising = False)
+
+    with moto.mock_aws():
+        s3_inventory.s3_clients.clear()
+        s3_client = boto3.client('s3', region_name = 'us-east-1')
+        s3_client.create_bucket(Bucket = s3_inventory.s3_bucket_name)
+        yield s3_client
+        s3_inventory.s3_clients.clear()
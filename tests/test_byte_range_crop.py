@@ -0,0 +1,96 @@
+import os
+import datetime
+
+import numpy as np
+import pytest
+
+xr = pytest.importorskip('xarray')
+pytest.importorskip('h5netcdf')
+pytest.importorskip('distributed')
+pytest.importorskip('boto3')
+pytest.importorskip('moto')
+
+from goes.download_abi import fetch_single_abi_file
+from goes.s3_inventory import s3_bucket_name, get_listing_prefix
+
+
+def write_full_disk_file(filepath, band, date):
+
+    # synthetic full-disk file with the dims, chunks and packing of a band 13 CMIP file, the values are exact in int16 #
+
+    num_pixels = 5424
+    dx = 56e-6
+    index_y, index_x = np.ogrid[0:num_pixels, 0:num_pixels]
+
+    # noise makes the chunks about as incompressible as real data, the values stay exact in int16 #
+
+    rng = np.random.default_rng(band)
+    cmi = (200.0 + (index_y % 97) * 0.5 + rng.integers(0, 1024, (num_pixels, num_pixels)) * 0.01).astype(np.float32)
+    cmi[3500:3550, 2600:2650] = np.nan
+    dqf = ((index_y + index_x) % 4).astype(np.int8)
+
+    dataset_full = xr.Dataset(
+        dict(CMI = (('y', 'x'), cmi),
+             DQF = (('y', 'x'), dqf),
+             goes_imager_projection = ((), np.int32(-2147483647),
+                                       dict(perspective_point_height = 35786023.0, semi_major_axis = 6378137.0,
+                                            semi_minor_axis = 6356752.31414, inverse_flattening = 298.2572221,
+                                            longitude_of_projection_origin = -75.0, sweep_angle_axis = 'x',
+                                            latitude_of_projection_origin = 0.0, grid_mapping_name = 'geostationary')),
+             band_id = ((), np.int8(band))),
+        coords = dict(x = ('x', -0.151844 + np.arange(num_pixels) * dx),
+                      y = ('y', 0.151844 - np.arange(num_pixels) * dx),
+                      t = ((), np.datetime64(date))))
+
+    dataset_full.to_netcdf(filepath, format = 'NETCDF4', encoding = dict(
+        CMI = dict(dtype = 'int16', scale_factor = 0.01, add_offset = 150.0, _FillValue = -1,
+                   zlib = True, chunksizes = (226, 226)),
+        DQF = dict(dtype = 'int8', _FillValue = -1, zlib = True, chunksizes = (226, 226)),
+        x = dict(dtype = 'int16', scale_factor = dx, add_offset = -0.151844),
+        y = dict(dtype = 'int16', scale_factor = -dx, add_offset = 0.151844)))
+
+    return
+
+
+def test_byte_range_crop_equals_full_file_crop(tmp_path, s3_bucket):
+
+    band = 13
+    date = datetime.datetime(2021, 4, 25, 17, 0)
+    region = 'atacama'
+
+    filepath_full = str(tmp_path / 'full_disk.nc')
+    write_full_disk_file(filepath_full, band, date)
+    s3_bucket.upload_file(filepath_full, s3_bucket_name, get_listing_prefix('L2-CMIPF', band, date) +
+                          'G16_s{:%Y%j%H%M}208_e{:%Y%j%H%M}577_c{:%Y%j%H%M}590.nc'.format(date, date, date),
+                          ExtraArgs = dict(ACL = 'public-read'))
+
+    datasets_region = dict()
+    fetched_bytes = dict()
+    for fetch_mode in ['full_file', 'memory', 'byte_range']:
+        base_path = str(tmp_path / fetch_mode) + '/'
+        os.makedirs(base_path + 'data/ABI/GOES-16/L2-CMIPF/temp')
+
+        filename, fetched_bytes[fetch_mode] = fetch_single_abi_file(base_path, 'L2-CMIPF', date, band, region,
+                                                                    False, fetch_mode)
+        datasets_region[fetch_mode] = xr.open_dataset(base_path + 'data/ABI/GOES-16/L2-CMIPF/b13/' + filename)
+
+    # only the byte range mode reads just the chunks of the region, the region is 2% of the full disk #
+
+    object_size = os.path.getsize(filepath_full)
+    assert fetched_bytes['full_file'] == object_size
+    assert fetched_bytes['memory'] == object_size
+    assert fetched_bytes['byte_range'] < 0.2 * object_size
+
+    for fetch_mode in ['memory', 'byte_range']:
+        for variable_name in ['CMI', 'DQF', 'x', 'y']:
+            np.testing.assert_array_equal(datasets_region[fetch_mode][variable_name].values,
+                                          datasets_region['full_file'][variable_name].values)
+
+    # the atacama region is y 3400-4400 and x 2550-3100 at 2km, with the nan block of the synthetic file inside #
+
+    assert datasets_region['byte_range']['CMI'].shape == (1000, 550)
+    assert np.isnan(datasets_region['byte_range']['CMI'].values).sum() == 50 * 50
+    assert datasets_region['byte_range']['DQF'].values[0, 0] == (3400 + 2550) % 4
+
+    for dataset_region in datasets_region.values():
+        dataset_region.close()
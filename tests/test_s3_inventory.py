@@ -0,0 +1,86 @@
+import datetime
+
+import pytest
+
+pytest.importorskip('boto3')
+pytest.importorskip('moto')
+
+from goes.s3_inventory import get_s3_client, s3_bucket_name, get_listing_prefix, update_inventory_hour, \
+                              find_s3_object, find_latest_scan, get_latest_scan, estimate_latest_scan
+
+
+def get_object_key(band, date, product_fullname = 'L2-CMIPF'):
+
+    # object key like in the bucket, full-disk scans end 9 minutes after their start #
+
+    date_end = date + datetime.timedelta(minutes = 9)
+    return get_listing_prefix(product_fullname, band, date) + \
+           'G16_s{:%Y%j%H%M}208_e{:%Y%j%H%M}577_c{:%Y%j%H%M}590.nc'.format(date, date_end, date_end)
+
+
+def put_object(s3_client, band, date, size = 16):
+
+    key = get_object_key(band, date)
+    s3_client.put_object(Bucket = s3_bucket_name, Key = key, Body = b'\0' * size)
+
+    return key
+
+
+def get_minute(datetime_now, minutes_before):
+
+    date = datetime_now - datetime.timedelta(minutes = minutes_before)
+    return datetime.datetime(date.year, date.month, date.day, date.hour, date.minute)
+
+
+def test_find_s3_object_lists_complete_hours_only_once(base_path, s3_bucket):
+
+    key = put_object(s3_bucket, 13, datetime.datetime(2021, 4, 25, 17, 0), size = 1234)
+
+    assert find_s3_object(base_path, get_s3_client(), s3_bucket_name, 'L2-CMIPF', 13,
+                          datetime.datetime(2021, 4, 25, 17, 0, 30)) == (key, 1234)
+    assert find_s3_object(base_path, get_s3_client(), s3_bucket_name, 'L2-CMIPF', 7,
+                          datetime.datetime(2021, 4, 25, 17, 0)) is None
+
+    # the hour ended long ago, so its prefix is complete and never listed again #
+
+    put_object(s3_bucket, 13, datetime.datetime(2021, 4, 25, 17, 10))
+    assert update_inventory_hour(base_path, get_s3_client(), s3_bucket_name, 'L2-CMIPF', 13,
+                                 datetime.datetime(2021, 4, 25, 17, 10)) == 0
+
+
+def test_update_inventory_hour_lists_only_new_keys(base_path, s3_bucket):
+
+    datetime_now = datetime.datetime.utcnow()
+    date = get_minute(datetime_now, 0).replace(minute = 0)
+
+    put_object(s3_bucket, 13, date)
+    assert update_inventory_hour(base_path, get_s3_client(), s3_bucket_name, 'L2-CMIPF', 13, date) == 1
+    assert update_inventory_hour(base_path, get_s3_client(), s3_bucket_name, 'L2-CMIPF', 13, date) == 0
+
+    key = put_object(s3_bucket, 13, date + datetime.timedelta(minutes = 1))
+    assert update_inventory_hour(base_path, get_s3_client(), s3_bucket_name, 'L2-CMIPF', 13, date) == 1
+    assert find_s3_object(base_path, get_s3_client(), s3_bucket_name, 'L2-CMIPF', 13,
+                          date + datetime.timedelta(minutes = 1))[0] == key
+
+
+def test_find_latest_scan_needs_all_bands(base_path, s3_bucket):
+
+    datetime_now = datetime.datetime.utcnow()
+    date_both = get_minute(datetime_now, 20)
+    date_b13 = get_minute(datetime_now, 10)
+
+    put_object(s3_bucket, 7, date_both)
+    put_object(s3_bucket, 13, date_both)
+    put_object(s3_bucket, 13, date_b13)
+
+    assert find_latest_scan(base_path, get_s3_client(), s3_bucket_name, 'L2-CMIPF', [7, 13],
+                            datetime_now) == date_both
+    assert find_latest_scan(base_path, get_s3_client(), s3_bucket_name, 'L2-CMIPF', None, datetime_now) == date_b13
+
+
+def test_get_latest_scan_is_estimated_without_files(base_path, s3_bucket):
+
+    datetime_now = datetime.datetime(2021, 4, 25, 17, 33, 12)
+
+    assert get_latest_scan(base_path, 'L2-CMIPF', [13], datetime_now) == datetime.datetime(2021, 4, 25, 17, 10)
+    assert estimate_latest_scan('L2-CMIPM1', datetime_now) == datetime.datetime(2021, 4, 25, 17, 31)